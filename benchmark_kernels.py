@@ -0,0 +1,312 @@
+"""
+Times the hot kernels over a grid of agent, poi, step and coupling counts
+and a full episode of specifics.getSim(), writes the results as JSON and
+optionally compares them with a stored baseline, flagging slowdowns.
+
+Kernels: doAgentSense() (all pairs and with a sensing radius),
+doAgentProcess(), doAgentProcessStacked(), doAgentMove(),
+assignGlobalReward(), assignDifferenceReward(), assignDppReward(),
+evolveCceaPolicies(), evolveCceaArrayPolicies() and "Episode" (one
+training and testing episode of getSim()).
+
+Usage:
+    python benchmark_kernels.py --output baseline.json
+        time every kernel on the full grid
+    python benchmark_kernels.py --quick --baseline baseline.json
+        time on a smaller grid and compare with the cases in baseline.json
+    python benchmark_kernels.py --compare current.json --baseline baseline.json
+        only compare two result files
+The exit status is 1 when a case is slower than the baseline by more than
+the threshold.
+"""
+import argparse
+import contextlib
+import datetime
+import errno
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import numpy as np
+import code.backend # Compiled or NumPy kernels (see code/backend.py)
+from code.agent_domain_2 import * # Rover Domain Dynamic
+from code.reward_2 import * # Agent Reward
+from code.ccea_2 import * # CCEA
+from benchmark_reward import getRandomRewardData
+from benchmark_sensing import getRandomSenseData
+
+fullGrid = {
+    "Number of Agents": [10, 100, 1000],
+    "Number of POIs": [8, 64, 256],
+    "Steps": [10, 100, 1000],
+    "Coupling": [1, 3, 6],
+    "Population Size": [50],
+    "Episodes": 3,
+}
+
+quickGrid = {
+    "Number of Agents": [10, 100],
+    "Number of POIs": [8, 64],
+    "Steps": [10, 100],
+    "Coupling": [1, 3],
+    "Population Size": [50],
+    "Episodes": 2,
+}
+
+def timeCall(func, minTotalTime = 0.2, maxTotalTime = 5.0, minRepeatCount = 3,
+        maxRepeatCount = 1000):
+    """
+    Calls func repeatedly and returns the list of call times. Stops after
+        minRepeatCount calls taking minTotalTime, or earlier (but after at
+        least one call) when calls take more than maxTotalTime in total.
+    """
+    timeCol = []
+    totalTime = 0.0
+    while len(timeCol) < maxRepeatCount:
+        startTime = time.perf_counter()
+        func()
+        callTime = time.perf_counter() - startTime
+        timeCol.append(callTime)
+        totalTime += callTime
+        if totalTime >= maxTotalTime:
+            break
+        if len(timeCol) >= minRepeatCount and totalTime >= minTotalTime:
+            break
+    return timeCol
+
+def getPolicyData(agentCount, poiCount, threadCount, seed = 0):
+    """
+    Get data for the sense, process and move kernels, with random Evo_MLP
+        policies
+    """
+    data = getRandomSenseData(agentCount, seed = seed, poiCount = poiCount)
+    data["World Width"] = 50.0
+    data["World Length"] = 50.0
+    data["Thread Count"] = threadCount
+    data["Sensing Radius"] = None
+    doAgentSense(data)
+    data["Agent Policies"] = [Evo_MLP(8, 2, 32) for agentIndex in range(agentCount)]
+    stackAgentPolicies(data)
+    doAgentProcess(data)
+    return data
+
+def getPopulationData(agentCount, policyCount, isArray):
+    data = {'Number of Agents': agentCount, 'Trains per Episode': policyCount,
+        "Episode Index": 0}
+    initFunc = initCceaArray(8, 2, 32) if isArray else initCcea(8, 2, 32)
+    initFunc(data)
+    for population in data['Agent Populations']:
+        for policy in population:
+            policy.fitness = np.random.rand()
+    return data
+
+def getKernelCaseCol(grid, threadCount):
+    """
+    Returns a list of (kernel name, parameter dictionary, setup function)
+        cases, the setup function returns the function to time
+    """
+    caseCol = []
+
+    def addCase(kernelName, parameterDict, setupFunc):
+        caseCol.append((kernelName, parameterDict, setupFunc))
+
+    for agentCount in grid["Number of Agents"]:
+        for poiCount in grid["Number of POIs"]:
+            def setupSense(agentCount = agentCount, poiCount = poiCount, sensingRadius = None):
+                data = getPolicyData(agentCount, poiCount, threadCount)
+                data["Sensing Radius"] = sensingRadius
+                return lambda: doAgentSense(data)
+            parameterDict = {"Number of Agents": agentCount, "Number of POIs": poiCount}
+            addCase("doAgentSense", parameterDict, setupSense)
+            addCase("doAgentSense Radius 10", parameterDict,
+                lambda setupSense = setupSense: setupSense(sensingRadius = 10.0))
+
+        def setupProcess(agentCount = agentCount):
+            data = getPolicyData(agentCount, 8, threadCount)
+            return lambda: doAgentProcess(data)
+        def setupProcessStacked(agentCount = agentCount):
+            data = getPolicyData(agentCount, 8, threadCount)
+            return lambda: doAgentProcessStacked(data)
+        def setupMove(agentCount = agentCount):
+            data = getPolicyData(agentCount, 8, threadCount)
+            return lambda: doAgentMove(data)
+        parameterDict = {"Number of Agents": agentCount}
+        addCase("doAgentProcess", parameterDict, setupProcess)
+        addCase("doAgentProcessStacked", parameterDict, setupProcessStacked)
+        addCase("doAgentMove", parameterDict, setupMove)
+
+        for policyCount in grid["Population Size"]:
+            for evolveFunc, isArray in ((evolveCceaPolicies, False), (evolveCceaArrayPolicies, True)):
+                def setupEvolve(agentCount = agentCount, policyCount = policyCount,
+                        evolveFunc = evolveFunc, isArray = isArray):
+                    data = getPopulationData(agentCount, policyCount, isArray)
+                    return lambda: evolveFunc(data)
+                addCase(evolveFunc.__name__, {"Number of Agents": agentCount,
+                    "Population Size": policyCount}, setupEvolve)
+
+    for rewardFunc in (assignGlobalReward, assignDifferenceReward, assignDppReward):
+        for agentCount in grid["Number of Agents"]:
+            for poiCount in grid["Number of POIs"]:
+                for stepCount in grid["Steps"]:
+                    for coupling in grid["Coupling"]:
+                        def setupReward(rewardFunc = rewardFunc, agentCount = agentCount,
+                                poiCount = poiCount, stepCount = stepCount, coupling = coupling):
+                            data = getRandomRewardData(agentCount, poiCount, stepCount)
+                            data["Coupling"] = coupling
+                            data["Thread Count"] = threadCount
+                            return lambda: rewardFunc(data)
+                        addCase(rewardFunc.__name__, {"Number of Agents": agentCount,
+                            "Number of POIs": poiCount, "Steps": stepCount,
+                            "Coupling": coupling}, setupReward)
+    return caseCol
+
+def benchmarkEpisode(episodeCount, threadCount):
+    """
+    Returns the times of full episodes (training and testing) of getSim(),
+        saving its files to a temporary folder
+    """
+    from specifics import getSim
+    saveFolderName = tempfile.mkdtemp()
+    try:
+        sim = getSim()
+        sim.data["Number of Episodes"] = episodeCount
+        sim.data["Thread Count"] = threadCount
+        for key in ("Performance Save File Name", "Trajectory Save File Name",
+                "Pickle Save File Name", "Results Catalog File Name"):
+            sim.data[key] = os.path.join(saveFolderName, os.path.basename(sim.data[key]))
+
+        episodeTimeCol = []
+        sim.trainBeginFuncCol.insert(0,
+            lambda data: data.update({"Episode Start Time": time.perf_counter()}))
+        sim.testEndFuncCol.append(
+            lambda data: episodeTimeCol.append(time.perf_counter() - data["Episode Start Time"]))
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim.run()
+        return episodeTimeCol
+    finally:
+        shutil.rmtree(saveFolderName, ignore_errors = True)
+
+def getCaseKey(result):
+    return result["Kernel"] + " " + json.dumps(result["Parameters"], sort_keys = True)
+
+def runBenchmarks(grid, kernelNameSet = None, threadCount = 1):
+    """
+    Times the kernel cases, printing each result
+
+    Returns:
+        dict: the results with information about the machine
+    """
+    resultCol = []
+
+    def addResult(kernelName, parameterDict, timeCol):
+        result = {
+            "Kernel": kernelName,
+            "Parameters": parameterDict,
+            "Best (s)": min(timeCol),
+            "Median (s)": statistics.median(timeCol),
+            "Repeats": len(timeCol)
+        }
+        resultCol.append(result)
+        print("%-26s %-70s %12.6f %12.6f %6d"%(kernelName,
+            json.dumps(parameterDict), result["Best (s)"], result["Median (s)"], len(timeCol)))
+
+    print("%-26s %-70s %12s %12s %6s"%("Kernel", "Parameters", "Best (s)", "Median (s)", "Runs"))
+    for kernelName, parameterDict, setupFunc in getKernelCaseCol(grid, threadCount):
+        if kernelNameSet is not None and kernelName not in kernelNameSet:
+            continue
+        addResult(kernelName, parameterDict, timeCall(setupFunc()))
+
+    if kernelNameSet is None or "Episode" in kernelNameSet:
+        addResult("Episode", {"Specifics": "getSim"},
+            benchmarkEpisode(grid["Episodes"], threadCount))
+
+    return {
+        "Date": datetime.datetime.now().isoformat(),
+        "Machine": {
+            "Platform": platform.platform(),
+            "Processor": platform.processor(),
+            "Cpu Count": os.cpu_count(),
+            "Python": platform.python_version(),
+            "Numpy": np.__version__,
+            "Kernel Backend": code.backend.backendName,
+            "Thread Count": threadCount
+        },
+        "Results": resultCol
+    }
+
+def compareBenchmarks(benchmark, baseline, threshold = 1.2, minTimeDifference = 1e-5):
+    """
+    Prints the ratio of each case's best time to the baseline's
+
+    Returns:
+        list: keys of the cases slower than threshold times the baseline
+            (and by more than minTimeDifference seconds)
+    """
+    baselineDict = {getCaseKey(result): result for result in baseline["Results"]}
+    slowerKeyCol = []
+    print("%-98s %12s %12s %8s"%("Case", "Baseline (s)", "Current (s)", "Ratio"))
+    for result in benchmark["Results"]:
+        key = getCaseKey(result)
+        if key not in baselineDict:
+            continue
+        baselineTime = baselineDict[key]["Best (s)"]
+        currentTime = result["Best (s)"]
+        ratio = currentTime / baselineTime if baselineTime > 0 else float("inf")
+        flag = ""
+        if ratio > threshold and currentTime - baselineTime > minTimeDifference:
+            flag = "SLOWER"
+            slowerKeyCol.append(key)
+        elif ratio < 1.0 / threshold:
+            flag = "faster"
+        print("%-98s %12.6f %12.6f %8.2f %s"%(key[:98], baselineTime, currentTime, ratio, flag))
+    print("%d of %d cases slower than %.2f times the baseline"%
+        (len(slowerKeyCol), len(benchmark["Results"]), threshold))
+    return slowerKeyCol
+
+def saveBenchmark(saveFileName, benchmark):
+    if os.path.dirname(saveFileName) and not os.path.exists(os.path.dirname(saveFileName)):
+        try:
+            os.makedirs(os.path.dirname(saveFileName))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+    with open(saveFileName, 'w') as saveFile:
+        json.dump(benchmark, saveFile, indent = 1)
+
+def loadBenchmark(saveFileName):
+    with open(saveFileName) as saveFile:
+        return json.load(saveFile)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Kernel benchmark suite")
+    parser.add_argument("--quick", action = "store_true", help = "use the smaller grid")
+    parser.add_argument("--kernels", help = "comma separated kernel names to run")
+    parser.add_argument("--threads", type = int, default = 1, help = 'data["Thread Count"]')
+    parser.add_argument("--output", default = "log/benchmark/kernels.json",
+        help = "file to save the results to")
+    parser.add_argument("--baseline", help = "results file to compare with")
+    parser.add_argument("--compare", help = "results file to compare instead of running")
+    parser.add_argument("--threshold", type = float, default = 1.2,
+        help = "slowdown ratio flagged as a regression")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        benchmark = loadBenchmark(args.compare)
+    else:
+        kernelNameSet = None if args.kernels is None else set(args.kernels.split(","))
+        benchmark = runBenchmarks(quickGrid if args.quick else fullGrid,
+            kernelNameSet, args.threads)
+        saveBenchmark(args.output, benchmark)
+        print("Saved %s"%args.output)
+
+    if args.baseline is not None:
+        print()
+        if compareBenchmarks(benchmark, loadBenchmark(args.baseline), args.threshold):
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Checks that assignDifferenceReward() and assignDppReward() match the 
+reference assignDifferenceRewardNaive() and assignDppRewardNaive() exactly 
+and times them as the number of agents grows. The references grow 
+quadratically with the number of agents, the table based rewards grow 
+linearly.
+
+Usage: python benchmark_reward.py
+"""
+import time
+import numpy as np
+import code.backend # Compiled or NumPy kernels (see code/backend.py)
+from code.reward_2 import * # Agent Reward
+
+
+def getRandomRewardData(agentCount, poiCount = 8, stepCount = 100, seed = 0):
+    """
+    Get data for a reward function with random walk trajectories that all
+        start from the world center (so observation distances have ties)
+    """
+    random = np.random.RandomState(seed)
+    data = {}
+    data['Number of Agents'] = agentCount
+    data['Number of POIs'] = poiCount
+    data["Minimum Distance"] = 1.0
+    data["Steps"] = stepCount
+    data["Coupling"] = 3
+    data["Observation Radius"] = 4.0
+    data['Poi Values'] = np.arange(poiCount) + 1.0
+    data["Poi Positions"] = random.rand(poiCount, 2) * 20.0
+
+    motion = random.uniform(-1, 1, (stepCount + 1, agentCount, 2))
+    motion[0] = 0.0
+    data["Agent Position History"] = 10.0 + np.cumsum(motion, axis = 0)
+    return data
+
+def timeRewardFunction(rewardFunc, data, repeatCount = 3):
+    bestTime = float("inf")
+    for repeatIndex in range(repeatCount):
+        startTime = time.perf_counter()
+        rewardFunc(data)
+        bestTime = min(bestTime, time.perf_counter() - startTime)
+    return bestTime
+
+def main():
+    rewardFuncPairCol = [
+        (assignDifferenceRewardNaive, assignDifferenceReward),
+        (assignDppRewardNaive, assignDppReward)
+    ]
+    for naiveRewardFunc, tableRewardFunc in rewardFuncPairCol:
+        print(tableRewardFunc.__name__)
+        print("%8s %14s %14s %10s %8s"%("Agents", "Naive (s)", "Tables (s)", "Speedup", "Equal"))
+        for agentCount in [10, 30, 100, 200, 400]:
+            data = getRandomRewardData(agentCount)
+
+            naiveRewardFunc(data)
+            naiveRewardCol = data["Agent Rewards"].copy()
+            naiveGlobalReward = data["Global Reward"]
+            tableRewardFunc(data)
+            isEqual = np.array_equal(naiveRewardCol, data["Agent Rewards"]) and \
+                naiveGlobalReward == data["Global Reward"]
+
+            naiveTime = timeRewardFunction(naiveRewardFunc, data)
+            tableTime = timeRewardFunction(tableRewardFunc, data)
+            print("%8d %14.6f %14.6f %10.1f %8s"%
+                (agentCount, naiveTime, tableTime, naiveTime / tableTime, isEqual))
+        print()
+
+if __name__ == "__main__":
+    main()
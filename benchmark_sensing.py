@@ -0,0 +1,102 @@
+"""
+Checks doAgentSense() with a finite data["Sensing Radius"] against a brute
+force reference and times it against the all-pairs sensing (no radius) as
+the number of agents grows at a constant agent density. All-pairs sensing
+grows quadratically with the number of agents, grid sensing grows linearly
+(the time per agent stays flat).
+
+Usage: python benchmark_sensing.py
+"""
+import time
+import numpy as np
+import code.backend # Compiled or NumPy kernels (see code/backend.py)
+from code.agent_domain_2 import * # Rover Domain Dynamic
+
+
+def getRandomSenseData(agentCount, agentsPerArea = 0.05, seed = 0, poiCount = None):
+    """
+    Get data for doAgentSense() with agents and pois spread uniformly over
+        a world that grows with the number of agents (by default with a 
+        quarter as many pois as agents)
+    """
+    random = np.random.RandomState(seed)
+    if poiCount is None:
+        poiCount = max(agentCount // 4, 1)
+    worldSize = np.sqrt(agentCount / agentsPerArea)
+    data = {}
+    data['Number of Agents'] = agentCount
+    data['Number of POIs'] = poiCount
+    data["Minimum Distance"] = 1.0
+    data["Agent Positions"] = random.rand(agentCount, 2) * worldSize
+    angleCol = random.uniform(-np.pi, np.pi, agentCount)
+    data["Agent Orientations"] = np.stack([np.cos(angleCol), np.sin(angleCol)], axis = 1)
+    data['Poi Values'] = np.arange(poiCount) + 1.0
+    data["Poi Positions"] = random.rand(poiCount, 2) * worldSize
+    return data
+
+def getReferenceObservations(data, sensingRadius):
+    """
+    Brute force doAgentSense() with a cutoff radius in numpy
+    """
+    observationCol = np.zeros((data['Number of Agents'], 8))
+    minDistanceSqr = data["Minimum Distance"] ** 2
+    orientationCol = data["Agent Orientations"]
+    for otherPositionCol, valueCol, obsOffset in [
+            (data["Agent Positions"], np.ones(data['Number of Agents']), 0),
+            (data["Poi Positions"], data['Poi Values'], 4)]:
+        globalFrameSeparation = otherPositionCol[np.newaxis] - data["Agent Positions"][:, np.newaxis]
+        agentFrameSeparation0 = orientationCol[:, 0:1] * globalFrameSeparation[..., 0] + \
+            orientationCol[:, 1:2] * globalFrameSeparation[..., 1]
+        agentFrameSeparation1 = orientationCol[:, 0:1] * globalFrameSeparation[..., 1] - \
+            orientationCol[:, 1:2] * globalFrameSeparation[..., 0]
+        distanceSqr = np.maximum(agentFrameSeparation0 ** 2 + agentFrameSeparation1 ** 2, minDistanceSqr)
+        contribution = valueCol[np.newaxis] / distanceSqr
+        contribution[(globalFrameSeparation ** 2).sum(axis = 2) >= sensingRadius ** 2] = 0.0
+        if obsOffset == 0:
+            np.fill_diagonal(contribution, 0.0)
+        isEast = agentFrameSeparation0 > 0
+        isNorth = agentFrameSeparation1 > 0
+        for quadrant, isQuadrant in enumerate([isEast & isNorth, ~isEast & isNorth,
+                ~isEast & ~isNorth, isEast & ~isNorth]):
+            observationCol[:, obsOffset + quadrant] = (contribution * isQuadrant).sum(axis = 1)
+    return observationCol
+
+def timeSenseFunction(data, repeatCount = 3):
+    bestTime = float("inf")
+    for repeatIndex in range(repeatCount):
+        startTime = time.perf_counter()
+        doAgentSense(data)
+        bestTime = min(bestTime, time.perf_counter() - startTime)
+    return bestTime
+
+def main():
+    sensingRadius = 10.0
+
+    data = getRandomSenseData(500)
+    data["Sensing Radius"] = sensingRadius
+    doAgentSense(data)
+    print("Grid matches brute force reference: %s"%
+        np.allclose(data["Agent Observations"], getReferenceObservations(data, sensingRadius)))
+    data["Sensing Radius"] = None
+    doAgentSense(data)
+    allPairsObservationCol = data["Agent Observations"]
+    data["Sensing Radius"] = float("inf")
+    doAgentSense(data)
+    print("Infinite radius matches all-pairs exactly: %s"%
+        np.array_equal(data["Agent Observations"], allPairsObservationCol))
+    print()
+
+    print("%8s %14s %14s %10s %18s"%("Agents", "All-Pairs (s)", "Grid (s)", "Speedup", "Grid us per Agent"))
+    for agentCount in [100, 300, 1000, 3000, 10000]:
+        data = getRandomSenseData(agentCount)
+
+        data["Sensing Radius"] = None
+        allPairsTime = timeSenseFunction(data)
+        data["Sensing Radius"] = sensingRadius
+        gridTime = timeSenseFunction(data)
+        print("%8d %14.6f %14.6f %10.1f %18.3f"%
+            (agentCount, allPairsTime, gridTime, allPairsTime / gridTime,
+            1e6 * gridTime / agentCount))
+
+if __name__ == "__main__":
+    main()
@@ -1,146 +1,372 @@
-# WARNING: Deprecated until this is like agent_domain_2
-# from numpy import matmul, array, dot, zeros, linalg, sin
-# 
-# 
-# 
-# def doAgentSense(data):
-#     """
-#      Sensor model is <aNE, aNW, aSW, aSE, pNE, pNE, pSW, pSE>
-#      Where a means (other) agent, p means poi, and the rest are the quadrants
-#     """
-#     number_agents = data['Number of Agents']
-#     number_pois = data['Number of POIs'] 
-#     poiValueCol = data['Poi Values']
-#     agentPositionCol = data["Agent Positions"]
-#     poiPositionCol = data["Poi Positions"]
-#     orientationCol = data["Agent Orientations"]
-#     minDistanceSqr = data["Minimum Distance"] ** 2
-#     observationCol = [None] * number_agents
-#     
-#     for agentIndex in range(number_agents):
-#         
-#         # recover agent position and orientation
-#         agentPosition = agentPositionCol[agentIndex]
-#         agentOrientation = orientationCol[agentIndex]
-#         c = agentOrientation[0]; s = agentOrientation[1]
-# 
-#         # initialize observation to zero
-#         observation = zeros(8)
-#         
-#         # calculate observation values due to other agents
-#         for otherAgentIndex in range(number_agents):
-#             
-#             # agents do not sense self (ergo skip self comparison)
-#             if agentIndex == otherAgentIndex:
-#                 continue
-#                 
-#             # Get global separation vector between the two agents    
-#             otherPosition = agentPositionCol[otherAgentIndex]
-#             globalFrameSeparation = otherPosition - agentPosition
-#             
-#             # Translate separation to agent frame using inverse rotation matrix
-#             agentFrameSeparation = matmul(array([[c, s], [-s, c]]), globalFrameSeparation)
-#             distanceSqr = dot(agentFrameSeparation, agentFrameSeparation)
-#             
-#             # By bounding distance value we implicitly bound sensor values
-#             if distanceSqr < minDistanceSqr:
-#                 distanceSqr = minDistanceSqr
-#             
-#             
-#             # other is east of agent
-#             if agentFrameSeparation[0] > 0:
-#                 # other is north-east of agent
-#                 if agentFrameSeparation[1] > 0:
-#                     observation[0] += 1.0 / distanceSqr
-#                 else: # other is south-east of agent
-#                     observation[3] += 1.0  / distanceSqr
-#             else:  # other is west of agent
-#                 # other is north-west of agent
-#                 if agentFrameSeparation[1] > 0:
-#                     observation[1] += 1.0  / distanceSqr
-#                 else:  # other is south-west of agent
-#                     observation[2] += 1.0  / distanceSqr
-# 
-#         # calculate observation values due to pois
-#         for poiIndex in range(number_pois):
-#             
-#             # Get global separation vector between the two agents    
-#             poiPosition = poiPositionCol[poiIndex]
-#             globalFrameSeparation = poiPosition - agentPosition
-#             
-#             # Translate separation to agent frame using inverse rotation matrix
-#             agentFrameSeparation = matmul(array([[c, s], [-s, c]]), globalFrameSeparation)
-#             distanceSqr = dot(agentFrameSeparation, agentFrameSeparation)
-#             
-#             # By bounding distance value we implicitly bound sensor values
-#             if distanceSqr < minDistanceSqr:
-#                 distanceSqr = minDistanceSqr
-#             
-#             
-#             # poi is east of agent
-#             if agentFrameSeparation[0] > 0:
-#                 # poi is north-east of agent
-#                 if agentFrameSeparation[1] > 0:
-#                     observation[4] += poiValueCol[poiIndex]  / distanceSqr
-#                 else: # poi is south-east of agent
-#                     observation[7] += poiValueCol[poiIndex]  / distanceSqr
-#             else:  # poi is west of agent
-#                 # poi is north-west of agent
-#                 if agentFrameSeparation[1] > 0:
-#                     observation[5] += poiValueCol[poiIndex]  / distanceSqr
-#                 else:  # poi is south-west of agent
-#                     observation[6] += poiValueCol[poiIndex]  / distanceSqr
-#             
-#         observationCol[agentIndex] = observation
-#     data["Agent Observations"] = observationCol
-# 
-#  
-# def doAgentProcess(data):
-#     number_agents = data['Number of Agents']
-#     actionCol = [None] * number_agents
-#     policyCol = data["Agent Policies"]
-#     observationCol = data["Agent Observations"]
-#     for agentIndex in range(number_agents):
-#         actionCol[agentIndex] = policyCol[agentIndex].get_action(observationCol[agentIndex])
-#     data["Agent Actions"] = actionCol
-# 
-#    
-# def doAgentMove(data):
-#     worldWidth = data["World Width"]
-#     worldLength = data["World Length"]
-#     number_agents = data['Number of Agents']
-#     actionCol = data["Agent Actions"]
-#     positionCol = data["Agent Positions"]
-#     orientationCol = data["Agent Orientations"]
-#     
-#     # move all agents
-#     for agentIndex in range(number_agents):
-#         # recover agent position and orientation
-#         agentPosition = positionCol[agentIndex]
-#         agentOrientation = orientationCol[agentIndex]
-#         c = orientationCol[agentIndex][0]; s = orientationCol[agentIndex][1]
-# 
-#         # turn action into global frame motion
-#         agentFrameMotion = actionCol[agentIndex]
-#         globalFrameMotion = matmul(array([[c, -s], [s, c]]), agentFrameMotion)
-#       
-#         # globally move and reorient agent
-#         positionCol[agentIndex] += globalFrameMotion
-#         if (globalFrameMotion == zeros(2)).all():
-#             orientationCol[agentIndex] = array([1.0,0.0])
-#         else:
-#             orientationCol[agentIndex] = globalFrameMotion / linalg.norm(globalFrameMotion)
-#             
-#         # # Check if action moves agent within the world bounds
-#         # if positionCol[agentIndex][0] > worldWidth:
-#         #     positionCol[agentIndex][0] = worldWidth
-#         # elif positionCol[agentIndex][0] < 0.0:
-#         #     positionCol[agentIndex][0] = 0.0
-#         # 
-#         # if positionCol[agentIndex][1] > worldLength:
-#         #     positionCol[agentIndex][1] = worldLength
-#         # elif positionCol[agentIndex][1] < 0.0:
-#         #     positionCol[agentIndex][1] = 0.0
-#         
-#     data["Agent Positions"]  = positionCol
-#     data["Agent Orientations"] = orientationCol 
\ No newline at end of file
+"""
+NumPy implementation of agent_domain_2 (see code/backend.py), with the same
+functions and the same results. Loops over agents and pois are replaced with
+array operations over all pairs; sums are still added one term after the
+other in the order of the compiled loops (see sumInOrder()), so results
+match to the last bit.
+"""
+import math
+import numpy as np
+
+# Maximum number of agent and other pairs held in memory at once
+pairBlockSize = 1 << 20
+
+# np.tanh may use its own SIMD approximation, math.tanh is the C library's
+# tanh used by the compiled kernels
+cTanh = np.vectorize(math.tanh, otypes = [np.float64])
+
+def sumInOrder(termArray, axis = 0):
+    """
+    Sums termArray over axis by adding the terms one after the other, like
+        the compiled += loops. np.sum() adds pairwise, which rounds
+        differently.
+    """
+    termArray = np.asarray(termArray)
+    if termArray.shape[axis] == 0:
+        return np.zeros(np.delete(termArray.shape, axis))
+    return np.take(np.add.accumulate(termArray, axis = axis), -1, axis = axis)
+
+def doAgentSense(data):
+    """
+     Sensor model is <aNE, aNW, aSW, aSE, pNE, pNE, pSW, pSE>
+     Where a means (other) agent, p means poi, and the rest are the quadrants
+
+     If agent positions are stacked with a leading world axis (see
+     data["World Batch Size"] in core.py), every world is sensed and the
+     observations are stacked the same way.
+
+     If data["Sensing Radius"] is set (default None, which like an infinite
+     radius senses every agent and poi), only agents and pois closer than
+     the radius are sensed, see senseWorldGrid().
+    """
+    number_agents = data['Number of Agents']
+    number_pois = data['Number of POIs']
+    minDistanceSqr = data["Minimum Distance"] ** 2
+    sensingRadius = getSensingRadius(data)
+    npAgentPositionCol = data["Agent Positions"]
+
+    if sensingRadius != math.inf:
+        doAgentSenseGrid(data, sensingRadius)
+        return
+
+    if npAgentPositionCol.ndim == 3:
+        npObservationCol = np.zeros(
+            (npAgentPositionCol.shape[0], number_agents, 8),
+            dtype = np.float64
+        )
+        for worldIndex in range(npAgentPositionCol.shape[0]):
+            senseWorld(number_agents, number_pois, minDistanceSqr,
+                npAgentPositionCol[worldIndex],
+                data["Agent Orientations"][worldIndex],
+                data['Poi Values'][worldIndex],
+                data["Poi Positions"][worldIndex],
+                npObservationCol[worldIndex])
+    else:
+        npObservationCol = np.zeros((number_agents, 8), dtype = np.float64)
+        senseWorld(number_agents, number_pois, minDistanceSqr,
+            npAgentPositionCol, data["Agent Orientations"],
+            data['Poi Values'], data["Poi Positions"], npObservationCol)
+
+    data["Agent Observations"] = npObservationCol
+
+def senseWorld(number_agents, number_pois, minDistanceSqr, agentPositionCol,
+        orientationCol, poiValueCol, poiPositionCol, observationCol):
+    # agents do not sense self (ergo skip self comparison)
+    notSelfMask = ~np.eye(number_agents, dtype = bool)
+    addQuadrantObservations(0, np.ones(number_agents), agentPositionCol,
+        notSelfMask, minDistanceSqr, agentPositionCol, orientationCol,
+        observationCol)
+    addQuadrantObservations(4, poiValueCol, poiPositionCol, None,
+        minDistanceSqr, agentPositionCol, orientationCol, observationCol)
+
+def addQuadrantObservations(obsOffset, valueCol, otherPositionCol,
+        senseMask, minDistanceSqr, agentPositionCol, orientationCol,
+        observationCol, sensingRadiusSqr = math.inf):
+    """
+    Adds value / distance^2 of every other position to each agent's sensor
+    for the quadrant of that position (sensors obsOffset to obsOffset + 3),
+    in the order of the others. senseMask (others by agents, None for all)
+    selects the pairs that are sensed, pairs as far as the sensing radius or
+    farther are ignored.
+    """
+    agentBlockSize = max(pairBlockSize // max(len(otherPositionCol), 1), 1)
+    for agentStart in range(0, len(agentPositionCol), agentBlockSize):
+        agentBlock = slice(agentStart, agentStart + agentBlockSize)
+
+        # Get global separation vectors, others by agents
+        globalFrameSeparation0 = otherPositionCol[:, np.newaxis, 0] - agentPositionCol[np.newaxis, agentBlock, 0]
+        globalFrameSeparation1 = otherPositionCol[:, np.newaxis, 1] - agentPositionCol[np.newaxis, agentBlock, 1]
+
+        # Ignore everything outside of the sensing radius
+        blockSenseMask = globalFrameSeparation0 * globalFrameSeparation0 + globalFrameSeparation1 * globalFrameSeparation1 < sensingRadiusSqr
+        if senseMask is not None:
+            blockSenseMask &= senseMask[:, agentBlock]
+
+        # Translate separation to agent frame using inverse rotation matrix
+        orientation0 = orientationCol[np.newaxis, agentBlock, 0]
+        orientation1 = orientationCol[np.newaxis, agentBlock, 1]
+        agentFrameSeparation0 = orientation0 * globalFrameSeparation0 + orientation1 * globalFrameSeparation1
+        agentFrameSeparation1 = orientation0 * globalFrameSeparation1 - orientation1 * globalFrameSeparation0
+        distanceSqr = agentFrameSeparation0 * agentFrameSeparation0 + agentFrameSeparation1 * agentFrameSeparation1
+
+        # By bounding distance value we implicitly bound sensor values
+        distanceSqr = np.maximum(distanceSqr, minDistanceSqr)
+        with np.errstate(divide = "ignore"): # e.g. self pairs, never sensed
+            valueArray = np.where(blockSenseMask, valueCol[:, np.newaxis] / distanceSqr, 0.0)
+
+        # east and north-east (0), north-west (1), south-west (2), south-east (3)
+        isEast = agentFrameSeparation0 > 0
+        isNorth = agentFrameSeparation1 > 0
+        for quadrant, quadrantMask in enumerate((isEast & isNorth, ~isEast & isNorth,
+                ~isEast & ~isNorth, isEast & ~isNorth)):
+            observationCol[agentBlock, obsOffset + quadrant] += \
+                sumInOrder(np.where(quadrantMask, valueArray, 0.0))
+
+def getSensingRadius(data):
+    """
+    Get data["Sensing Radius"] as a number, None means an infinite radius
+    """
+    sensingRadius = data.get("Sensing Radius")
+    if sensingRadius is None:
+        return math.inf
+    if sensingRadius <= 0:
+        raise ValueError("Sensing Radius must be positive, got %r"%(sensingRadius,))
+    return float(sensingRadius)
+
+def doAgentSenseGrid(data, sensingRadius):
+    """
+    doAgentSense() for a finite sensing radius, see senseWorldGrid()
+    """
+    number_agents = data['Number of Agents']
+    number_pois = data['Number of POIs']
+    minDistanceSqr = data["Minimum Distance"] ** 2
+    npAgentPositionCol = data["Agent Positions"]
+
+    if npAgentPositionCol.ndim == 3:
+        npObservationCol = np.zeros(
+            (npAgentPositionCol.shape[0], number_agents, 8),
+            dtype = np.float64
+        )
+        for worldIndex in range(npAgentPositionCol.shape[0]):
+            senseWorldGrid(number_agents, number_pois, minDistanceSqr,
+                sensingRadius, npAgentPositionCol[worldIndex],
+                data["Agent Orientations"][worldIndex],
+                data['Poi Values'][worldIndex],
+                data["Poi Positions"][worldIndex],
+                npObservationCol[worldIndex])
+    else:
+        npObservationCol = np.zeros((number_agents, 8), dtype = np.float64)
+        senseWorldGrid(number_agents, number_pois, minDistanceSqr,
+            sensingRadius, npAgentPositionCol, data["Agent Orientations"],
+            data['Poi Values'], data["Poi Positions"], npObservationCol)
+
+    data["Agent Observations"] = npObservationCol
+
+def senseWorldGrid(number_agents, number_pois, minDistanceSqr, sensingRadius,
+        agentPositionCol, orientationCol, poiValueCol, poiPositionCol,
+        observationCol):
+    """
+    Like senseWorld() but only senses agents and pois closer than
+    sensingRadius. Uses the cells of the compiled senseWorldGrid() to pick
+    the same pairs and to add them in the same order (by cell, then index).
+    Unlike the compiled version, the cost still grows quadratically with the
+    number of agents.
+    """
+    maxCellCount = 4 * (number_agents + number_pois) + 16
+    positionCol = np.concatenate((agentPositionCol, poiPositionCol))
+    minPosition0, minPosition1 = positionCol.min(axis = 0)
+    maxPosition0, maxPosition1 = positionCol.max(axis = 0)
+    cellSize = sensingRadius
+
+    # Grow the cells until the grid fits in the cell buffers
+    while True:
+        gridWidth = int((maxPosition0 - minPosition0) / cellSize) + 1
+        gridLength = int((maxPosition1 - minPosition1) / cellSize) + 1
+        if float(gridWidth) * gridLength <= maxCellCount:
+            break
+        cellSize *= 2
+
+    def getCellCol(positionCol):
+        cell0 = ((positionCol[:, 0] - minPosition0) / cellSize).astype(np.intc)
+        cell1 = ((positionCol[:, 1] - minPosition1) / cellSize).astype(np.intc)
+        return np.clip(cell0, 0, gridWidth - 1), np.clip(cell1, 0, gridLength - 1)
+
+    agentCell0Col, agentCell1Col = getCellCol(agentPositionCol)
+    for obsOffset, valueCol, otherPositionCol in ((0, np.ones(number_agents), agentPositionCol),
+            (4, poiValueCol, poiPositionCol)):
+        otherCell0Col, otherCell1Col = getCellCol(otherPositionCol)
+        otherOrderCol = np.argsort(otherCell1Col * gridWidth + otherCell0Col, kind = "stable")
+        otherCell0Col = otherCell0Col[otherOrderCol]
+        otherCell1Col = otherCell1Col[otherOrderCol]
+
+        # Only the 3 x 3 block of cells around the agent is sensed
+        senseMask = (np.abs(otherCell0Col[:, np.newaxis] - agentCell0Col) <= 1) & \
+            (np.abs(otherCell1Col[:, np.newaxis] - agentCell1Col) <= 1)
+        if obsOffset == 0:
+            # agents do not sense self (ergo skip self comparison)
+            senseMask &= otherOrderCol[:, np.newaxis] != np.arange(number_agents)
+        addQuadrantObservations(obsOffset, valueCol[otherOrderCol],
+            otherPositionCol[otherOrderCol], senseMask, minDistanceSqr,
+            agentPositionCol, orientationCol, observationCol,
+            sensingRadius * sensingRadius)
+
+def doAgentProcess(data):
+    number_agents = data['Number of Agents']
+    policyCol = data["Agent Policies"]
+    observationCol = data["Agent Observations"]
+    if observationCol.ndim == 3:
+        actionCol = np.zeros((observationCol.shape[0], number_agents, 2), dtype = np.float_)
+        for worldIndex in range(observationCol.shape[0]):
+            for agentIndex in range(number_agents):
+                actionCol[worldIndex, agentIndex] = \
+                    policyCol[worldIndex][agentIndex].get_action(observationCol[worldIndex, agentIndex])
+    else:
+        actionCol = np.zeros((number_agents, 2), dtype = np.float_)
+        for agentIndex in range(number_agents):
+            actionCol[agentIndex] = policyCol[agentIndex].get_action(observationCol[agentIndex])
+    data["Agent Actions"] = actionCol
+
+def doAgentProcessStacked(data):
+    """
+    Computes the actions of all agents at once from the policy weights
+    stacked by stackAgentPolicies() in ccea_2, with one batched matrix
+    product per layer (relu hidden layer, tanh output layer like Evo_MLP)
+    """
+    inToHiddenStack, inToHiddenBiasStack, hiddenToOutStack, hiddenToOutBiasStack = \
+        data["Agent Policy Stack"]
+    observationCol = data["Agent Observations"]
+
+    hiddenCol = np.matmul(inToHiddenStack, observationCol[..., np.newaxis])[..., 0]
+    hiddenCol += inToHiddenBiasStack
+    np.maximum(hiddenCol, 0.0, out = hiddenCol)
+    actionCol = np.matmul(hiddenToOutStack, hiddenCol[..., np.newaxis])[..., 0]
+    actionCol += hiddenToOutBiasStack
+    np.tanh(actionCol, out = actionCol)
+
+    data["Agent Actions"] = actionCol
+
+def doAgentMove(data):
+    npAgentPositionCol = data["Agent Positions"]
+    npOrientationCol = data["Agent Orientations"]
+    npActionCol = np.array(data["Agent Actions"]).astype(np.float_)
+    npActionCol = np.clip(npActionCol, -1, 1)
+
+    # moves every agent of every world at once, in place like the compiled
+    # moveWorld()
+    moveWorld(npAgentPositionCol, npOrientationCol, npActionCol)
+
+    data["Agent Positions"]  = npAgentPositionCol
+    data["Agent Orientations"] = npOrientationCol
+
+def moveWorld(agentPositionCol, orientationCol, actionCol):
+    # turn action into global frame motion
+    globalFrameMotion0 = orientationCol[..., 0] * actionCol[..., 0] - orientationCol[..., 1] * actionCol[..., 1]
+    globalFrameMotion1 = orientationCol[..., 0] * actionCol[..., 1] + orientationCol[..., 1] * actionCol[..., 0]
+
+    # globally move and reorient agent
+    agentPositionCol[..., 0] += globalFrameMotion0
+    agentPositionCol[..., 1] += globalFrameMotion1
+
+    isStill = (globalFrameMotion0 == 0.0) & (globalFrameMotion1 == 0.0)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        norm = np.sqrt(globalFrameMotion0 * globalFrameMotion0 + globalFrameMotion1 * globalFrameMotion1)
+        orientationCol[..., 0] = np.where(isStill, 1.0, globalFrameMotion0 / norm)
+        orientationCol[..., 1] = np.where(isStill, 0.0, globalFrameMotion1 / norm)
+
+def doAgentRollout(data):
+    """
+    Runs the whole world (data["Steps"] steps of doAgentSense(), policy
+    inference, doAgentMove() and trajectory recording) in one call.
+    Policies are read from data["Agent Policy Stack"] (see
+    stackAgentPolicies() in ccea_2) and computed like Evo_MLP.get_action().
+    Use as a world end function before the reward function, with no step
+    functions; data["Observation Function"] is not used.
+
+    Sets "Agent Position History" and "Agent Orientation History" like
+    createTrajectoryHistories() and updateTrajectoryHistories(), and leaves
+    the final positions, orientations and last observations and actions in
+    data. Supports a leading world axis and data["Sensing Radius"] like
+    doAgentSense().
+    """
+    number_agents = data['Number of Agents']
+    number_pois = data['Number of POIs']
+    stepCount = data["Steps"]
+    minDistanceSqr = data["Minimum Distance"] ** 2
+    sensingRadius = getSensingRadius(data)
+    npAgentPositionCol = data["Agent Positions"]
+    npOrientationCol = data["Agent Orientations"]
+    npPoiValueCol = data['Poi Values']
+    npPoiPositionCol = data["Poi Positions"]
+    npInToHiddenStack, npInToHiddenBiasStack, npHiddenToOutStack, npHiddenToOutBiasStack = \
+        data["Agent Policy Stack"]
+
+    # Treat a single world as a batch of one
+    isBatch = npAgentPositionCol.ndim == 3
+    if not isBatch:
+        npAgentPositionCol = npAgentPositionCol[np.newaxis]
+        npOrientationCol = npOrientationCol[np.newaxis]
+        npPoiValueCol = npPoiValueCol[np.newaxis]
+        npPoiPositionCol = npPoiPositionCol[np.newaxis]
+        npInToHiddenStack = npInToHiddenStack[np.newaxis]
+        npInToHiddenBiasStack = npInToHiddenBiasStack[np.newaxis]
+        npHiddenToOutStack = npHiddenToOutStack[np.newaxis]
+        npHiddenToOutBiasStack = npHiddenToOutBiasStack[np.newaxis]
+
+    worldCount = npAgentPositionCol.shape[0]
+    outputCount = npHiddenToOutStack.shape[2]
+    npObservationCol = np.zeros((worldCount, number_agents, 8))
+    npActionCol = np.zeros((worldCount, number_agents, outputCount))
+    npAgentPositionHistory = np.zeros((worldCount, stepCount + 1, number_agents, 2))
+    npAgentOrientationHistory = np.zeros((worldCount, stepCount + 1, number_agents, 2))
+
+    for worldIndex in range(worldCount):
+        agentPositionCol = npAgentPositionCol[worldIndex]
+        orientationCol = npOrientationCol[worldIndex]
+        observationCol = npObservationCol[worldIndex]
+        npAgentPositionHistory[worldIndex, 0] = agentPositionCol
+        npAgentOrientationHistory[worldIndex, 0] = orientationCol
+
+        for stepIndex in range(stepCount):
+            observationCol[:, :] = 0.0
+            if sensingRadius == math.inf:
+                senseWorld(number_agents, number_pois, minDistanceSqr,
+                    agentPositionCol, orientationCol, npPoiValueCol[worldIndex],
+                    npPoiPositionCol[worldIndex], observationCol)
+            else:
+                senseWorldGrid(number_agents, number_pois, minDistanceSqr,
+                    sensingRadius, agentPositionCol, orientationCol,
+                    npPoiValueCol[worldIndex], npPoiPositionCol[worldIndex],
+                    observationCol)
+            npActionCol[worldIndex] = inferWorld(npInToHiddenStack[worldIndex],
+                npInToHiddenBiasStack[worldIndex], npHiddenToOutStack[worldIndex],
+                npHiddenToOutBiasStack[worldIndex], observationCol)
+            moveWorld(agentPositionCol, orientationCol, npActionCol[worldIndex])
+
+            npAgentPositionHistory[worldIndex, stepIndex + 1] = agentPositionCol
+            npAgentOrientationHistory[worldIndex, stepIndex + 1] = orientationCol
+
+    if not isBatch:
+        npObservationCol = npObservationCol[0]
+        npActionCol = npActionCol[0]
+        npAgentPositionHistory = npAgentPositionHistory[0]
+        npAgentOrientationHistory = npAgentOrientationHistory[0]
+
+    data["Agent Observations"] = npObservationCol
+    data["Agent Actions"] = npActionCol
+    data["Agent Position History"] = npAgentPositionHistory
+    data["Agent Orientation History"] = npAgentOrientationHistory
+
+def inferWorld(inToHiddenStack, inToHiddenBiasStack, hiddenToOutStack,
+        hiddenToOutBiasStack, observationCol):
+    """
+    Actions of all agents of a world, like Evo_MLP.get_action()
+    """
+    # relu hidden layer
+    hiddenCol = sumInOrder(inToHiddenStack * observationCol[:, np.newaxis, :], axis = 2)
+    hiddenCol += inToHiddenBiasStack
+    hiddenCol = hiddenCol * (hiddenCol > 0)
+
+    # tanh output layer, clipped to the action range like doAgentMove()
+    actionCol = sumInOrder(hiddenToOutStack * hiddenCol[:, np.newaxis, :], axis = 2)
+    actionCol += hiddenToOutBiasStack
+    return np.clip(cTanh(actionCol), -1.0, 1.0)
@@ -1,9 +1,13 @@
 
 import numpy as np
 cimport cython
+from cython.parallel cimport prange
 
-cdef extern from "math.h":
+from libc.math cimport INFINITY
+
+cdef extern from "math.h" nogil:
     double sqrt(double m)
+    double tanh(double m)
 
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing.
@@ -11,17 +15,66 @@ cpdef doAgentSense(data):
     """
      Sensor model is <aNE, aNW, aSW, aSE, pNE, pNE, pSW, pSE>
      Where a means (other) agent, p means poi, and the rest are the quadrants
+     
+     If agent positions are stacked with a leading world axis (see 
+     data["World Batch Size"] in core.py), every world is sensed and the 
+     observations are stacked the same way.
+     
+     Agents are sensed without the GIL, split over data["Thread Count"] 
+     threads (default 1).
+     
+     If data["Sensing Radius"] is set (default None, which like an infinite
+     radius senses every agent and poi), only agents and pois closer than 
+     the radius are sensed. They are found with a uniform grid of cells 
+     (see senseWorldGrid()), so the cost per step grows linearly with the 
+     number of agents instead of quadratically.
     """
     cdef int number_agents = data['Number of Agents']
     cdef int number_pois = data['Number of POIs'] 
     cdef double minDistanceSqr = data["Minimum Distance"] ** 2
-    cdef double[:, :] agentPositionCol = data["Agent Positions"]
-    cdef double[:] poiValueCol = data['Poi Values']
-    cdef double[:, :] poiPositionCol = data["Poi Positions"]
-    cdef double[:, :] orientationCol = data["Agent Orientations"]
-    npObservationCol = np.zeros((number_agents, 8), dtype = np.float64)
-    cdef double[:, :] observationCol = npObservationCol
+    cdef int threadCount = data.get("Thread Count", 1)
+    cdef double sensingRadius = getSensingRadius(data)
+    npAgentPositionCol = data["Agent Positions"]
+    
+    cdef int worldIndex
+    cdef double[:, :, :] agentPositionBatch, orientationBatch, poiPositionBatch
+    cdef double[:, :, :] observationBatch
+    cdef double[:, :] poiValueBatch
     
+    if sensingRadius != INFINITY:
+        doAgentSenseGrid(data, sensingRadius)
+        return
+    
+    if npAgentPositionCol.ndim == 3:
+        agentPositionBatch = npAgentPositionCol
+        orientationBatch = data["Agent Orientations"]
+        poiValueBatch = data['Poi Values']
+        poiPositionBatch = data["Poi Positions"]
+        npObservationCol = np.zeros(
+            (agentPositionBatch.shape[0], number_agents, 8), 
+            dtype = np.float64
+        )
+        observationBatch = npObservationCol
+        for worldIndex in range(agentPositionBatch.shape[0]):
+            senseWorld(number_agents, number_pois, minDistanceSqr,
+                agentPositionBatch[worldIndex], orientationBatch[worldIndex], 
+                poiValueBatch[worldIndex], poiPositionBatch[worldIndex], 
+                observationBatch[worldIndex], threadCount)
+    else:
+        npObservationCol = np.zeros((number_agents, 8), dtype = np.float64)
+        senseWorld(number_agents, number_pois, minDistanceSqr,
+            npAgentPositionCol, data["Agent Orientations"], 
+            data['Poi Values'], data["Poi Positions"], npObservationCol, 
+            threadCount)
+                    
+    data["Agent Observations"] = npObservationCol
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void senseWorld(int number_agents, int number_pois, double minDistanceSqr,
+        double[:, :] agentPositionCol, double[:, :] orientationCol, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double[:, :] observationCol, int threadCount) noexcept nogil:
     cdef int agentIndex, otherAgentIndex, poiIndex, obsIndex
     cdef double globalFrameSeparation0, globalFrameSeparation1
     cdef double agentFrameSeparation0, agentFrameSeparation1
@@ -29,7 +82,7 @@ cpdef doAgentSense(data):
     cdef double distanceSqr
     
     
-    for agentIndex in range(number_agents):
+    for agentIndex in prange(number_agents, num_threads = threadCount, schedule = 'static'):
 
         # calculate observation values due to other agents
         for otherAgentIndex in range(number_agents):
@@ -97,19 +150,309 @@ cpdef doAgentSense(data):
                     observationCol[agentIndex,5] += poiValueCol[poiIndex]  / distanceSqr
                 else:  # poi is south-west of agent
                     observationCol[agentIndex,6] += poiValueCol[poiIndex]  / distanceSqr
+
+def getSensingRadius(data):
+    """
+    Get data["Sensing Radius"] as a number, None means an infinite radius
+    """
+    sensingRadius = data.get("Sensing Radius")
+    if sensingRadius is None:
+        return INFINITY
+    if sensingRadius <= 0:
+        raise ValueError("Sensing Radius must be positive, got %r"%(sensingRadius,))
+    return float(sensingRadius)
+    
+class SensingGrid:
+    """
+    Preallocated cell list buffers for senseWorldGrid(), get them with 
+    getSensingGrid(). The grid never has more than maxCellCount cells, cells
+    are made larger than the sensing radius when the agents are spread too 
+    far apart for that.
+    """
+    def __init__(self, agentCount, poiCount):
+        self.agentCount = agentCount
+        self.poiCount = poiCount
+        self.maxCellCount = 4 * (agentCount + poiCount) + 16
+        self.agentCellCol = np.zeros(agentCount, dtype = np.intc)
+        self.agentCellStartCol = np.zeros(self.maxCellCount + 1, dtype = np.intc)
+        self.agentCellOrderCol = np.zeros(agentCount, dtype = np.intc)
+        self.poiCellCol = np.zeros(poiCount, dtype = np.intc)
+        self.poiCellStartCol = np.zeros(self.maxCellCount + 1, dtype = np.intc)
+        self.poiCellOrderCol = np.zeros(poiCount, dtype = np.intc)
+
+def getSensingGrid(data):
+    """
+    Returns the SensingGrid kept in data["Sensing Grid"], made again only 
+        when the number of agents or pois changes
+    """
+    grid = data.get("Sensing Grid")
+    if grid is None or grid.agentCount != data['Number of Agents'] \
+            or grid.poiCount != data['Number of POIs']:
+        grid = SensingGrid(data['Number of Agents'], data['Number of POIs'])
+        data["Sensing Grid"] = grid
+    return grid
+
+def doAgentSenseGrid(data, sensingRadius):
+    """
+    doAgentSense() for a finite sensing radius, see senseWorldGrid()
+    """
+    cdef int number_agents = data['Number of Agents']
+    cdef int number_pois = data['Number of POIs'] 
+    cdef double minDistanceSqr = data["Minimum Distance"] ** 2
+    cdef int threadCount = data.get("Thread Count", 1)
+    npAgentPositionCol = data["Agent Positions"]
+    grid = getSensingGrid(data)
+    
+    cdef int worldIndex
+    cdef double[:, :, :] agentPositionBatch, orientationBatch, poiPositionBatch
+    cdef double[:, :, :] observationBatch
+    cdef double[:, :] poiValueBatch
+    
+    if npAgentPositionCol.ndim == 3:
+        agentPositionBatch = npAgentPositionCol
+        orientationBatch = data["Agent Orientations"]
+        poiValueBatch = data['Poi Values']
+        poiPositionBatch = data["Poi Positions"]
+        npObservationCol = np.zeros(
+            (agentPositionBatch.shape[0], number_agents, 8), 
+            dtype = np.float64
+        )
+        observationBatch = npObservationCol
+        for worldIndex in range(agentPositionBatch.shape[0]):
+            senseWorldGrid(number_agents, number_pois, minDistanceSqr,
+                sensingRadius, agentPositionBatch[worldIndex], 
+                orientationBatch[worldIndex], poiValueBatch[worldIndex], 
+                poiPositionBatch[worldIndex], observationBatch[worldIndex], 
+                grid.agentCellCol, grid.agentCellStartCol, 
+                grid.agentCellOrderCol, grid.poiCellCol, grid.poiCellStartCol, 
+                grid.poiCellOrderCol, threadCount)
+    else:
+        npObservationCol = np.zeros((number_agents, 8), dtype = np.float64)
+        senseWorldGrid(number_agents, number_pois, minDistanceSqr, 
+            sensingRadius, npAgentPositionCol, data["Agent Orientations"], 
+            data['Poi Values'], data["Poi Positions"], npObservationCol, 
+            grid.agentCellCol, grid.agentCellStartCol, grid.agentCellOrderCol, 
+            grid.poiCellCol, grid.poiCellStartCol, grid.poiCellOrderCol, 
+            threadCount)
                     
     data["Agent Observations"] = npObservationCol
 
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void senseWorldGrid(int number_agents, int number_pois, 
+        double minDistanceSqr, double sensingRadius, 
+        double[:, :] agentPositionCol, double[:, :] orientationCol, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double[:, :] observationCol, int[:] agentCellCol, 
+        int[:] agentCellStartCol, int[:] agentCellOrderCol, int[:] poiCellCol,
+        int[:] poiCellStartCol, int[:] poiCellOrderCol, int threadCount) noexcept nogil:
+    """
+    Like senseWorld() but only senses agents and pois closer than 
+    sensingRadius. Agents and pois are binned into square cells at least 
+    sensingRadius wide, so everything in range is in the 3 x 3 block of 
+    cells around the sensing agent. The cells are rebuilt every call with a 
+    counting sort, O(agents + pois + cells).
+    """
+    cdef int agentIndex, poiIndex, gridWidth, gridLength
+    cdef int maxCellCount = agentCellStartCol.shape[0] - 1
+    cdef double minPosition0 = INFINITY, minPosition1 = INFINITY
+    cdef double maxPosition0 = -INFINITY, maxPosition1 = -INFINITY
+    cdef double cellSize = sensingRadius
+    
+    # Find the bounds of the grid
+    for agentIndex in range(number_agents):
+        minPosition0 = min(minPosition0, agentPositionCol[agentIndex, 0])
+        minPosition1 = min(minPosition1, agentPositionCol[agentIndex, 1])
+        maxPosition0 = max(maxPosition0, agentPositionCol[agentIndex, 0])
+        maxPosition1 = max(maxPosition1, agentPositionCol[agentIndex, 1])
+    for poiIndex in range(number_pois):
+        minPosition0 = min(minPosition0, poiPositionCol[poiIndex, 0])
+        minPosition1 = min(minPosition1, poiPositionCol[poiIndex, 1])
+        maxPosition0 = max(maxPosition0, poiPositionCol[poiIndex, 0])
+        maxPosition1 = max(maxPosition1, poiPositionCol[poiIndex, 1])
+    
+    # Grow the cells until the grid fits in the cell buffers
+    while True:
+        gridWidth = <int>((maxPosition0 - minPosition0) / cellSize) + 1
+        gridLength = <int>((maxPosition1 - minPosition1) / cellSize) + 1
+        if <double>gridWidth * gridLength <= maxCellCount:
+            break
+        cellSize *= 2
+    
+    fillCellList(number_agents, agentPositionCol, minPosition0, minPosition1, 
+        cellSize, gridWidth, gridLength, agentCellCol, agentCellStartCol, 
+        agentCellOrderCol)
+    fillCellList(number_pois, poiPositionCol, minPosition0, minPosition1, 
+        cellSize, gridWidth, gridLength, poiCellCol, poiCellStartCol, 
+        poiCellOrderCol)
+    
+    for agentIndex in prange(number_agents, num_threads = threadCount, schedule = 'static'):
+        senseAgentGrid(agentIndex, minDistanceSqr, sensingRadius * sensingRadius,
+            gridWidth, gridLength, agentPositionCol, orientationCol, 
+            poiValueCol, poiPositionCol, observationCol, agentCellCol, 
+            agentCellStartCol, agentCellOrderCol, poiCellStartCol, 
+            poiCellOrderCol)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void fillCellList(int count, double[:, :] positionCol, 
+        double minPosition0, double minPosition1, double cellSize, 
+        int gridWidth, int gridLength, int[:] cellCol, int[:] cellStartCol, 
+        int[:] cellOrderCol) noexcept nogil:
+    """
+    Counting sort of positions into cells. Afterwards the indices in cell c
+    are cellOrderCol[cellStartCol[c]:cellStartCol[c + 1]], in index order.
+    """
+    cdef int index, cellIndex, cell0, cell1
+    cdef int cellCount = gridWidth * gridLength
+    
+    for cellIndex in range(cellCount + 1):
+        cellStartCol[cellIndex] = 0
+    
+    # Count the members of each cell (shifted by one)
+    for index in range(count):
+        cell0 = <int>((positionCol[index, 0] - minPosition0) / cellSize)
+        cell1 = <int>((positionCol[index, 1] - minPosition1) / cellSize)
+        cell0 = min(max(cell0, 0), gridWidth - 1)
+        cell1 = min(max(cell1, 0), gridLength - 1)
+        cellCol[index] = cell1 * gridWidth + cell0
+        cellStartCol[cellCol[index] + 1] += 1
+        
+    # Turn counts into start offsets
+    for cellIndex in range(cellCount):
+        cellStartCol[cellIndex + 1] += cellStartCol[cellIndex]
+    
+    # Place members, this moves each start offset to the next cell's start
+    for index in range(count):
+        cellOrderCol[cellStartCol[cellCol[index]]] = index
+        cellStartCol[cellCol[index]] += 1
+    
+    # Shift the offsets back
+    for cellIndex in range(cellCount, 0, -1):
+        cellStartCol[cellIndex] = cellStartCol[cellIndex - 1]
+    cellStartCol[0] = 0
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void senseAgentGrid(int agentIndex, double minDistanceSqr, 
+        double sensingRadiusSqr, int gridWidth, int gridLength, 
+        double[:, :] agentPositionCol, double[:, :] orientationCol, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double[:, :] observationCol, int[:] agentCellCol, 
+        int[:] agentCellStartCol, int[:] agentCellOrderCol, 
+        int[:] poiCellStartCol, int[:] poiCellOrderCol) noexcept nogil:
+    cdef int cell0 = agentCellCol[agentIndex] % gridWidth
+    cdef int cell1 = agentCellCol[agentIndex] // gridWidth
+    cdef int neighborCell0, neighborCell1, cellIndex, orderIndex
+    cdef int otherAgentIndex, poiIndex
+    
+    for neighborCell1 in range(max(cell1 - 1, 0), min(cell1 + 2, gridLength)):
+        for neighborCell0 in range(max(cell0 - 1, 0), min(cell0 + 2, gridWidth)):
+            cellIndex = neighborCell1 * gridWidth + neighborCell0
+            
+            # calculate observation values due to other agents in the cell
+            for orderIndex in range(agentCellStartCol[cellIndex], agentCellStartCol[cellIndex + 1]):
+                otherAgentIndex = agentCellOrderCol[orderIndex]
+                
+                # agents do not sense self (ergo skip self comparison)
+                if agentIndex == otherAgentIndex:
+                    continue
+                    
+                addQuadrantObservation(agentIndex, 0, 1.0, 
+                    agentPositionCol[otherAgentIndex, 0], 
+                    agentPositionCol[otherAgentIndex, 1], minDistanceSqr, 
+                    sensingRadiusSqr, agentPositionCol, orientationCol, 
+                    observationCol)
+            
+            # calculate observation values due to pois in the cell
+            for orderIndex in range(poiCellStartCol[cellIndex], poiCellStartCol[cellIndex + 1]):
+                poiIndex = poiCellOrderCol[orderIndex]
+                addQuadrantObservation(agentIndex, 4, poiValueCol[poiIndex], 
+                    poiPositionCol[poiIndex, 0], poiPositionCol[poiIndex, 1], 
+                    minDistanceSqr, sensingRadiusSqr, agentPositionCol, 
+                    orientationCol, observationCol)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef inline void addQuadrantObservation(int agentIndex, int obsOffset, 
+        double value, double otherPosition0, double otherPosition1, 
+        double minDistanceSqr, double sensingRadiusSqr, 
+        double[:, :] agentPositionCol, double[:, :] orientationCol, 
+        double[:, :] observationCol) noexcept nogil:
+    """
+    Adds value / distance^2 to the agent's sensor for the quadrant of the 
+    other position (sensors obsOffset to obsOffset + 3), like senseWorld()
+    """
+    cdef double globalFrameSeparation0, globalFrameSeparation1
+    cdef double agentFrameSeparation0, agentFrameSeparation1, distanceSqr
+    
+    # Get global separation vector between the agent and the other position
+    globalFrameSeparation0 = otherPosition0 - agentPositionCol[agentIndex,0]
+    globalFrameSeparation1 = otherPosition1 - agentPositionCol[agentIndex,1]
+    
+    # Ignore everything outside of the sensing radius
+    if globalFrameSeparation0 * globalFrameSeparation0 + globalFrameSeparation1 * globalFrameSeparation1 >= sensingRadiusSqr:
+        return
+    
+    # Translate separation to agent frame using inverse rotation matrix
+    agentFrameSeparation0 = orientationCol[agentIndex, 0] * globalFrameSeparation0 + orientationCol[agentIndex, 1] * globalFrameSeparation1 
+    agentFrameSeparation1 = orientationCol[agentIndex, 0] * globalFrameSeparation1 - orientationCol[agentIndex, 1] * globalFrameSeparation0 
+    distanceSqr = agentFrameSeparation0 * agentFrameSeparation0 + agentFrameSeparation1 * agentFrameSeparation1
+    
+    # By bounding distance value we implicitly bound sensor values
+    if distanceSqr < minDistanceSqr:
+        distanceSqr = minDistanceSqr
+    
+    # other is east of agent
+    if agentFrameSeparation0 > 0:
+        # other is north-east of agent
+        if agentFrameSeparation1 > 0:
+            observationCol[agentIndex, obsOffset + 0] += value / distanceSqr
+        else: # other is south-east of agent
+            observationCol[agentIndex, obsOffset + 3] += value / distanceSqr
+    else:  # other is west of agent
+        # other is north-west of agent
+        if agentFrameSeparation1 > 0:
+            observationCol[agentIndex, obsOffset + 1] += value / distanceSqr
+        else:  # other is south-west of agent
+            observationCol[agentIndex, obsOffset + 2] += value / distanceSqr
+
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing. 
 cpdef doAgentProcess(data):
     cdef int number_agents = data['Number of Agents']
-    actionCol = np.zeros((number_agents, 2), dtype = np.float_)
     policyCol = data["Agent Policies"]
     observationCol = data["Agent Observations"]
-    cdef int agentIndex
-    for agentIndex in range(number_agents):
-        actionCol[agentIndex] = policyCol[agentIndex].get_action(observationCol[agentIndex])
+    cdef int agentIndex, worldIndex
+    if observationCol.ndim == 3:
+        actionCol = np.zeros((observationCol.shape[0], number_agents, 2), dtype = np.float_)
+        for worldIndex in range(observationCol.shape[0]):
+            for agentIndex in range(number_agents):
+                actionCol[worldIndex, agentIndex] = \
+                    policyCol[worldIndex][agentIndex].get_action(observationCol[worldIndex, agentIndex])
+    else:
+        actionCol = np.zeros((number_agents, 2), dtype = np.float_)
+        for agentIndex in range(number_agents):
+            actionCol[agentIndex] = policyCol[agentIndex].get_action(observationCol[agentIndex])
+    data["Agent Actions"] = actionCol
+
+def doAgentProcessStacked(data):
+    """
+    Computes the actions of all agents at once from the policy weights 
+    stacked by stackAgentPolicies() in ccea_2, with one batched matrix 
+    product per layer (relu hidden layer, tanh output layer like Evo_MLP)
+    """
+    inToHiddenStack, inToHiddenBiasStack, hiddenToOutStack, hiddenToOutBiasStack = \
+        data["Agent Policy Stack"]
+    observationCol = data["Agent Observations"]
+    
+    hiddenCol = np.matmul(inToHiddenStack, observationCol[..., np.newaxis])[..., 0]
+    hiddenCol += inToHiddenBiasStack
+    np.maximum(hiddenCol, 0.0, out = hiddenCol)
+    actionCol = np.matmul(hiddenToOutStack, hiddenCol[..., np.newaxis])[..., 0]
+    actionCol += hiddenToOutBiasStack
+    np.tanh(actionCol, out = actionCol)
+    
     data["Agent Actions"] = actionCol
 
 @cython.boundscheck(False)  # Deactivate bounds checking
@@ -118,18 +461,41 @@ cpdef doAgentMove(data):
     cdef float worldWidth = data["World Width"]
     cdef float worldLength = data["World Length"]
     cdef int number_agents = data['Number of Agents']
-    cdef double[:, :] agentPositionCol = data["Agent Positions"]
-    cdef double[:, :] orientationCol = data["Agent Orientations"]
+    cdef int threadCount = data.get("Thread Count", 1)
+    npAgentPositionCol = data["Agent Positions"]
+    npOrientationCol = data["Agent Orientations"]
     npActionCol = np.array(data["Agent Actions"]).astype(np.float_)
     npActionCol = np.clip(npActionCol, -1, 1)
-    cdef double[:, :] actionCol = npActionCol
     
+    cdef int worldIndex
+    cdef double[:, :, :] agentPositionBatch, orientationBatch, actionBatch
+    
+    if npAgentPositionCol.ndim == 3:
+        agentPositionBatch = npAgentPositionCol
+        orientationBatch = npOrientationCol
+        actionBatch = npActionCol
+        for worldIndex in range(agentPositionBatch.shape[0]):
+            moveWorld(number_agents, agentPositionBatch[worldIndex], 
+                orientationBatch[worldIndex], actionBatch[worldIndex], 
+                threadCount)
+    else:
+        moveWorld(number_agents, npAgentPositionCol, npOrientationCol, 
+            npActionCol, threadCount)
+
+    data["Agent Positions"]  = npAgentPositionCol
+    data["Agent Orientations"] = npOrientationCol 
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.  
+cdef void moveWorld(int number_agents, double[:, :] agentPositionCol, 
+        double[:, :] orientationCol, double[:, :] actionCol, 
+        int threadCount) noexcept nogil:
     cdef int agentIndex
 
     cdef double globalFrameMotion0, globalFrameMotion1, norm
     
     # move all agents
-    for agentIndex in range(number_agents):
+    for agentIndex in prange(number_agents, num_threads = threadCount, schedule = 'static'):
 
         # turn action into global frame motion
         globalFrameMotion0 = orientationCol[agentIndex, 0] * actionCol[agentIndex, 0] - orientationCol[agentIndex, 1] * actionCol[agentIndex, 1] 
@@ -158,7 +524,176 @@ cpdef doAgentMove(data):
         #     agentPositionCol[agentIndex,1] = worldLength
         # elif agentPositionCol[agentIndex,1] < 0.0:
         #     agentPositionCol[agentIndex,1] = 0.0
-        
 
-    data["Agent Positions"]  = agentPositionCol
-    data["Agent Orientations"] = orientationCol 
\ No newline at end of file
+def doAgentRollout(data):
+    """
+    Runs the whole world (data["Steps"] steps of doAgentSense(), policy 
+    inference, doAgentMove() and trajectory recording) in one compiled call.
+    Policies are read from data["Agent Policy Stack"] (see 
+    stackAgentPolicies() in ccea_2) and computed like Evo_MLP.get_action().
+    Use as a world end function before the reward function, with no step 
+    functions; data["Observation Function"] is not used.
+    
+    Sets "Agent Position History" and "Agent Orientation History" like
+    createTrajectoryHistories() and updateTrajectoryHistories(), and leaves
+    the final positions, orientations and last observations and actions in 
+    data. Supports a leading world axis and data["Sensing Radius"] like 
+    doAgentSense().
+    """
+    cdef int number_agents = data['Number of Agents']
+    cdef int number_pois = data['Number of POIs'] 
+    cdef int stepCount = data["Steps"]
+    cdef double minDistanceSqr = data["Minimum Distance"] ** 2
+    cdef int threadCount = data.get("Thread Count", 1)
+    cdef double sensingRadius = getSensingRadius(data)
+    npAgentPositionCol = data["Agent Positions"]
+    npOrientationCol = data["Agent Orientations"]
+    npPoiValueCol = data['Poi Values']
+    npPoiPositionCol = data["Poi Positions"]
+    npInToHiddenStack, npInToHiddenBiasStack, npHiddenToOutStack, npHiddenToOutBiasStack = \
+        data["Agent Policy Stack"]
+    
+    # Treat a single world as a batch of one
+    cdef bint isBatch = npAgentPositionCol.ndim == 3
+    if not isBatch:
+        npAgentPositionCol = npAgentPositionCol[np.newaxis]
+        npOrientationCol = npOrientationCol[np.newaxis]
+        npPoiValueCol = npPoiValueCol[np.newaxis]
+        npPoiPositionCol = npPoiPositionCol[np.newaxis]
+        npInToHiddenStack = npInToHiddenStack[np.newaxis]
+        npInToHiddenBiasStack = npInToHiddenBiasStack[np.newaxis]
+        npHiddenToOutStack = npHiddenToOutStack[np.newaxis]
+        npHiddenToOutBiasStack = npHiddenToOutBiasStack[np.newaxis]
+    
+    cdef int worldCount = npAgentPositionCol.shape[0]
+    cdef int hiddenCount = npInToHiddenStack.shape[2]
+    cdef int outputCount = npHiddenToOutStack.shape[2]
+    npObservationCol = np.zeros((worldCount, number_agents, 8))
+    npHiddenCol = np.zeros((number_agents, hiddenCount))
+    npActionCol = np.zeros((worldCount, number_agents, outputCount))
+    npAgentPositionHistory = np.zeros((worldCount, stepCount + 1, number_agents, 2))
+    npAgentOrientationHistory = np.zeros((worldCount, stepCount + 1, number_agents, 2))
+    grid = getSensingGrid(data)
+    
+    cdef double[:, :, :] agentPositionBatch = npAgentPositionCol
+    cdef double[:, :, :] orientationBatch = npOrientationCol
+    cdef double[:, :] poiValueBatch = npPoiValueCol
+    cdef double[:, :, :] poiPositionBatch = npPoiPositionCol
+    cdef double[:, :, :, :] inToHiddenBatch = npInToHiddenStack
+    cdef double[:, :, :] inToHiddenBiasBatch = npInToHiddenBiasStack
+    cdef double[:, :, :, :] hiddenToOutBatch = npHiddenToOutStack
+    cdef double[:, :, :] hiddenToOutBiasBatch = npHiddenToOutBiasStack
+    cdef double[:, :, :] observationBatch = npObservationCol
+    cdef double[:, :, :] actionBatch = npActionCol
+    cdef double[:, :, :, :] agentPositionHistoryBatch = npAgentPositionHistory
+    cdef double[:, :, :, :] agentOrientationHistoryBatch = npAgentOrientationHistory
+    cdef int worldIndex
+    
+    for worldIndex in range(worldCount):
+        rolloutWorld(number_agents, number_pois, stepCount, minDistanceSqr, 
+            sensingRadius, grid, agentPositionBatch[worldIndex], orientationBatch[worldIndex], 
+            poiValueBatch[worldIndex], poiPositionBatch[worldIndex], 
+            inToHiddenBatch[worldIndex], inToHiddenBiasBatch[worldIndex], 
+            hiddenToOutBatch[worldIndex], hiddenToOutBiasBatch[worldIndex], 
+            observationBatch[worldIndex], npHiddenCol, actionBatch[worldIndex],
+            agentPositionHistoryBatch[worldIndex], 
+            agentOrientationHistoryBatch[worldIndex], threadCount)
+    
+    if not isBatch:
+        npObservationCol = npObservationCol[0]
+        npActionCol = npActionCol[0]
+        npAgentPositionHistory = npAgentPositionHistory[0]
+        npAgentOrientationHistory = npAgentOrientationHistory[0]
+        
+    data["Agent Observations"] = npObservationCol
+    data["Agent Actions"] = npActionCol
+    data["Agent Position History"] = npAgentPositionHistory
+    data["Agent Orientation History"] = npAgentOrientationHistory
+    
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.  
+cdef rolloutWorld(int number_agents, int number_pois, int stepCount, 
+        double minDistanceSqr, double sensingRadius, object grid, 
+        double[:, :] agentPositionCol, 
+        double[:, :] orientationCol, double[:] poiValueCol, 
+        double[:, :] poiPositionCol, double[:, :, :] inToHiddenStack, 
+        double[:, :] inToHiddenBiasStack, double[:, :, :] hiddenToOutStack, 
+        double[:, :] hiddenToOutBiasStack, double[:, :] observationCol, 
+        double[:, :] hiddenCol, double[:, :] actionCol, 
+        double[:, :, :] agentPositionHistory, 
+        double[:, :, :] agentOrientationHistory, int threadCount):
+    cdef int stepIndex
+    cdef int[:] agentCellCol = grid.agentCellCol
+    cdef int[:] agentCellStartCol = grid.agentCellStartCol
+    cdef int[:] agentCellOrderCol = grid.agentCellOrderCol
+    cdef int[:] poiCellCol = grid.poiCellCol
+    cdef int[:] poiCellStartCol = grid.poiCellStartCol
+    cdef int[:] poiCellOrderCol = grid.poiCellOrderCol
+    
+    agentPositionHistory[0, :, :] = agentPositionCol
+    agentOrientationHistory[0, :, :] = orientationCol
+    
+    with nogil:
+        for stepIndex in range(stepCount):
+            observationCol[:, :] = 0.0
+            if sensingRadius == INFINITY:
+                senseWorld(number_agents, number_pois, minDistanceSqr, 
+                    agentPositionCol, orientationCol, poiValueCol, 
+                    poiPositionCol, observationCol, threadCount)
+            else:
+                senseWorldGrid(number_agents, number_pois, minDistanceSqr, 
+                    sensingRadius, agentPositionCol, orientationCol, 
+                    poiValueCol, poiPositionCol, observationCol, agentCellCol, 
+                    agentCellStartCol, agentCellOrderCol, poiCellCol, 
+                    poiCellStartCol, poiCellOrderCol, threadCount)
+            inferWorld(number_agents, inToHiddenStack, inToHiddenBiasStack, 
+                hiddenToOutStack, hiddenToOutBiasStack, observationCol, 
+                hiddenCol, actionCol, threadCount)
+            moveWorld(number_agents, agentPositionCol, orientationCol, 
+                actionCol, threadCount)
+            
+            agentPositionHistory[stepIndex + 1, :, :] = agentPositionCol
+            agentOrientationHistory[stepIndex + 1, :, :] = orientationCol
+        
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.  
+cdef void inferWorld(int number_agents, double[:, :, :] inToHiddenStack, 
+        double[:, :] inToHiddenBiasStack, double[:, :, :] hiddenToOutStack, 
+        double[:, :] hiddenToOutBiasStack, double[:, :] observationCol, 
+        double[:, :] hiddenCol, double[:, :] actionCol, int threadCount) noexcept nogil:
+    cdef int agentIndex
+    
+    for agentIndex in prange(number_agents, num_threads = threadCount, schedule = 'static'):
+        inferAgent(agentIndex, inToHiddenStack, inToHiddenBiasStack, 
+            hiddenToOutStack, hiddenToOutBiasStack, observationCol, hiddenCol, 
+            actionCol)
+            
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.  
+cdef void inferAgent(int agentIndex, double[:, :, :] inToHiddenStack, 
+        double[:, :] inToHiddenBiasStack, double[:, :, :] hiddenToOutStack, 
+        double[:, :] hiddenToOutBiasStack, double[:, :] observationCol, 
+        double[:, :] hiddenCol, double[:, :] actionCol) noexcept nogil:
+    cdef int rowIndex, colIndex
+    cdef double sum
+    
+    # relu hidden layer
+    for rowIndex in range(inToHiddenStack.shape[1]):
+        sum = 0
+        for colIndex in range(inToHiddenStack.shape[2]):
+            sum += inToHiddenStack[agentIndex, rowIndex, colIndex] * observationCol[agentIndex, colIndex]
+        sum += inToHiddenBiasStack[agentIndex, rowIndex]
+        hiddenCol[agentIndex, rowIndex] = sum * (sum > 0)
+        
+    # tanh output layer, clipped to the action range like doAgentMove()
+    for rowIndex in range(hiddenToOutStack.shape[1]):
+        sum = 0
+        for colIndex in range(hiddenToOutStack.shape[2]):
+            sum += hiddenToOutStack[agentIndex, rowIndex, colIndex] * hiddenCol[agentIndex, colIndex]
+        sum += hiddenToOutBiasStack[agentIndex, rowIndex]
+        sum = tanh(sum)
+        if sum > 1.0:
+            sum = 1.0
+        elif sum < -1.0:
+            sum = -1.0
+        actionCol[agentIndex, rowIndex] = sum
@@ -0,0 +1,116 @@
+"""
+Background writing for the save functions (saveRewardHistory(),
+    saveTrajectoryHistories(), archiveTrajectoryHistories(), savePickle()).
+
+While data["Async Writer"] holds an AsyncWriter (see startAsyncWriter()),
+    save functions copy what they write into immutable snapshots and submit
+    the writing to it instead of writing on the simulation thread. The
+    simulation only waits on disk when data["Async Writer Queue Size"]
+    writes (default 16) are already waiting, and at stopAsyncWriter().
+    Writes are done in the order they are submitted.
+"""
+import atexit
+import os
+import queue
+import threading
+import numpy as np
+
+class AsyncWriter:
+    """
+    Runs submitted write functions in order on a background thread, with a
+        bounded queue. Pending writes are also flushed when the interpreter
+        exits (e.g. after a crash). An exception raised by a write is
+        raised again by the next submit(), flush() or close().
+    """
+    def __init__(self, maxQueueSize = 16):
+        self.taskQueue = queue.Queue(maxQueueSize)
+        self.error = None
+        self.processId = os.getpid()
+        self.thread = threading.Thread(target = self.runWrites, daemon = True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def runWrites(self):
+        while True:
+            task = self.taskQueue.get()
+            try:
+                if task is None:
+                    return
+                writeFunc, args = task
+                if self.error is None:
+                    writeFunc(*args)
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.taskQueue.task_done()
+
+    def raiseError(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def submit(self, writeFunc, *args):
+        """
+        Queue writeFunc(*args), blocking while the queue is full. Writes
+            submitted from another process (e.g. a forked worker) or after
+            close() are done immediately instead.
+        """
+        self.raiseError()
+        if os.getpid() != self.processId or not self.thread.is_alive():
+            writeFunc(*args)
+            return
+        self.taskQueue.put((writeFunc, args))
+
+    def flush(self):
+        """
+        Wait until all submitted writes are done
+        """
+        if os.getpid() == self.processId and self.thread.is_alive():
+            self.taskQueue.join()
+        self.raiseError()
+
+    def close(self):
+        """
+        Flush and stop the writer thread
+        """
+        if os.getpid() == self.processId and self.thread.is_alive():
+            self.taskQueue.put(None)
+            self.thread.join()
+        atexit.unregister(self.close)
+        self.raiseError()
+
+def startAsyncWriter(data):
+    """
+    Start writing in the background, use as a trial begin function
+    """
+    data["Async Writer"] = AsyncWriter(data.get("Async Writer Queue Size", 16))
+
+def stopAsyncWriter(data):
+    """
+    Wait for all writes and stop the writer, use as the last trial end
+        function
+    """
+    writer = data.get("Async Writer")
+    data["Async Writer"] = None
+    if writer is not None:
+        writer.close()
+
+def submitWrite(data, writeFunc, *args):
+    """
+    Do writeFunc(*args) with data["Async Writer"] if there is one, otherwise
+        immediately
+    """
+    writer = data.get("Async Writer")
+    if writer is None:
+        writeFunc(*args)
+    else:
+        writer.submit(writeFunc, *args)
+
+def getArraySnapshot(array):
+    """
+    Returns a read only copy of array
+    """
+    snapshot = np.array(array)
+    snapshot.setflags(write = False)
+    return snapshot
@@ -0,0 +1,96 @@
+"""
+Selects the implementation of the kernel modules code.agent_domain_2,
+code.reward_2 and code.ccea_2 when first imported. Entry points import it
+before those modules:
+
+    import code.backend # Compiled or NumPy kernels, see code/backend.py
+
+Backends, tried in this order unless the environment variable
+ROVER_DOMAIN_BACKEND names one of them:
+    "compiled"   extension modules built ahead of time, from the
+                 repository root, with
+                     python code/setup.py build_ext --inplace
+    "pyximport"  the .pyx files compiled by pyximport on first import
+                 (needs Cython and a C compiler, and tens of seconds for
+                 every new build directory)
+    "numpy"      the NumPy modules code.agent_domain, code.reward and
+                 code.ccea, with the same functions and results but slower,
+                 no compiler needed
+When "numpy" is selected, code.agent_domain_2, code.reward_2 and code.ccea_2
+are aliases of the NumPy modules, so the usual imports work unchanged.
+backendName is the selected backend.
+"""
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import warnings
+import code
+
+# Compiled module name: NumPy module name
+kernelModuleNameDict = {
+    "agent_domain_2": "agent_domain",
+    "reward_2": "reward",
+    "ccea_2": "ccea",
+}
+
+backendNameCol = ("compiled", "pyximport", "numpy")
+
+def importCompiledKernels():
+    for moduleName in kernelModuleNameDict:
+        # Never use a module built from an older .pyx file
+        spec = importlib.util.find_spec("code." + moduleName)
+        pyxFileName = os.path.join(os.path.dirname(code.__file__), moduleName + ".pyx")
+        if spec is not None and spec.origin.endswith(tuple(importlib.machinery.EXTENSION_SUFFIXES)) \
+                and os.path.getmtime(spec.origin) < os.path.getmtime(pyxFileName):
+            raise ImportError("%s is older than %s, build it again"%(spec.origin, pyxFileName))
+        importlib.import_module("code." + moduleName)
+
+def importPyximportKernels():
+    import pyximport
+    pyxImporter = pyximport.install()[1] # For cython(pyx) code
+    # Build the .pyx files instead of using older modules built in place
+    sys.meta_path.remove(pyxImporter)
+    sys.meta_path.insert(0, pyxImporter)
+    importCompiledKernels()
+
+def importNumpyKernels():
+    for moduleName, numpyModuleName in kernelModuleNameDict.items():
+        module = importlib.import_module("code." + numpyModuleName)
+        sys.modules["code." + moduleName] = module
+        setattr(code, moduleName, module)
+
+def loadBackend(requestedBackendName = None):
+    """
+    Imports the kernels of the requested backend, or of the first backend
+        that works if requestedBackendName is None or "auto"
+
+    Returns:
+        str: name of the loaded backend
+    """
+    importFuncDict = {
+        "compiled": importCompiledKernels,
+        "pyximport": importPyximportKernels,
+        "numpy": importNumpyKernels,
+    }
+    if requestedBackendName not in (None, "auto"):
+        if requestedBackendName not in importFuncDict:
+            raise ValueError("Unknown kernel backend %r, use one of %s"%
+                (requestedBackendName, ", ".join(backendNameCol)))
+        importFuncDict[requestedBackendName]()
+        return requestedBackendName
+
+    errorCol = []
+    for backendName in backendNameCol:
+        try:
+            importFuncDict[backendName]()
+        except ImportError as error: # e.g. not built, no Cython or no compiler
+            errorCol.append("%s: %s"%(backendName, error))
+            continue
+        if backendName == "numpy":
+            warnings.warn("Using the slower NumPy kernels, the compiled kernels "
+                "could not be loaded (%s)"%"; ".join(errorCol))
+        return backendName
+
+backendName = loadBackend(os.environ.get("ROVER_DOMAIN_BACKEND"))
@@ -0,0 +1,56 @@
+"""
+Compiler flags shared by the .pyxbld files (pyximport builds) and
+code/setup.py (builds ahead of time).
+
+The prange loops of the kernels use OpenMP threads when compiled with
+-fopenmp, and run on one thread otherwise, with the same results. Whether
+the C compiler supports -fopenmp is found by building a small test program
+with it, unless the environment variable ROVER_DOMAIN_OPENMP is set to "1"
+(always use -fopenmp) or "0" (never use it).
+"""
+import os
+import shlex
+import subprocess
+import sysconfig
+import tempfile
+
+openmpTestSource = """
+#include <omp.h>
+int main(void) { return omp_get_max_threads() > 0 ? 0 : 1; }
+"""
+
+def hasOpenMP():
+    """
+    Returns:
+        bool: True if the C compiler (the CC environment variable or the one
+            Python was built with) can compile and link with -fopenmp
+    """
+    compilerCommand = os.environ.get("CC") or sysconfig.get_config_var("CC")
+    if not compilerCommand:
+        return False
+    with tempfile.TemporaryDirectory() as buildDirectory:
+        sourceFileName = os.path.join(buildDirectory, "openmp_test.c")
+        with open(sourceFileName, 'w') as sourceFile:
+            sourceFile.write(openmpTestSource)
+        try:
+            result = subprocess.run(shlex.split(compilerCommand) + ["-fopenmp",
+                sourceFileName, "-o", os.path.join(buildDirectory, "openmp_test")],
+                stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        except OSError:
+            return False
+    return result.returncode == 0
+
+def getOpenMPArgs():
+    """
+    Returns:
+        list: the extra compile and link args that turn on OpenMP, empty if
+            OpenMP is not available or ROVER_DOMAIN_OPENMP is "0"
+    """
+    useOpenMP = os.environ.get("ROVER_DOMAIN_OPENMP")
+    if useOpenMP is None:
+        useOpenMP = hasOpenMP()
+    elif useOpenMP not in ("0", "1"):
+        raise ValueError('ROVER_DOMAIN_OPENMP must be "0" or "1", not %r'%(useOpenMP))
+    else:
+        useOpenMP = useOpenMP == "1"
+    return ['-fopenmp'] if useOpenMP else []
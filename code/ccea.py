@@ -1,125 +1,356 @@
-# WARNING: Deprecated until this updated to be like ccea_2
-# import numpy as np
-# import math
-# import torch
-# import torch.nn as nn
-# import torch.nn.functional as F
-# import random
-# from numba import jit
-# from torch.autograd import Variable
-# from torch import Tensor
-# 
-# 
-# 
-# class RandomPolicy:
-#     def __init__(self, output_shape, low=-1, high=1):
-#         self.output_shape = output_shape
-#         self.low = low
-#         self.high = high
-# 
-#     def get_next(self,state):
-#         return np.random.uniform(self.low, self.high, self.output_shape)
-#         
-# class Evo_MLP(nn.Module):
-#     def __init__(self, input_shape, num_outputs, num_units=16):
-#         super(Evo_MLP, self).__init__()
-#         
-#         self.input_shape = input_shape
-#         self.num_outputs = num_outputs
-#         self.num_units = num_units
-#         self.fitness = float("-inf")
-# 
-#         self.fc1 = nn.Linear(input_shape, num_units)
-#         self.fc2 = nn.Linear(num_units, num_outputs)
-#         
-#         for param in self.parameters():
-#             param.requires_grad = False
-#             
-# 
-#     def get_action(self, state):
-#         x = Variable(torch.FloatTensor(state))
-#         x = self.fc1(x).tanh()
-#         y = self.fc2(x).tanh()
-#         return y.numpy()
-#         
-#     def init_weights(m):
-#         #Not implemented
-#         if type(m) == nn.Linear:
-#             m.weight.data.normal_(0, 2)
-# 
-#     def mutate(self):
-#         m = 10
-#         mr = 0.01
-#         random_w1 = np.random.normal(0, m, list(self.fc1.weight.size()))
-#         random_w1 *= (np.random.uniform(size = list(self.fc1.weight.size())) < mr).astype(float)
-#         random_w2 = np.random.normal(0, m, list(self.fc2.weight.size()))
-#         random_w2 *= (np.random.uniform(size = list(self.fc2.weight.size())) < mr).astype(float)
-#         self.fc1.weight += Tensor(random_w1)
-#         self.fc2.weight += Tensor(random_w2)
-#         
-#     def copy(self):
-#         newMlp = Evo_MLP(self.input_shape, self.num_outputs, self.num_units)
-#         newMlp.load_state_dict(self.state_dict())
-#         return newMlp
-# 
-# 
-# 
-# def initCcea(input_shape, num_outputs, num_units=16):
-#     def initCceaGo(data):
-#         number_agents = data['Number of Agents']
-#         populationCol = [[Evo_MLP(input_shape,num_outputs,num_units) for i in range(data['Trains per Episode'])] for j in range(number_agents)] 
-#         data['Agent Populations'] = populationCol
-#     return initCceaGo
-#     
-# def assignCceaPolicies(data):
-#     number_agents = data['Number of Agents']
-#     populationCol = data['Agent Populations']
-#     worldIndex = data["World Index"]
-#     policyCol = [None] * number_agents
-#     for agentIndex in range(number_agents):
-#         policyCol[agentIndex] = populationCol[agentIndex][worldIndex]
-#     data["Agent Policies"] = policyCol
-#     
-# def assignBestCceaPolicies(data):
-#     number_agents = data['Number of Agents']
-#     populationCol = data['Agent Populations']
-#     policyCol = [None] * number_agents
-#     for agentIndex in range(number_agents):
-#         policyCol[agentIndex] = max(populationCol[agentIndex], key = lambda policy: policy.fitness)
-#         #policyCol[agentIndex] = populationCol[agentIndex][0]
-#     data["Agent Policies"] = policyCol
-# 
-# def rewardCceaPolicies(data):
-#     policyCol = data["Agent Policies"]
-#     number_agents = data['Number of Agents']
-#     rewardCol = data["Agent Rewards"]
-#     for agentIndex in range(number_agents):
-#         policyCol[agentIndex].fitness = rewardCol[agentIndex]
-#     
-# def evolveCceaPolicies(data): 
-#     number_agents = data['Number of Agents']
-#     populationCol = data['Agent Populations']
-#     for agentIndex in range(number_agents):
-#         population = populationCol[agentIndex]
-#         newPopulation = [None] * len(population)
-# 
-#         # Binary Tournament
-#         newPolicyIndex = 0
-#         for matchIndex in range(len(population)//2):
-#             if population[2 * matchIndex].fitness > population[2 * matchIndex + 1].fitness:
-#                 newPopulation[matchIndex] = population[2 * matchIndex]
-#             else:
-#                 newPopulation[matchIndex] = population[2 * matchIndex + 1]
-#             newPolicyIndex += 1
-#             
-#         # Random fill with mutation
-#         elite = newPopulation[:newPolicyIndex]
-#         while newPolicyIndex < len(population):
-#             newPolicy = random.choice(elite).copy()
-#             newPolicy.mutate()
-#             newPopulation[newPolicyIndex] = newPolicy
-#             newPolicyIndex += 1
-#             
-#         random.shuffle(newPopulation)
-#         data['Agent Populations'][agentIndex] = newPopulation
-#         
\ No newline at end of file
+"""
+NumPy implementation of ccea_2 (see code/backend.py), with the same
+functions and the same results. Evo_MLP keeps its weights in NumPy arrays
+and adds the products of its layers in the order of the compiled loops.
+"""
+import numpy as np
+import random
+from code.agent_domain import cTanh, sumInOrder
+from code.random_streams import getRandomState
+
+def mutate(vec, m, mr, randomState):
+    shape = [vec.shape[0]]
+    npMutation = randomState.standard_cauchy(shape)
+    npMutation *= randomState.uniform(0, 1, shape) < mr
+    vec += npMutation
+
+def mutateMat(mat, m, mr, randomState):
+    shape = [mat.shape[0], mat.shape[1]]
+    npMutation = m * randomState.standard_cauchy(shape)
+    npMutation *= randomState.uniform(0, 1, shape) < mr
+    mat += npMutation
+
+class Evo_MLP:
+    def __init__(self, input_shape, num_outputs, num_units=16, randomState=None):
+        self.input_shape = input_shape
+        self.num_outputs = num_outputs
+        self.num_units = num_units
+        self.fitness = 0
+        if randomState is None:
+            randomState = np.random
+
+        # XAVIER INITIALIZATION
+        stdev = (3/ input_shape) ** 0.5
+        self.npInToHiddenMat = randomState.uniform(-stdev, stdev, (num_units, input_shape))
+        self.npInToHiddenBias = randomState.uniform(-stdev, stdev, num_units)
+        stdev = (3/ num_units) ** 0.5
+        self.npHiddenToOutMat = randomState.uniform(-stdev, stdev, (num_outputs, num_units))
+        self.npHiddenToOutBias = randomState.uniform(-stdev, stdev, num_outputs)
+
+        self.npHidden = np.zeros(num_units)
+        self.npOut = np.zeros(num_outputs)
+
+    # The compiled Evo_MLP stores these as C ints and doubles
+    input_shape = property(lambda self: self._input_shape,
+        lambda self, value: setattr(self, "_input_shape", int(value)))
+    num_outputs = property(lambda self: self._num_outputs,
+        lambda self, value: setattr(self, "_num_outputs", int(value)))
+    num_units = property(lambda self: self._num_units,
+        lambda self, value: setattr(self, "_num_units", int(value)))
+    fitness = property(lambda self: self._fitness,
+        lambda self, value: setattr(self, "_fitness", float(value)))
+
+    # The compiled Evo_MLP's memoryviews of the weights
+    inToHiddenMat = property(lambda self: self.npInToHiddenMat)
+    inToHiddenBias = property(lambda self: self.npInToHiddenBias)
+    hiddenToOutMat = property(lambda self: self.npHiddenToOutMat)
+    hiddenToOutBias = property(lambda self: self.npHiddenToOutBias)
+    hidden = property(lambda self: self.npHidden)
+    out = property(lambda self: self.npOut)
+
+    def get_action(self, state):
+        state = np.asarray(state, dtype = np.float64)
+        self.npHidden[:] = sumInOrder(self.npInToHiddenMat * state, axis = 1)
+        self.npHidden += self.npInToHiddenBias
+        self.npHidden *= self.npHidden > 0
+        self.npOut[:] = sumInOrder(self.npHiddenToOutMat * self.npHidden, axis = 1)
+        self.npOut += self.npHiddenToOutBias
+        self.npOut[:] = cTanh(self.npOut)
+        return self.npOut
+
+    def mutate(self, randomState=None):
+        m = 1
+        mr = 0.01
+        if randomState is None:
+            randomState = np.random
+        mutateMat(self.npInToHiddenMat, m, mr, randomState)
+        mutate(self.npInToHiddenBias, m, mr, randomState)
+        mutateMat(self.npHiddenToOutMat, m, mr, randomState)
+        mutate(self.npHiddenToOutBias, m, mr, randomState)
+
+
+    def copyFrom(self, other):
+        self.input_shape = other.input_shape
+        self.num_outputs = other.num_outputs
+        self.num_units = other.num_units
+
+        self.npInToHiddenMat[:] = other.npInToHiddenMat
+        self.npInToHiddenBias[:] = other.npInToHiddenBias
+        self.npHiddenToOutMat[:] = other.npHiddenToOutMat
+        self.npHiddenToOutBias[:] = other.npHiddenToOutBias
+
+    def useParams(self, params):
+        """
+        Makes the weights views into a flat parameter array (see
+        getParamCount()), laid out as input to hidden matrix, hidden bias,
+        hidden to output matrix and output bias
+        """
+        start = 0
+        inToHiddenCount = self.num_units * self.input_shape
+        hiddenToOutCount = self.num_outputs * self.num_units
+        self.npInToHiddenMat = params[start:start + inToHiddenCount].reshape(
+            (self.num_units, self.input_shape))
+        start += inToHiddenCount
+        self.npInToHiddenBias = params[start:start + self.num_units]
+        start += self.num_units
+        self.npHiddenToOutMat = params[start:start + hiddenToOutCount].reshape(
+            (self.num_outputs, self.num_units))
+        start += hiddenToOutCount
+        self.npHiddenToOutBias = params[start:start + self.num_outputs]
+
+    def getWeights(self):
+        return (
+            self.npInToHiddenMat.copy(),
+            self.npInToHiddenBias.copy(),
+            self.npHiddenToOutMat.copy(),
+            self.npHiddenToOutBias.copy()
+        )
+
+    def setWeights(self, weights):
+        newInToHiddenMat, newInToHiddenBias, newHiddenToOutMat, newHiddenToOutBias = weights
+        self.npInToHiddenMat[:] = newInToHiddenMat
+        self.npInToHiddenBias[:] = newInToHiddenBias
+        self.npHiddenToOutMat[:] = newHiddenToOutMat
+        self.npHiddenToOutBias[:] = newHiddenToOutBias
+
+def initCcea(input_shape, num_outputs, num_units=16):
+    def initCceaGo(data):
+        number_agents = data['Number of Agents']
+
+        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units,getRandomState(data, "Init Policy", j, i)) for i in range(data['Trains per Episode'])] for j in range(number_agents)]
+        data['Agent Populations'] = populationCol
+    return initCceaGo
+
+def getParamCount(input_shape, num_outputs, num_units=16):
+    return num_units * input_shape + num_units + num_outputs * num_units + num_outputs
+
+def initCceaArray(input_shape, num_outputs, num_units=16):
+    """
+    Like initCcea(), but all policy weights are stored in one contiguous
+    array data['Agent Population Params'] (agents by population by
+    parameters, see Evo_MLP.useParams()). data['Agent Populations'] holds
+    Evo_MLP views into that array, so the usual policy assignment and reward
+    functions work unchanged. Evolve with evolveCceaArrayPolicies().
+    """
+    def initCceaGo(data):
+        number_agents = data['Number of Agents']
+        policyCount = data['Trains per Episode']
+
+        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units,getRandomState(data, "Init Policy", j, i)) for i in range(policyCount)] for j in range(number_agents)]
+        paramArray = np.array([
+            [np.concatenate(policy.getWeights(), axis = None) for policy in population]
+            for population in populationCol
+        ])
+        for agentIndex in range(number_agents):
+            for policyIndex in range(policyCount):
+                populationCol[agentIndex][policyIndex].useParams(paramArray[agentIndex, policyIndex])
+
+        data['Agent Population Params'] = paramArray
+        data['Agent Populations'] = populationCol
+    return initCceaGo
+
+def initCcea2(input_shape, num_outputs, num_units=16):
+    def initCceaGo(data):
+        number_agents = data['Number of Agents']
+        policyCount = data['Number of Policies']
+        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units,getRandomState(data, "Init Policy", j, i)) for i in range(policyCount)] for j in range(number_agents)]
+        data['Agent Populations'] = populationCol
+    return initCceaGo
+
+def clearFitness(data):
+    populationCol = data['Agent Populations']
+    number_agents = data['Number of Agents']
+
+    for agentIndex in range(number_agents):
+        for policy in populationCol[agentIndex]:
+            policy.fitness = 0
+
+def assignCceaPolicies(data):
+    number_agents = data['Number of Agents']
+    populationCol = data['Agent Populations']
+    worldIndex = data["World Index"]
+    worldCount = data.get("World Batch Size")
+
+    # Assign one team per world when running worlds in lockstep
+    if worldCount is not None:
+        data["Agent Policies"] = [
+            [populationCol[agentIndex][worldIndex] for agentIndex in range(number_agents)]
+            for worldIndex in range(worldCount)
+        ]
+        return
+
+    policyCol = [None] * number_agents
+    for agentIndex in range(number_agents):
+        policyCol[agentIndex] = populationCol[agentIndex][worldIndex]
+    data["Agent Policies"] = policyCol
+
+def assignCceaPolicies2(data):
+    number_agents = data['Number of Agents']
+    populationCol = data['Agent Populations']
+    worldIndex = data["World Index"]
+    policyCount = len(populationCol[0])
+    policyCol = [None] * number_agents
+    for agentIndex in range(number_agents):
+        policyCol[agentIndex] = populationCol[agentIndex][worldIndex % policyCount]
+    data["Agent Policies"] = policyCol
+
+def assignBestCceaPolicies(data):
+    number_agents = data['Number of Agents']
+    populationCol = data['Agent Populations']
+    policyCol = [None] * number_agents
+    for agentIndex in range(number_agents):
+        policyCol[agentIndex] = max(populationCol[agentIndex], key = lambda policy: policy.fitness)
+        #policyCol[agentIndex] = populationCol[agentIndex][0]
+    data["Agent Policies"] = policyCol
+
+def stackAgentPolicies(data):
+    """
+    Stacks the weights of the assigned policies into contiguous arrays for
+    doAgentProcessStacked(). Run after the policies are assigned.
+
+    data["Agent Policy Stack"] is a tuple of the input to hidden matrices
+    (agents by hidden by inputs), hidden biases (agents by hidden), hidden to
+    output matrices (agents by outputs by hidden) and output biases (agents
+    by outputs), with a leading world axis when worlds are run in lockstep.
+    """
+    policyCol = data["Agent Policies"]
+    if data.get("World Batch Size") is not None:
+        teamCol = policyCol
+    else:
+        teamCol = [policyCol]
+
+    stack = (
+        np.array([[policy.npInToHiddenMat for policy in team] for team in teamCol]),
+        np.array([[policy.npInToHiddenBias for policy in team] for team in teamCol]),
+        np.array([[policy.npHiddenToOutMat for policy in team] for team in teamCol]),
+        np.array([[policy.npHiddenToOutBias for policy in team] for team in teamCol])
+    )
+
+    if data.get("World Batch Size") is None:
+        stack = tuple(weights[0] for weights in stack)
+    data["Agent Policy Stack"] = stack
+
+def rewardCceaPolicies(data):
+    policyCol = data["Agent Policies"]
+    number_agents = data['Number of Agents']
+    rewardCol = data["Agent Rewards"]
+
+    # Reward one team per world when running worlds in lockstep
+    if data.get("World Batch Size") is not None:
+        for worldIndex in range(len(policyCol)):
+            for agentIndex in range(number_agents):
+                policyCol[worldIndex][agentIndex].fitness = rewardCol[worldIndex][agentIndex]
+        return
+
+    for agentIndex in range(number_agents):
+        policyCol[agentIndex].fitness = rewardCol[agentIndex]
+
+def exportCceaTeam(data):
+    """
+    Train world export function (see core.py) that sends the weights of the
+    team assigned to the current training world to a worker
+    """
+    assignCceaPolicies(data)
+    return {
+        "Agent Team Weights": [policy.getWeights() for policy in data["Agent Policies"]]
+    }
+
+def importCceaTeam(data):
+    """
+    Train world import function (see core.py) that loads the team weights
+    sent by exportCceaTeam() into the worker's copy of the populations
+    """
+    assignCceaPolicies(data)
+    for policy, weights in zip(data["Agent Policies"], data["Agent Team Weights"]):
+        policy.setWeights(weights)
+
+def rewardCceaPolicies2(data):
+    policyCol = data["Agent Policies"]
+    number_agents = data['Number of Agents']
+    rewardCol = data["Agent Rewards"]
+    for agentIndex in range(number_agents):
+        policyCol[agentIndex].fitness += rewardCol[agentIndex]
+
+def evolveCceaPolicies(data):
+    number_agents = data['Number of Agents']
+    populationCol = data['Agent Populations']
+    halfPopLen = int(len(populationCol[0])//2)
+    for agentIndex in range(number_agents):
+        population = populationCol[agentIndex]
+        randomState = getRandomState(data, "Evolve Policies", data["Episode Index"], agentIndex)
+
+        # Binary Tournament, replace loser with copy of winner, then mutate copy
+        for matchIndex in range(halfPopLen):
+
+            if population[2 * matchIndex].fitness > population[2 * matchIndex + 1].fitness:
+                population[2 * matchIndex + 1].copyFrom(population[2 * matchIndex])
+            else:
+                population[2 * matchIndex].copyFrom(population[2 * matchIndex + 1])
+
+            population[2 * matchIndex + 1].mutate(randomState)
+
+        # Python's shuffle keeps unseeded results unchanged
+        if randomState is np.random:
+            random.shuffle(population)
+        else:
+            randomState.shuffle(population)
+        data['Agent Populations'][agentIndex] = population
+
+def evolveCceaArrayPolicies(data):
+    """
+    Vectorized evolveCceaPolicies() for populations made by initCceaArray().
+    Binary tournament, copying the winner over the loser, mutation of the
+    copy and shuffling are done on all agents' populations at once. Fitness
+    stays with the policy's position in the tournament, like copyFrom(),
+    and moves with the weights when shuffling.
+    """
+    populationCol = data['Agent Populations']
+    paramArray = data['Agent Population Params']
+    agentCount, policyCount, paramCount = paramArray.shape
+    halfPopLen = policyCount // 2
+
+    fitnessArray = np.array([[policy.fitness for policy in population] for population in populationCol])
+
+    # Binary Tournament, replace loser with copy of winner, then mutate copy
+    evenParams = paramArray[:, 0:2 * halfPopLen:2]
+    oddParams = paramArray[:, 1:2 * halfPopLen:2]
+    evenWins = fitnessArray[:, 0:2 * halfPopLen:2] > fitnessArray[:, 1:2 * halfPopLen:2]
+    winnerParams = np.where(evenWins[:, :, np.newaxis], evenParams, oddParams)
+
+    # Only draw cauchy noise for the weights that are selected for mutation
+    if data.get("Random Seed") is None:
+        mutationMask = np.random.uniform(0, 1, winnerParams.shape) < 0.01
+        mutation = np.random.standard_cauchy(np.count_nonzero(mutationMask))
+        shuffleKeyArray = np.random.uniform(0, 1, (agentCount, policyCount))
+    else:
+        # Draw each agent's noise from its own stream
+        mutationMask = np.zeros(winnerParams.shape, dtype = bool)
+        mutationCol = []
+        shuffleKeyArray = np.zeros((agentCount, policyCount))
+        for agentIndex in range(agentCount):
+            randomState = getRandomState(data, "Evolve Policies", data["Episode Index"], agentIndex)
+            mutationMask[agentIndex] = randomState.uniform(0, 1, winnerParams.shape[1:]) < 0.01
+            mutationCol.append(randomState.standard_cauchy(np.count_nonzero(mutationMask[agentIndex])))
+            shuffleKeyArray[agentIndex] = randomState.uniform(0, 1, policyCount)
+        mutation = np.concatenate(mutationCol)
+    evenParams[:] = winnerParams
+    oddParams[:] = winnerParams
+    oddParams[mutationMask] += mutation
+
+    # Shuffle each population, writing in place to keep the policy views valid
+    shuffleIndexArray = np.argsort(shuffleKeyArray, axis = 1)
+    paramArray[:] = np.take_along_axis(paramArray, shuffleIndexArray[:, :, np.newaxis], axis = 1)
+    fitnessArray = np.take_along_axis(fitnessArray, shuffleIndexArray, axis = 1)
+    for agentIndex in range(agentCount):
+        for policyIndex in range(policyCount):
+            populationCol[agentIndex][policyIndex].fitness = fitnessArray[agentIndex, policyIndex]
@@ -1,6 +1,7 @@
 import numpy as np
 import random
 cimport cython
+from code.random_streams import getRandomState
 
 cdef extern from "math.h":
     double tanh(double m)
@@ -47,19 +48,19 @@ cdef reluInPlace(double[:] vec):
      
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing. 
-cdef mutate(double[:] vec, double m, double mr):
+cdef mutate(double[:] vec, double m, double mr, randomState):
     shape = [vec.shape[0]]
-    npMutation = np.random.standard_cauchy(shape)
-    npMutation *= np.random.uniform(0, 1, shape) < mr
+    npMutation = randomState.standard_cauchy(shape)
+    npMutation *= randomState.uniform(0, 1, shape) < mr
     cdef double[:] mutation = npMutation
     addInPlace(vec, mutation)
     
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing. 
-cdef mutateMat(double[:,:] mat, double m, double mr):
+cdef mutateMat(double[:,:] mat, double m, double mr, randomState):
     shape = [mat.shape[0], mat.shape[1]]
-    npMutation = m * np.random.standard_cauchy(shape)
-    npMutation *= np.random.uniform(0, 1, shape) < mr
+    npMutation = m * randomState.standard_cauchy(shape)
+    npMutation *= randomState.uniform(0, 1, shape) < mr
     cdef double[:,:] mutation = npMutation
     addInPlaceMat(mat, mutation)
         
@@ -81,19 +82,21 @@ cdef class Evo_MLP:
     cdef public int num_units
     cdef public double fitness
     
-    def __init__(self, input_shape, num_outputs, num_units=16):
+    def __init__(self, input_shape, num_outputs, num_units=16, randomState=None):
         self.input_shape = input_shape
         self.num_outputs = num_outputs
         self.num_units = num_units
         self.fitness = 0
+        if randomState is None:
+            randomState = np.random
 
         # XAVIER INITIALIZATION
         stdev = (3/ input_shape) ** 0.5
-        self.npInToHiddenMat = np.random.uniform(-stdev, stdev, (num_units, input_shape))
-        self.npInToHiddenBias = np.random.uniform(-stdev, stdev, num_units)
+        self.npInToHiddenMat = randomState.uniform(-stdev, stdev, (num_units, input_shape))
+        self.npInToHiddenBias = randomState.uniform(-stdev, stdev, num_units)
         stdev = (3/ num_units) ** 0.5
-        self.npHiddenToOutMat = np.random.uniform(-stdev, stdev, (num_outputs, num_units))
-        self.npHiddenToOutBias = np.random.uniform(-stdev, stdev, num_outputs)
+        self.npHiddenToOutMat = randomState.uniform(-stdev, stdev, (num_outputs, num_units))
+        self.npHiddenToOutBias = randomState.uniform(-stdev, stdev, num_outputs)
         
         self.npHidden = np.zeros(num_units)
         self.npOut = np.zeros(num_outputs)
@@ -114,13 +117,15 @@ cdef class Evo_MLP:
         tanhInPlace(self.out)
         return self.npOut
 
-    cpdef mutate(self):
+    cpdef mutate(self, randomState=None):
         cdef double m = 1
         cdef double mr = 0.01
-        mutateMat(self.inToHiddenMat, m, mr)
-        mutate(self.inToHiddenBias, m, mr)
-        mutateMat(self.hiddenToOutMat, m, mr)
-        mutate(self.hiddenToOutBias, m, mr)
+        if randomState is None:
+            randomState = np.random
+        mutateMat(self.inToHiddenMat, m, mr, randomState)
+        mutate(self.inToHiddenBias, m, mr, randomState)
+        mutateMat(self.hiddenToOutMat, m, mr, randomState)
+        mutate(self.hiddenToOutBias, m, mr, randomState)
 
         
     cpdef copyFrom(self, other):
@@ -136,6 +141,45 @@ cdef class Evo_MLP:
         self.hiddenToOutMat[:] = newHiddenToOutMat
         cdef double[:] newHiddenToOutBias = other.npHiddenToOutBias
         self.hiddenToOutBias[:] = newHiddenToOutBias
+
+    cpdef useParams(self, params):
+        """
+        Makes the weights views into a flat parameter array (see 
+        getParamCount()), laid out as input to hidden matrix, hidden bias, 
+        hidden to output matrix and output bias
+        """
+        cdef int start = 0
+        cdef int inToHiddenCount = self.num_units * self.input_shape
+        cdef int hiddenToOutCount = self.num_outputs * self.num_units
+        self.npInToHiddenMat = params[start:start + inToHiddenCount].reshape(
+            (self.num_units, self.input_shape))
+        start += inToHiddenCount
+        self.npInToHiddenBias = params[start:start + self.num_units]
+        start += self.num_units
+        self.npHiddenToOutMat = params[start:start + hiddenToOutCount].reshape(
+            (self.num_outputs, self.num_units))
+        start += hiddenToOutCount
+        self.npHiddenToOutBias = params[start:start + self.num_outputs]
+        
+        self.inToHiddenMat = self.npInToHiddenMat
+        self.inToHiddenBias = self.npInToHiddenBias
+        self.hiddenToOutMat = self.npHiddenToOutMat
+        self.hiddenToOutBias = self.npHiddenToOutBias
+        
+    cpdef getWeights(self):
+        return (
+            self.npInToHiddenMat.copy(), 
+            self.npInToHiddenBias.copy(), 
+            self.npHiddenToOutMat.copy(), 
+            self.npHiddenToOutBias.copy()
+        )
+        
+    cpdef setWeights(self, weights):
+        newInToHiddenMat, newInToHiddenBias, newHiddenToOutMat, newHiddenToOutBias = weights
+        self.npInToHiddenMat[:] = newInToHiddenMat
+        self.npInToHiddenBias[:] = newInToHiddenBias
+        self.npHiddenToOutMat[:] = newHiddenToOutMat
+        self.npHiddenToOutBias[:] = newHiddenToOutBias
         
 
         
@@ -144,7 +188,35 @@ def initCcea(input_shape, num_outputs, num_units=16):
     def initCceaGo(data):
         number_agents = data['Number of Agents']
 
-        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units) for i in range(data['Trains per Episode'])] for j in range(number_agents)] 
+        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units,getRandomState(data, "Init Policy", j, i)) for i in range(data['Trains per Episode'])] for j in range(number_agents)] 
+        data['Agent Populations'] = populationCol
+    return initCceaGo
+    
+def getParamCount(input_shape, num_outputs, num_units=16):
+    return num_units * input_shape + num_units + num_outputs * num_units + num_outputs
+    
+def initCceaArray(input_shape, num_outputs, num_units=16):
+    """
+    Like initCcea(), but all policy weights are stored in one contiguous
+    array data['Agent Population Params'] (agents by population by 
+    parameters, see Evo_MLP.useParams()). data['Agent Populations'] holds 
+    Evo_MLP views into that array, so the usual policy assignment and reward
+    functions work unchanged. Evolve with evolveCceaArrayPolicies().
+    """
+    def initCceaGo(data):
+        number_agents = data['Number of Agents']
+        policyCount = data['Trains per Episode']
+        
+        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units,getRandomState(data, "Init Policy", j, i)) for i in range(policyCount)] for j in range(number_agents)] 
+        paramArray = np.array([
+            [np.concatenate(policy.getWeights(), axis = None) for policy in population]
+            for population in populationCol
+        ])
+        for agentIndex in range(number_agents):
+            for policyIndex in range(policyCount):
+                populationCol[agentIndex][policyIndex].useParams(paramArray[agentIndex, policyIndex])
+                
+        data['Agent Population Params'] = paramArray
         data['Agent Populations'] = populationCol
     return initCceaGo
     
@@ -152,7 +224,7 @@ def initCcea2(input_shape, num_outputs, num_units=16):
     def initCceaGo(data):
         number_agents = data['Number of Agents']
         policyCount = data['Number of Policies']
-        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units) for i in range(policyCount)] for j in range(number_agents)] 
+        populationCol = [[Evo_MLP(input_shape,num_outputs,num_units,getRandomState(data, "Init Policy", j, i)) for i in range(policyCount)] for j in range(number_agents)] 
         data['Agent Populations'] = populationCol
     return initCceaGo
     
@@ -168,6 +240,16 @@ def assignCceaPolicies(data):
     number_agents = data['Number of Agents']
     populationCol = data['Agent Populations']
     worldIndex = data["World Index"]
+    worldCount = data.get("World Batch Size")
+    
+    # Assign one team per world when running worlds in lockstep
+    if worldCount is not None:
+        data["Agent Policies"] = [
+            [populationCol[agentIndex][worldIndex] for agentIndex in range(number_agents)]
+            for worldIndex in range(worldCount)
+        ]
+        return
+        
     policyCol = [None] * number_agents
     for agentIndex in range(number_agents):
         policyCol[agentIndex] = populationCol[agentIndex][worldIndex]
@@ -192,13 +274,67 @@ def assignBestCceaPolicies(data):
         #policyCol[agentIndex] = populationCol[agentIndex][0]
     data["Agent Policies"] = policyCol
 
+def stackAgentPolicies(data):
+    """
+    Stacks the weights of the assigned policies into contiguous arrays for
+    doAgentProcessStacked(). Run after the policies are assigned. 
+    
+    data["Agent Policy Stack"] is a tuple of the input to hidden matrices 
+    (agents by hidden by inputs), hidden biases (agents by hidden), hidden to 
+    output matrices (agents by outputs by hidden) and output biases (agents 
+    by outputs), with a leading world axis when worlds are run in lockstep.
+    """
+    policyCol = data["Agent Policies"]
+    if data.get("World Batch Size") is not None:
+        teamCol = policyCol
+    else:
+        teamCol = [policyCol]
+        
+    stack = (
+        np.array([[policy.npInToHiddenMat for policy in team] for team in teamCol]),
+        np.array([[policy.npInToHiddenBias for policy in team] for team in teamCol]),
+        np.array([[policy.npHiddenToOutMat for policy in team] for team in teamCol]),
+        np.array([[policy.npHiddenToOutBias for policy in team] for team in teamCol])
+    )
+    
+    if data.get("World Batch Size") is None:
+        stack = tuple(weights[0] for weights in stack)
+    data["Agent Policy Stack"] = stack
+    
 def rewardCceaPolicies(data):
     policyCol = data["Agent Policies"]
     number_agents = data['Number of Agents']
     rewardCol = data["Agent Rewards"]
+    
+    # Reward one team per world when running worlds in lockstep
+    if data.get("World Batch Size") is not None:
+        for worldIndex in range(len(policyCol)):
+            for agentIndex in range(number_agents):
+                policyCol[worldIndex][agentIndex].fitness = rewardCol[worldIndex][agentIndex]
+        return
+        
     for agentIndex in range(number_agents):
         policyCol[agentIndex].fitness = rewardCol[agentIndex]
  
+def exportCceaTeam(data):
+    """
+    Train world export function (see core.py) that sends the weights of the
+    team assigned to the current training world to a worker
+    """
+    assignCceaPolicies(data)
+    return {
+        "Agent Team Weights": [policy.getWeights() for policy in data["Agent Policies"]]
+    }
+    
+def importCceaTeam(data):
+    """
+    Train world import function (see core.py) that loads the team weights 
+    sent by exportCceaTeam() into the worker's copy of the populations
+    """
+    assignCceaPolicies(data)
+    for policy, weights in zip(data["Agent Policies"], data["Agent Team Weights"]):
+        policy.setWeights(weights)
+    
 def rewardCceaPolicies2(data):
     policyCol = data["Agent Policies"]
     number_agents = data['Number of Agents']
@@ -213,6 +349,7 @@ cpdef evolveCceaPolicies(data):
     halfPopLen = int(len(populationCol[0])//2)
     for agentIndex in range(number_agents):
         population = populationCol[agentIndex]
+        randomState = getRandomState(data, "Evolve Policies", data["Episode Index"], agentIndex)
         
         # Binary Tournament, replace loser with copy of winner, then mutate copy
         for matchIndex in range(halfPopLen):
@@ -222,10 +359,60 @@ cpdef evolveCceaPolicies(data):
             else:
                 population[2 * matchIndex].copyFrom(population[2 * matchIndex + 1])
 
-            population[2 * matchIndex + 1].mutate()
+            population[2 * matchIndex + 1].mutate(randomState)
 
-        random.shuffle(population)
+        # Python's shuffle keeps unseeded results unchanged
+        if randomState is np.random:
+            random.shuffle(population)
+        else:
+            randomState.shuffle(population)
         data['Agent Populations'][agentIndex] = population
-        
-   
-        
\ No newline at end of file
+
+def evolveCceaArrayPolicies(data):
+    """
+    Vectorized evolveCceaPolicies() for populations made by initCceaArray(). 
+    Binary tournament, copying the winner over the loser, mutation of the 
+    copy and shuffling are done on all agents' populations at once. Fitness
+    stays with the policy's position in the tournament, like copyFrom(), 
+    and moves with the weights when shuffling.
+    """
+    populationCol = data['Agent Populations']
+    paramArray = data['Agent Population Params']
+    agentCount, policyCount, paramCount = paramArray.shape
+    halfPopLen = policyCount // 2
+    
+    fitnessArray = np.array([[policy.fitness for policy in population] for population in populationCol])
+    
+    # Binary Tournament, replace loser with copy of winner, then mutate copy
+    evenParams = paramArray[:, 0:2 * halfPopLen:2]
+    oddParams = paramArray[:, 1:2 * halfPopLen:2]
+    evenWins = fitnessArray[:, 0:2 * halfPopLen:2] > fitnessArray[:, 1:2 * halfPopLen:2]
+    winnerParams = np.where(evenWins[:, :, np.newaxis], evenParams, oddParams)
+    
+    # Only draw cauchy noise for the weights that are selected for mutation
+    if data.get("Random Seed") is None:
+        mutationMask = np.random.uniform(0, 1, winnerParams.shape) < 0.01
+        mutation = np.random.standard_cauchy(np.count_nonzero(mutationMask))
+        shuffleKeyArray = np.random.uniform(0, 1, (agentCount, policyCount))
+    else:
+        # Draw each agent's noise from its own stream
+        mutationMask = np.zeros(winnerParams.shape, dtype = bool)
+        mutationCol = []
+        shuffleKeyArray = np.zeros((agentCount, policyCount))
+        for agentIndex in range(agentCount):
+            randomState = getRandomState(data, "Evolve Policies", data["Episode Index"], agentIndex)
+            mutationMask[agentIndex] = randomState.uniform(0, 1, winnerParams.shape[1:]) < 0.01
+            mutationCol.append(randomState.standard_cauchy(np.count_nonzero(mutationMask[agentIndex])))
+            shuffleKeyArray[agentIndex] = randomState.uniform(0, 1, policyCount)
+        mutation = np.concatenate(mutationCol)
+    evenParams[:] = winnerParams
+    oddParams[:] = winnerParams
+    oddParams[mutationMask] += mutation
+    
+    # Shuffle each population, writing in place to keep the policy views valid
+    shuffleIndexArray = np.argsort(shuffleKeyArray, axis = 1)
+    paramArray[:] = np.take_along_axis(paramArray, shuffleIndexArray[:, :, np.newaxis], axis = 1)
+    fitnessArray = np.take_along_axis(fitnessArray, shuffleIndexArray, axis = 1)
+    for agentIndex in range(agentCount):
+        for policyIndex in range(policyCount):
+            populationCol[agentIndex][policyIndex].fitness = fitnessArray[agentIndex, policyIndex]
@@ -0,0 +1,139 @@
+"""
+Trial checkpoints for SimulationCore.resume().
+
+saveCheckpoint() (a test end function) saves the state needed to continue
+    the trial after the current episode as arrays in one .npz file:
+    the episode index, the CCEA population weights and fitness, the reward
+    history, the numpy and python random generator states and the data
+    entries listed in data["Checkpoint Value Keys"] (e.g. the curriculum
+    controlled "Coupling", "World Width" and "World Length"). It is saved
+    every data["Checkpoint Period"] episodes (default 1) to
+    data["Checkpoint File Name"] (by default data["Performance Save File
+    Name"] with a ".checkpoint.npz" extension), replacing the previous one.
+
+loadCheckpoint() is the matching data["Checkpoint Load Function"]. The trial
+    begin functions must have built populations of the same shapes. List the
+    save file names and "Results Catalog Trial Id" in "Checkpoint Value Keys"
+    so a resumed trial keeps writing its own files and catalog row; what the
+    interrupted run logged or archived after the checkpoint is dropped.
+"""
+import os
+import errno
+import random
+import numpy as np
+from code.async_io import submitWrite
+from code.reward_history import truncatePerformanceLog
+from code.trajectory_history import truncateTrajectoryArchive
+
+policyWeightNameCol = (
+    "In To Hidden Matrix", "In To Hidden Bias",
+    "Hidden To Out Matrix", "Hidden To Out Bias"
+)
+
+def getCheckpointFileName(data):
+    checkpointFileName = data.get("Checkpoint File Name")
+    if checkpointFileName is None:
+        checkpointFileName = os.path.splitext(data["Performance Save File Name"])[0] + \
+            ".checkpoint.npz"
+    return checkpointFileName
+
+def saveCheckpoint(data):
+    if (data["Episode Index"] + 1) % data.get("Checkpoint Period", 1) != 0:
+        return
+    submitWrite(data, writeCheckpoint, getCheckpointFileName(data),
+        getCheckpointArrays(data))
+
+def getCheckpointArrays(data):
+    """
+    Returns a dictionary of copies of the trial state arrays
+    """
+    arrayDict = {}
+    arrayDict["Episode Index"] = np.array(data["Episode Index"])
+    arrayDict["Reward History"] = np.array(data["Reward History"], dtype = np.float64)
+
+    # Population weights and fitness, agents by population by ...
+    weightsCol = [
+        [policy.getWeights() for policy in population]
+        for population in data['Agent Populations']
+    ]
+    for weightIndex, weightName in enumerate(policyWeightNameCol):
+        arrayDict["Population " + weightName] = np.array([
+            [weights[weightIndex] for weights in populationWeights]
+            for populationWeights in weightsCol
+        ])
+    arrayDict["Population Fitness"] = np.array([
+        [policy.fitness for policy in population]
+        for population in data['Agent Populations']
+    ])
+
+    # Random generator states
+    generatorName, keyCol, position, hasGauss, cachedGaussian = np.random.get_state()
+    arrayDict["Numpy Random Keys"] = keyCol.copy()
+    arrayDict["Numpy Random Position"] = np.array([position, hasGauss])
+    arrayDict["Numpy Random Gaussian"] = np.array(cachedGaussian)
+    version, internalState, gaussNext = random.getstate()
+    arrayDict["Python Random Version"] = np.array(version)
+    arrayDict["Python Random State"] = np.array(internalState, dtype = np.int64)
+    arrayDict["Python Random Gaussian"] = np.array(
+        np.nan if gaussNext is None else gaussNext)
+
+    for key in data.get("Checkpoint Value Keys", []):
+        arrayDict["Value " + key] = np.array(data[key])
+
+    return arrayDict
+
+def writeCheckpoint(checkpointFileName, arrayDict):
+    """
+    Writes the checkpoint to a temporary file first so a crash while writing
+        leaves the previous checkpoint intact
+    """
+    if not os.path.exists(os.path.dirname(checkpointFileName)):
+        try:
+            os.makedirs(os.path.dirname(checkpointFileName))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+
+    with open(checkpointFileName + ".tmp", 'wb') as checkpointFile:
+        np.savez(checkpointFile, **arrayDict)
+        checkpointFile.flush()
+        os.fsync(checkpointFile.fileno())
+    os.replace(checkpointFileName + ".tmp", checkpointFileName)
+
+def loadCheckpoint(data, checkpointFileName):
+    with np.load(checkpointFileName) as arrayDict:
+        data["Episode Index"] = int(arrayDict["Episode Index"])
+        data["Reward History"] = arrayDict["Reward History"].tolist()
+
+        # Copy weights into the existing policies (keeps array views valid)
+        populationCol = data['Agent Populations']
+        weightArrayCol = [
+            arrayDict["Population " + weightName]
+            for weightName in policyWeightNameCol
+        ]
+        fitnessArray = arrayDict["Population Fitness"]
+        for agentIndex, population in enumerate(populationCol):
+            for policyIndex, policy in enumerate(population):
+                policy.setWeights(tuple(
+                    weightArray[agentIndex, policyIndex]
+                    for weightArray in weightArrayCol
+                ))
+                policy.fitness = fitnessArray[agentIndex, policyIndex]
+
+        position, hasGauss = arrayDict["Numpy Random Position"]
+        np.random.set_state(("MT19937", arrayDict["Numpy Random Keys"],
+            int(position), int(hasGauss),
+            float(arrayDict["Numpy Random Gaussian"])))
+        gaussNext = float(arrayDict["Python Random Gaussian"])
+        random.setstate((int(arrayDict["Python Random Version"]),
+            tuple(int(value) for value in arrayDict["Python Random State"]),
+            None if np.isnan(gaussNext) else gaussNext))
+
+        for key in data.get("Checkpoint Value Keys", []):
+            value = arrayDict["Value " + key]
+            data[key] = value.item() if value.ndim == 0 else value
+
+    # Drop what the interrupted run wrote after the checkpoint
+    truncatePerformanceLog(data)
+    if "Trajectory Archive File Name" in data or "Trajectory Save File Name" in data:
+        truncateTrajectoryArchive(data)
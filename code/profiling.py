@@ -0,0 +1,297 @@
+"""
+Per-function timing of a SimulationCore (or RoverDomainCoreGym) for finding
+    out which functions dominate a configuration.
+
+    profiler = HookProfiler()
+    profiler.attach(sim) # After all mods have changed sim
+    sim.run()
+    print(profiler.formatSummaryTable())
+    profiler.saveSummary("log/profile/summary.csv")
+    profiler.saveChromeTrace("log/profile/trace.json") # chrome://tracing
+
+attach() replaces each function collection of the simulation with a
+    ProfiledFuncCol, which times every function as it is iterated over by
+    run(), step() or reset(). Nothing is timed (and nothing is slower) for a
+    simulation that is not attached. Functions called through data entries
+    (see HookProfiler.functionKeyCol, e.g. data["Observation Function"]) are
+    timed too. When called from a function of a collection (e.g. the lambda
+    calling data["Reward Function"]) they are nested: their time is already
+    in the calling function's, so the summary shows their share in 
+    parentheses and leaves it out of the total the shares add up to.
+
+Each function is recorded under the phase (collection) it ran in, e.g.
+    "worldTrainStep" for sim.worldTrainStepFuncCol. Each pass over a
+    collection is also recorded as a span of that phase, and the "Trial",
+    "Episode" and "World" spans enclose the collections they are made of, so
+    the trace nests as trial > episode > world > step > function.
+
+Note: functions run by forked training world workers ("Train Worker Count")
+    are timed in the worker and not recorded; the main process only records
+    the merge functions and the enclosing spans.
+"""
+import os
+import errno
+import json
+import time
+
+# Collections of SimulationCore, the phase name is the name without "FuncCol"
+funcColNameCol = (
+    "trialBeginFuncCol",
+    "trainBeginFuncCol", "worldTrainBeginFuncCol", "worldTrainStepFuncCol",
+    "worldTrainEndFuncCol", "worldTrainMergeFuncCol", "trainEndFuncCol",
+    "testBeginFuncCol", "worldTestBeginFuncCol", "worldTestStepFuncCol",
+    "worldTestEndFuncCol", "testEndFuncCol",
+    "trialEndFuncCol"
+)
+
+# Spans opened by the start and closed by the end of a pass over a collection
+spanOpenPhaseDict = {
+    "trialBegin": "Trial",
+    "trainBegin": "Episode",
+    "worldTrainBegin": "World",
+    "worldTestBegin": "World",
+}
+spanClosePhaseDict = {
+    "trialEnd": "Trial",
+    "testEnd": "Episode",
+    "worldTrainEnd": "World",
+    "worldTestEnd": "World",
+}
+
+def getFunctionName(func):
+    """
+    Returns a readable name for a function, lambda or callable object
+    """
+    if isinstance(func, ProfiledFunction):
+        func = func.func
+    name = getattr(func, "__qualname__", None)
+    if name is None:
+        return type(func).__name__
+    if "<lambda>" in name and hasattr(func, "__code__"):
+        name = "%s (%s:%d)"%(name, os.path.basename(func.__code__.co_filename),
+            func.__code__.co_firstlineno)
+    return name
+
+class ProfiledFuncCol(list):
+    """
+    List of functions that times each function while it is iterated over
+    """
+    def __init__(self, funcCol, profiler, phase):
+        list.__init__(self, funcCol)
+        self.profiler = profiler
+        self.phase = phase
+
+    def __iter__(self):
+        profiler = self.profiler
+        phase = self.phase
+        colStartTime = profiler.beginPhase(phase)
+        for func in list.__iter__(self):
+            startTime = time.perf_counter()
+            profiler.callDepth += 1
+            try:
+                yield func
+            finally:
+                profiler.callDepth -= 1
+            profiler.record(phase, func, startTime, time.perf_counter())
+        profiler.endPhase(phase, colStartTime)
+
+class ProfiledFunction:
+    """
+    Times calls of a function stored in data, recorded under the data key
+    """
+    def __init__(self, func, profiler, phase):
+        self.func = func
+        self.profiler = profiler
+        self.phase = phase
+
+    def __call__(self, *args, **kwargs):
+        isNested = self.profiler.callDepth > 0
+        startTime = time.perf_counter()
+        result = self.func(*args, **kwargs)
+        self.profiler.record(self.phase, self.func, startTime, time.perf_counter(),
+            isNested)
+        return result
+
+    def __reduce__(self):
+        # Save (e.g. pickle) the original function, not the profiler
+        return (getOriginalFunction, (self.func,))
+
+def getOriginalFunction(func):
+    return func
+
+class HookProfiler:
+    """
+    Records the wall time and call count of every function and phase of the
+        attached simulations. Totals are always kept; individual calls are
+        kept for the trace until traceEventLimit calls have been recorded.
+    """
+    functionKeyCol = ("Observation Function", "Reward Function",
+        "Evaluation Function")
+
+    def __init__(self, traceEventLimit = 1000000):
+        self.traceEventLimit = traceEventLimit
+        self.originTime = time.perf_counter()
+        self.totalDict = {} # (phase, name) -> [call count, total time, nested time]
+        self.nameDict = {} # function -> name
+        self.eventCol = [] # (phase, name, start time, end time)
+        self.droppedEventCount = 0
+        self.openSpanDict = {}
+        self.callDepth = 0 # Collection functions running
+
+    def attach(self, sim):
+        """
+        Start timing sim. Attach after all functions have been added,
+            functions may still be appended to or removed from the
+            collections afterwards.
+        """
+        for funcColName in funcColNameCol:
+            funcCol = getattr(sim, funcColName)
+            if not isinstance(funcCol, ProfiledFuncCol):
+                setattr(sim, funcColName,
+                    ProfiledFuncCol(funcCol, self, funcColName[:-len("FuncCol")]))
+        for key in self.functionKeyCol:
+            func = sim.data.get(key)
+            if callable(func) and not isinstance(func, ProfiledFunction):
+                sim.data[key] = ProfiledFunction(func, self, key)
+
+    def detach(self, sim):
+        """
+        Stop timing sim and restore its plain collections and functions
+        """
+        for funcColName in funcColNameCol:
+            funcCol = getattr(sim, funcColName)
+            if isinstance(funcCol, ProfiledFuncCol):
+                setattr(sim, funcColName, list(list.__iter__(funcCol)))
+        for key in self.functionKeyCol:
+            func = sim.data.get(key)
+            if isinstance(func, ProfiledFunction):
+                sim.data[key] = func.func
+
+    def getName(self, func):
+        try:
+            return self.nameDict[func]
+        except KeyError:
+            name = getFunctionName(func)
+            self.nameDict[func] = name
+            return name
+        except TypeError: # Unhashable callable
+            return getFunctionName(func)
+
+    def record(self, phase, func, startTime, endTime, isNested = False):
+        self.recordSpan(phase, self.getName(func), startTime, endTime, isNested)
+
+    def recordSpan(self, phase, name, startTime, endTime, isNested = False):
+        key = (phase, name)
+        total = self.totalDict.get(key)
+        if total is None:
+            total = [0, 0.0, 0.0]
+            self.totalDict[key] = total
+        total[0] += 1
+        total[1] += endTime - startTime
+        if isNested:
+            total[2] += endTime - startTime
+        if len(self.eventCol) < self.traceEventLimit:
+            self.eventCol.append((phase, name, startTime, endTime))
+        else:
+            self.droppedEventCount += 1
+
+    def beginPhase(self, phase):
+        startTime = time.perf_counter()
+        spanName = spanOpenPhaseDict.get(phase)
+        if spanName is not None:
+            # A span that was not closed (e.g. a gym world reset early) ends
+            # where the next one starts
+            self.closeSpan(spanName, startTime)
+            self.openSpanDict[spanName] = startTime
+        return startTime
+
+    def endPhase(self, phase, startTime):
+        endTime = time.perf_counter()
+        self.recordSpan(phase, "*", startTime, endTime)
+        spanName = spanClosePhaseDict.get(phase)
+        if spanName is not None:
+            self.closeSpan(spanName, endTime)
+            if spanName == "Trial":
+                self.closeSpan("Episode", endTime)
+
+    def closeSpan(self, spanName, endTime):
+        startTime = self.openSpanDict.pop(spanName, None)
+        if startTime is not None:
+            self.recordSpan(spanName, "*", startTime, endTime)
+
+    def getSummaryRows(self):
+        """
+        Returns a list of (phase, function, call count, total time in seconds,
+            mean time in microseconds, percent of all function time) tuples.
+            Rows with function "*" are phases and spans (the time for all of
+            their functions together), followed by functions by total time.
+            All function time leaves out the time of nested calls, which is
+            already in the time of the functions calling them.
+        """
+        functionTime = sum(
+            totalTime - nestedTime 
+            for (phase, name), (callCount, totalTime, nestedTime)
+            in self.totalDict.items() if name != "*"
+        )
+        rowCol = [
+            (phase, name, callCount, totalTime, 1e6 * totalTime / callCount,
+                100.0 * totalTime / functionTime if functionTime > 0 else 0.0)
+            for (phase, name), (callCount, totalTime, nestedTime) in self.totalDict.items()
+        ]
+        rowCol.sort(key = lambda row: (row[1] != "*", -row[3]))
+        return rowCol
+
+    def formatSummaryTable(self):
+        lineCol = ["%-22s %-50s %10s %12s %12s %8s"%
+            ("Phase", "Function", "Calls", "Total (s)", "Mean (us)", "Share")]
+        for phase, name, callCount, totalTime, meanTime, share in self.getSummaryRows():
+            shareText = "" if name == "*" else "%.1f%%"%share
+            if self.totalDict[(phase, name)][2] > 0:
+                shareText = "(%s)"%shareText
+            lineCol.append("%-22s %-50s %10d %12.4f %12.2f %8s"%
+                (phase, name[:50], callCount, totalTime, meanTime, shareText))
+        if self.droppedEventCount > 0:
+            lineCol.append("(%d calls not kept for the trace)"%self.droppedEventCount)
+        return "\n".join(lineCol)
+
+    def saveSummary(self, saveFileName):
+        """
+        Save the summary rows as a csv file
+        """
+        makeFileDirectory(saveFileName)
+        with open(saveFileName, 'w') as saveFile:
+            saveFile.write("Phase,Function,Calls,Total (s),Mean (us),Share (%)\n")
+            for row in self.getSummaryRows():
+                saveFile.write('%s,"%s",%d,%r,%r,%r\n'%row)
+
+    def saveChromeTrace(self, saveFileName):
+        """
+        Save the recorded calls as a Chrome trace event file (open with
+            chrome://tracing or https://ui.perfetto.dev)
+        """
+        makeFileDirectory(saveFileName)
+        processId = os.getpid()
+        traceEventCol = [
+            {
+                "name": phase if name == "*" else name,
+                "cat": phase,
+                "ph": "X",
+                "ts": 1e6 * (startTime - self.originTime),
+                "dur": 1e6 * (endTime - startTime),
+                "pid": processId,
+                "tid": 0
+            }
+            for phase, name, startTime, endTime in self.eventCol
+        ]
+        with open(saveFileName, 'w') as saveFile:
+            json.dump({"traceEvents": traceEventCol, "displayTimeUnit": "ms"},
+                saveFile)
+
+def makeFileDirectory(saveFileName):
+    directory = os.path.dirname(saveFileName)
+    if directory and not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
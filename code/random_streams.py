@@ -0,0 +1,58 @@
+"""
+Independent random number streams derived from one root seed.
+
+When data["Random Seed"] is None (the default), getRandomState() returns the
+    numpy.random module, so functions keep drawing from the global random
+    state exactly as before.
+
+When data["Random Seed"] is an integer, each stream is a fresh
+    numpy.random.RandomState seeded from the root seed, data["Trial Index"]
+    (default 0), the stream name and the given indices (e.g. episode, world
+    and agent). A stream only depends on these values and not on what was
+    drawn before it, so results do not depend on the order in which worlds
+    and agents are run, and serial, batched (data["Batch Train Worlds"]) and
+    parallel (data["Train Worker Count"]) runs give identical results.
+
+Note: a RoverDomainCoreGym does not set data["Episode Index"]; set it before
+    each fully resetting reset() when "Random Seed" is set, otherwise every
+    episode gets the same world.
+"""
+import zlib
+import numpy as np
+
+modeIndexDict = {"Train": 0, "Test": 1}
+
+def getStreamId(streamName):
+    """
+    Returns a stable (across processes and runs) integer for streamName
+    """
+    return zlib.crc32(streamName.encode("utf-8"))
+
+def getRandomState(data, streamName, *indexCol):
+    """
+    Returns the random state for the stream streamName at the given indices,
+        or numpy.random when data["Random Seed"] is None
+
+    Args:
+        data (dict): simulation data
+        streamName (str): name of the stream, e.g. "Evolve Policies"
+        indexCol (int): indices that pick the stream, e.g. episode and agent
+
+    Returns:
+        numpy.random.RandomState or numpy.random
+    """
+    rootSeed = data.get("Random Seed")
+    if rootSeed is None:
+        return np.random
+    seedSequence = np.random.SeedSequence(rootSeed,
+        spawn_key = (data.get("Trial Index", 0), getStreamId(streamName)) +
+        tuple(int(index) for index in indexCol))
+    return np.random.RandomState(np.random.PCG64(seedSequence))
+
+def getEpisodeRandomState(data, streamName, *indexCol):
+    """
+    Returns getRandomState() for the current episode and mode (e.g. for
+        functions in trainBeginFuncCol or testBeginFuncCol)
+    """
+    return getRandomState(data, streamName, data.get("Episode Index", 0),
+        modeIndexDict[data.get("Mode", "Train")], *indexCol)
@@ -0,0 +1,251 @@
+"""
+A SQLite catalog of trials and their result files, so results can be found
+    with a query instead of walking the log folder.
+
+registerTrialStart() (a trial begin function) adds a row for the trial with
+    status "Running"; registerTrialFinish() (a trial end function) sets it to
+    "Finished" with the final and best performance once the trial's files
+    are written. A trial that crashed stays "Running" until it is resumed 
+    (see SimulationCore.resume()) with "Results Catalog Trial Id" in 
+    "Checkpoint Value Keys", which keeps its row. The catalog file is
+    data["Results Catalog File Name"] (default "log/results_catalog.sqlite").
+
+Example, all finished difference reward trials with a coupling curriculum
+    starting at coupling 3:
+    queryTrials("log/results_catalog.sqlite", status = "Finished",
+        reward_function = "assignDifferenceReward",
+        curriculum_type = "Coupling", curriculum_start = 3)
+
+Note: SQLite relies on file locking, keep the catalog on a local disk rather
+    than a network file system. Trials run from a shared work queue (see 
+    work_queue.py) register into a catalog on each worker's local disk, and 
+    their rows are imported into a central catalog with importTrialRows().
+"""
+import datetime
+import errno
+import glob
+import json
+import os
+import socket
+import sqlite3
+from code.async_io import submitWrite
+from code.checkpoint import getCheckpointFileName
+from code.reward_history import getPerformanceLogFileName
+from code.trajectory_history import getTrajectoryArchiveFileName
+
+catalogColumnCol = (
+    ("specifics_name", "TEXT"),
+    ("mod_name", "TEXT"),
+    ("reward_function", "TEXT"),
+    ("evaluation_function", "TEXT"),
+    ("curriculum_type", "TEXT"),
+    ("curriculum_start", "REAL"),
+    ("schedule", "TEXT"),
+    ("number_agents", "INTEGER"),
+    ("number_pois", "INTEGER"),
+    ("coupling", "INTEGER"),
+    ("number_episodes", "INTEGER"),
+    ("random_seed", "INTEGER"),
+    ("trial_index", "INTEGER"),
+    ("status", "TEXT"),
+    ("start_time", "TEXT"),
+    ("finish_time", "TEXT"),
+    ("host", "TEXT"),
+    ("process_id", "INTEGER"),
+    ("final_performance", "REAL"),
+    ("best_performance", "REAL"),
+    ("performance_file", "TEXT"),
+    ("performance_log_file", "TEXT"),
+    ("trajectory_file", "TEXT"),
+    ("trajectory_archive_file", "TEXT"),
+    ("checkpoint_file", "TEXT"),
+)
+
+catalogIndexCol = (
+    "specifics_name", "mod_name", "reward_function", "schedule",
+    "curriculum_type, curriculum_start", "number_agents, number_pois",
+    "random_seed", "status"
+)
+
+def getCatalogFileName(data):
+    return data.get("Results Catalog File Name", "log/results_catalog.sqlite")
+
+def connectCatalog(catalogFileName):
+    """
+    Opens the catalog, creating its table and indexes if needed
+    """
+    if os.path.dirname(catalogFileName) and not os.path.exists(os.path.dirname(catalogFileName)):
+        try:
+            os.makedirs(os.path.dirname(catalogFileName))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+
+    # Wait for other processes' writes instead of failing
+    connection = sqlite3.connect(catalogFileName, timeout = 60)
+    connection.row_factory = sqlite3.Row
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS trials (id INTEGER PRIMARY KEY, %s)"%
+            ", ".join("%s %s"%column for column in catalogColumnCol))
+        for indexColumns in catalogIndexCol:
+            connection.execute("CREATE INDEX IF NOT EXISTS trials_%s ON trials (%s)"%
+                (indexColumns.replace(", ", "_"), indexColumns))
+    return connection
+
+def getFunctionName(func):
+    return None if func is None else getattr(func, "__name__", repr(func))
+
+def getDefault(func, data, default = None):
+    try:
+        return func(data)
+    except KeyError:
+        return default
+
+def getTrialRow(data):
+    """
+    Returns the catalog columns of the trial, except for its results
+    """
+    schedule = data.get("Schedule")
+    return {
+        "specifics_name": data.get("Specifics Name"),
+        "mod_name": data.get("Mod Name"),
+        "reward_function": getFunctionName(data.get("Reward Function")),
+        "evaluation_function": getFunctionName(data.get("Evaluation Function")),
+        "curriculum_type": data.get("Curriculum Type"),
+        "curriculum_start": None if schedule is None else float(schedule[0][0]),
+        "schedule": None if schedule is None else json.dumps(
+            [[float(value), int(duration)] for value, duration in schedule]),
+        "number_agents": data.get("Number of Agents"),
+        "number_pois": data.get("Number of POIs"),
+        "coupling": data.get("Coupling"),
+        "number_episodes": data.get("Number of Episodes"),
+        "random_seed": data.get("Random Seed"),
+        "trial_index": data.get("Trial Index"),
+        "host": socket.gethostname(),
+        "process_id": os.getpid(),
+        "performance_file": data.get("Performance Save File Name"),
+        "performance_log_file": getDefault(getPerformanceLogFileName, data),
+        "trajectory_file": data.get("Trajectory Save File Name"),
+        "trajectory_archive_file": getDefault(getTrajectoryArchiveFileName, data),
+        "checkpoint_file": getDefault(getCheckpointFileName, data),
+    }
+
+def registerTrialStart(data):
+    # A resumed trial keeps its row, its id is restored from the checkpoint
+    if data.get("Resume Checkpoint File Name") is not None:
+        return
+    row = getTrialRow(data)
+    row["status"] = "Running"
+    row["start_time"] = datetime.datetime.now().isoformat()
+    connection = connectCatalog(getCatalogFileName(data))
+    try:
+        with connection:
+            cursor = connection.execute("INSERT INTO trials (%s) VALUES (%s)"%
+                (", ".join(row), ", ".join("?" * len(row))), tuple(row.values()))
+        data["Results Catalog Trial Id"] = cursor.lastrowid
+    finally:
+        connection.close()
+
+def registerTrialFinish(data):
+    """
+    Marks the trial finished after its submitted writes (see async_io)
+    """
+    rewardHistory = data.get("Reward History") or []
+    finalPerformance = float(rewardHistory[-1]) if rewardHistory else None
+    bestPerformance = float(max(rewardHistory)) if rewardHistory else None
+    submitWrite(data, writeTrialFinish, getCatalogFileName(data),
+        data["Results Catalog Trial Id"], finalPerformance, bestPerformance)
+
+def writeTrialFinish(catalogFileName, trialId, finalPerformance, bestPerformance):
+    connection = connectCatalog(catalogFileName)
+    try:
+        with connection:
+            connection.execute("UPDATE trials SET status = ?, finish_time = ?, "
+                "final_performance = ?, best_performance = ? WHERE id = ?",
+                ("Finished", datetime.datetime.now().isoformat(),
+                finalPerformance, bestPerformance, trialId))
+    finally:
+        connection.close()
+
+def queryTrials(catalogFileName, **conditionDict):
+    """
+    Returns the trials (as dictionaries) whose columns equal the given
+        values, e.g. queryTrials(fileName, status = "Finished", number_agents = 30)
+    """
+    columnNameSet = set(name for name, _ in catalogColumnCol) | {"id"}
+    for name in conditionDict:
+        if name not in columnNameSet:
+            raise ValueError("Unknown catalog column %s"%name)
+    connection = connectCatalog(catalogFileName)
+    try:
+        query = "SELECT * FROM trials"
+        if conditionDict:
+            query += " WHERE " + " AND ".join("%s IS ?"%name for name in conditionDict)
+        return [dict(row) for row in connection.execute(query, tuple(conditionDict.values()))]
+    finally:
+        connection.close()
+
+def getTrialCatalogRow(data):
+    """
+    Returns the catalog row (as a dictionary) of the trial, e.g. to send it 
+        to another catalog with importTrialRows(), or None if the trial is 
+        not in its catalog
+    """
+    trialId = data.get("Results Catalog Trial Id")
+    if trialId is None:
+        return None
+    rowCol = queryTrials(getCatalogFileName(data), id = trialId)
+    return rowCol[0] if rowCol else None
+
+def importTrialRows(catalogFileName, rowCol):
+    """
+    Adds trial rows from other catalogs (see getTrialCatalogRow()), with new
+        ids, skipping trials whose performance file is already in the catalog
+
+    Returns:
+        int: number of trials added
+    """
+    columnNameCol = [name for name, _ in catalogColumnCol]
+    connection = connectCatalog(catalogFileName)
+    try:
+        knownFileNameSet = set(row[0] for row in
+            connection.execute("SELECT performance_file FROM trials"))
+        valueCol = []
+        for row in rowCol:
+            if row is None or row.get("performance_file") in knownFileNameSet:
+                continue
+            knownFileNameSet.add(row.get("performance_file"))
+            valueCol.append(tuple(row.get(name) for name in columnNameCol))
+        with connection:
+            connection.executemany("INSERT INTO trials (%s) VALUES (%s)"%
+                (", ".join(columnNameCol), ", ".join("?" * len(columnNameCol))), valueCol)
+        return len(valueCol)
+    finally:
+        connection.close()
+
+def importLogFolder(catalogFileName, logFolderName = "log"):
+    """
+    Registers the performance files already in a log folder
+        (log/<Specifics Name>/<Mod Name>/performance/*.csv) that are not in
+        the catalog as finished trials, with only the names and files known
+
+    Returns:
+        int: number of trials added
+    """
+    connection = connectCatalog(catalogFileName)
+    try:
+        knownFileNameSet = set(row[0] for row in
+            connection.execute("SELECT performance_file FROM trials"))
+        rowCol = []
+        for fileName in sorted(glob.glob(os.path.join(logFolderName, "*", "*", "performance", "*.csv"))):
+            if fileName in knownFileNameSet:
+                continue
+            modFolderName = os.path.dirname(os.path.dirname(fileName))
+            rowCol.append((os.path.basename(os.path.dirname(modFolderName)),
+                os.path.basename(modFolderName), "Finished", fileName))
+        with connection:
+            connection.executemany("INSERT INTO trials (specifics_name, mod_name, "
+                "status, performance_file) VALUES (?, ?, ?, ?)", rowCol)
+        return len(rowCol)
+    finally:
+        connection.close()
@@ -1,180 +1,395 @@
-# WARNING: DEPRECATED, use reward_2, this will be updated later
-# from numpy import dot
-# 
-# def assignGlobalReward(data):
-#     agentPositionHistory = data["Agent Position History"]
-#     number_agents = data['Number of Agents']
-#     number_pois = data['Number of POIs'] 
-#     poiValueCol = data['Poi Values']
-#     poiPositionCol = data["Poi Positions"]
-#     minDistanceSqr = data["Minimum Distance"] ** 2
-#     historyStepCount = data["Steps"] + 1
-#     coupling = data["Coupling"]
-#     observationRadiusSqr = data["Observation Radius"] ** 2
-#     
-#     globalReward = 0.0
-#     
-#     for poiIndex in range(number_pois):
-#         poiPosition = poiPositionCol[poiIndex]
-#         closestObsDistanceSqr = float("inf")
-#         for stepIndex in range(historyStepCount):
-#             # Count how many agents observe poi, update closest distance if necessary
-#             observerCount = 0
-#             stepClosestObsDistanceSqr = float("inf")
-#             for agentIndex in range(number_agents):
-#                 # Calculate separation distance between poi and agent
-#                 agentPosition = agentPositionHistory[stepIndex, agentIndex]
-#                 separation = poiPosition - agentPosition
-#                 distanceSqr = dot(separation, separation)
-#                 
-#                 # Check if agent observes poi, update closest step distance
-#                 if distanceSqr < observationRadiusSqr:
-#                     observerCount += 1
-#                     if distanceSqr < stepClosestObsDistanceSqr:
-#                         stepClosestObsDistanceSqr = distanceSqr
-#                         
-#                         
-#             # update closest distance only if poi is observed    
-#             if observerCount >= coupling:
-#                 if stepClosestObsDistanceSqr < closestObsDistanceSqr:
-#                     closestObsDistanceSqr = stepClosestObsDistanceSqr
-#         
-#         # add to global reward if poi is observed 
-#         if closestObsDistanceSqr < observationRadiusSqr:
-#             if closestObsDistanceSqr < minDistanceSqr:
-#                 closestObsDistanceSqr = minDistanceSqr
-#             globalReward += poiValueCol[poiIndex] / closestObsDistanceSqr
-#     
-#     data["Global Reward"] = globalReward
-#     data["Agent Rewards"] = [globalReward] * number_agents
-#  
-# def assignStepGlobalReward(data):
-#     agentPositionHistory = data["Agent Position History"]
-#     number_agents = data['Number of Agents']
-#     number_pois = data['Number of POIs'] 
-#     poiValueCol = data['Poi Values']
-#     poiPositionCol = data["Poi Positions"]
-#     minDistanceSqr = data["Minimum Distance"] ** 2
-#     historyStepCount = data["Steps"] + 1
-#     coupling = data["Coupling"]
-#     observationRadiusSqr = data["Observation Radius"] ** 2
-#     
-#     globalReward = 0.0
-#     
-#     for poiIndex in range(number_pois):
-#         poiPosition = poiPositionCol[poiIndex]
-#         for stepIndex in range(historyStepCount):
-#             # Count how many agents observe poi, update closest distance if necessary
-#             observerCount = 0
-#             stepClosestObsDistanceSqr = float("inf")
-#             for agentIndex in range(number_agents):
-#                 # Calculate separation distance between poi and agent
-#                 agentPosition = agentPositionHistory[stepIndex, agentIndex]
-#                 separation = poiPosition - agentPosition
-#                 distanceSqr = dot(separation, separation)
-#                 
-#                 # Check if agent observes poi, update closest step distance
-#                 if distanceSqr < observationRadiusSqr:
-#                     observerCount += 1
-#                     if distanceSqr < stepClosestObsDistanceSqr:
-#                         stepClosestObsDistanceSqr = distanceSqr
-#                         
-#                         
-#             # update closest distance only if poi is observed    
-#             if observerCount >= coupling:
-#                 # add to global reward if poi is observed 
-#                 if stepClosestObsDistanceSqr < observationRadiusSqr:
-#                     if stepClosestObsDistanceSqr < minDistanceSqr:
-#                         stepClosestObsDistanceSqr = minDistanceSqr
-#                     globalReward += poiValueCol[poiIndex] / stepClosestObsDistanceSqr
-# 
-#     data["Global Reward"] = globalReward
-#     data["Agent Rewards"] = [globalReward] * number_agents    
-#     
-# def assignDifferenceReward(data):
-#     agentPositionHistory = data["Agent Position History"]
-#     number_agents = data['Number of Agents']
-#     number_pois = data['Number of POIs'] 
-#     poiValueCol = data['Poi Values']
-#     poiPositionCol = data["Poi Positions"]
-#     minDistanceSqr = data["Minimum Distance"] ** 2
-#     historyStepCount = data["Steps"] + 1
-#     coupling = data["Coupling"]
-#     observationRadiusSqr = data["Observation Radius"] ** 2
-#     
-#     globalReward = 0.0
-#     
-#     for poiIndex in range(number_pois):
-#         poiPosition = poiPositionCol[poiIndex]
-#         closestObsDistanceSqr = float("inf")
-#         for stepIndex in range(historyStepCount):
-#             # Count how many agents observe poi, update closest distance if necessary
-#             observerCount = 0
-#             stepClosestObsDistanceSqr = float("inf")
-#             for agentIndex in range(number_agents):
-#                 # Calculate separation distance between poi and agent
-#                 agentPosition = agentPositionHistory[stepIndex, agentIndex]
-#                 separation = poiPosition - agentPosition
-#                 distanceSqr = dot(separation, separation)
-#                 
-#                 # Check if agent observes poi, update closest step distance
-#                 if distanceSqr < observationRadiusSqr:
-#                     observerCount += 1
-#                     if distanceSqr < stepClosestObsDistanceSqr:
-#                         stepClosestObsDistanceSqr = distanceSqr
-#                         
-#                         
-#             # update closest distance only if poi is observed    
-#             if observerCount >= coupling:
-#                 if stepClosestObsDistanceSqr < closestObsDistanceSqr:
-#                     closestObsDistanceSqr = stepClosestObsDistanceSqr
-#         
-#         # add to global reward if poi is observed 
-#         if closestObsDistanceSqr < observationRadiusSqr:
-#             if closestObsDistanceSqr < minDistanceSqr:
-#                 closestObsDistanceSqr = minDistanceSqr
-#             globalReward += poiValueCol[poiIndex] / closestObsDistanceSqr
-#     
-#     differenceRewards = [0] * number_agents
-#     
-#     for agentIndex in range(number_agents):
-#         globalWithoutReward = 0
-#         for poiIndex in range(number_pois):
-#             poiPosition = poiPositionCol[poiIndex]
-#             closestObsDistanceSqr = float("inf")
-#             for stepIndex in range(historyStepCount):
-#                 # Count how many agents observe poi, update closest distance if necessary
-#                 observerCount = 0
-#                 stepClosestObsDistanceSqr = float("inf")
-#                 for otherAgentIndex in range(number_agents):
-#                     if agentIndex != otherAgentIndex:
-#                         # Calculate separation distance between poi and agent
-#                         agentPosition = agentPositionHistory[stepIndex, otherAgentIndex]
-#                         separation = poiPosition - agentPosition
-#                         distanceSqr = dot(separation, separation)
-#                         
-#                         # Check if agent observes poi, update closest step distance
-#                         if distanceSqr < observationRadiusSqr:
-#                             observerCount += 1
-#                             if distanceSqr < stepClosestObsDistanceSqr:
-#                                 stepClosestObsDistanceSqr = distanceSqr
-#                             
-#                             
-#                 # update closest distance only if poi is observed    
-#                 if observerCount >= coupling:
-#                     if stepClosestObsDistanceSqr < closestObsDistanceSqr:
-#                         closestObsDistanceSqr = stepClosestObsDistanceSqr
-#             
-#             # add to global reward if poi is observed 
-#             if closestObsDistanceSqr < observationRadiusSqr:
-#                 if closestObsDistanceSqr < minDistanceSqr:
-#                     closestObsDistanceSqr = minDistanceSqr
-#                 globalWithoutReward += poiValueCol[poiIndex] / closestObsDistanceSqr
-#         differenceRewards[agentIndex] = globalReward - globalWithoutReward
-#         
-#     data["Agent Rewards"] = differenceRewards  
-#     data["Global Reward"] = globalReward
-# 
-#             
-#     
-#     
\ No newline at end of file
+"""
+NumPy implementation of reward_2 (see code/backend.py), with the same
+functions and the same results. Distances of every poi, step and agent are
+computed at once (in blocks of pois to bound memory) and reduced with
+array operations; sums over pois are added in order (see sumInOrder()) so
+results match the compiled kernels to the last bit.
+"""
+import numpy as np
+from code.agent_domain import sumInOrder
+
+# Maximum number of poi, step and agent distances held in memory at once
+distanceBlockSize = 1 << 22
+
+def getPoiBlockCol(number_pois, historyStepCount, number_agents):
+    poiBlockSize = max(distanceBlockSize // max(historyStepCount * number_agents, 1), 1)
+    return [slice(poiStart, poiStart + poiBlockSize)
+        for poiStart in range(0, number_pois, poiBlockSize)]
+
+def getDistanceSqrTable(agentPositionHistory, poiPositionCol):
+    """
+    Returns the squared distances of the pois to the agents, pois by steps
+        by agents (or pois by agents for positions without a step axis)
+    """
+    poiShape = (len(poiPositionCol),) + (1,) * (agentPositionHistory.ndim - 1)
+    separation0 = poiPositionCol[:, 0].reshape(poiShape) - agentPositionHistory[np.newaxis, ..., 0]
+    separation1 = poiPositionCol[:, 1].reshape(poiShape) - agentPositionHistory[np.newaxis, ..., 1]
+    return separation0 * separation0 + separation1 * separation1
+
+def getPoiRewardCol(closestObsDistanceSqrCol, poiValueCol, observationRadiusSqr,
+        minDistanceSqr):
+    """
+    Rewards of pois with the given closest observations (broadcast against
+        poiValueCol), 0 for unobserved pois
+    """
+    # reward if poi is observed
+    isObserved = closestObsDistanceSqrCol < observationRadiusSqr
+    closestObsDistanceSqrCol = np.maximum(closestObsDistanceSqrCol, minDistanceSqr)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return np.where(isObserved, poiValueCol / closestObsDistanceSqrCol, 0.0)
+
+def getObservationTables(distanceSqrTable, observationRadiusSqr):
+    """
+    For each poi and step, returns how many agents observe the poi, which
+    agent is the closest observer (the first one on ties, -1 if none) and the
+    closest and second closest observation distances (Inf if there are none).
+    """
+    isObservedTable = distanceSqrTable < observationRadiusSqr
+    observedDistanceSqrTable = np.where(isObservedTable, distanceSqrTable, np.inf)
+    observerCountTable = np.count_nonzero(isObservedTable, axis = -1)
+    closestAgentTable = np.argmin(observedDistanceSqrTable, axis = -1)
+    closestTable = np.min(observedDistanceSqrTable, axis = -1, initial = np.inf)
+    closestAgentTable[observerCountTable == 0] = -1
+    if distanceSqrTable.shape[-1] > 1:
+        secondClosestTable = np.partition(observedDistanceSqrTable, 1, axis = -1)[..., 1]
+    else:
+        secondClosestTable = np.full(closestTable.shape, np.inf)
+    return isObservedTable, observerCountTable, closestAgentTable, closestTable, secondClosestTable
+
+def getClosestObservation(observerCountTable, closestTable, coupling, axis):
+    """
+    Closest observation over the steps (axis) where the poi is observed by
+    at least coupling agents, Inf if there are none
+    """
+    return np.min(np.where(observerCountTable >= coupling, closestTable, np.inf),
+        axis = axis, initial = np.inf)
+
+def assignRewardBatch(data, rewardWorldFunc):
+    """
+    Calls rewardWorldFunc(..., agentPositionHistory, poiValueCol,
+    poiPositionCol) for each world of a batch, or for the single world, and
+    sets "Agent Rewards" and "Global Reward" from its results
+    """
+    number_agents = data['Number of Agents']
+    npAgentPositionHistory = data["Agent Position History"]
+    if npAgentPositionHistory.ndim == 4:
+        # Leading world axis, evaluate each world in the batch separately
+        npGlobalRewardCol = np.zeros(npAgentPositionHistory.shape[0])
+        npRewardCol = np.zeros((npAgentPositionHistory.shape[0], number_agents))
+        for worldIndex in range(npAgentPositionHistory.shape[0]):
+            npGlobalRewardCol[worldIndex], npRewardCol[worldIndex] = rewardWorldFunc(
+                npAgentPositionHistory[worldIndex], data['Poi Values'][worldIndex],
+                data["Poi Positions"][worldIndex])
+        data["Agent Rewards"] = npRewardCol
+        data["Global Reward"] = npGlobalRewardCol
+    else:
+        globalReward, npRewardCol = rewardWorldFunc(npAgentPositionHistory,
+            data['Poi Values'], data["Poi Positions"])
+        data["Agent Rewards"] = npRewardCol
+        data["Global Reward"] = globalReward
+
+def getRewardParameters(data):
+    return (data['Number of Agents'], data['Number of POIs'], data["Steps"] + 1,
+        data["Coupling"], data["Observation Radius"] ** 2,
+        data["Minimum Distance"] ** 2)
+
+def assignGlobalReward(data):
+    """
+    If data["Agent Position History"] has a leading world axis (see
+    data["World Batch Size"] in core.py), each world is evaluated separately
+    and the results are stacked: "Global Reward" has one value per world and
+    "Agent Rewards" has one row per world.
+    """
+    rewardParameters = getRewardParameters(data)
+    def globalRewardWorld(agentPositionHistory, poiValueCol, poiPositionCol):
+        globalReward = getRewardWorld(0, *rewardParameters, agentPositionHistory,
+            poiValueCol, poiPositionCol)[0]
+        return globalReward, np.ones(rewardParameters[0]) * globalReward
+    assignRewardBatch(data, globalRewardWorld)
+
+def assignDifferenceReward(data):
+    rewardParameters = getRewardParameters(data)
+    assignRewardBatch(data, lambda *worldArrayCol:
+        getRewardWorld(1, *rewardParameters, *worldArrayCol))
+
+def assignDppReward(data):
+    rewardParameters = getRewardParameters(data)
+    assignRewardBatch(data, lambda *worldArrayCol:
+        getRewardWorld(2, *rewardParameters, *worldArrayCol))
+
+def getRewardWorld(rewardType, number_agents, number_pois, historyStepCount,
+        coupling, observationRadiusSqr, minDistanceSqr, agentPositionHistory,
+        poiValueCol, poiPositionCol):
+    """
+    Global (rewardType 0), difference (1) or D++ (2) rewards of a world from
+    the observation tables of each poi and step, like the compiled
+    differenceRewardWorld() and dppRewardWorld(). Removing an agent only
+    changes a step's count and closest distance when that agent is itself an
+    observer, and extra copies of an agent only add to the count.
+
+    Returns:
+        tuple: global reward (float), agent rewards (array)
+    """
+    closestObsCol = np.full(number_pois, np.inf)
+    withoutClosestObsTable = np.full((number_pois, number_agents), np.inf)
+    extraClosestObsTable = np.full((coupling, number_pois, number_agents), np.inf)
+    for poiBlock in getPoiBlockCol(number_pois, historyStepCount, number_agents):
+        distanceSqrTable = getDistanceSqrTable(agentPositionHistory, poiPositionCol[poiBlock])
+        isObservedTable, observerCountTable, closestAgentTable, closestTable, secondClosestTable = \
+            getObservationTables(distanceSqrTable, observationRadiusSqr)
+        closestObsCol[poiBlock] = getClosestObservation(observerCountTable,
+            closestTable, coupling, 1)
+        if rewardType == 0:
+            continue
+
+        # Remove each agent from the step's observers if it is one
+        # (pois by steps by agents)
+        withoutClosestTable = np.where(
+            isObservedTable & (closestAgentTable[..., np.newaxis] == np.arange(number_agents)),
+            secondClosestTable[..., np.newaxis], closestTable[..., np.newaxis])
+        withoutClosestObsTable[poiBlock] = getClosestObservation(
+            observerCountTable[..., np.newaxis] - isObservedTable,
+            withoutClosestTable, coupling, 1)
+        if rewardType == 1:
+            continue
+
+        # Add the extra copies if the agent observes the poi
+        for counterfactualCount in range(coupling):
+            extraClosestObsTable[counterfactualCount, poiBlock] = getClosestObservation(
+                observerCountTable[..., np.newaxis] + isObservedTable * counterfactualCount,
+                np.broadcast_to(closestTable[..., np.newaxis], isObservedTable.shape),
+                coupling, 1)
+
+    return getRewardsFromClosestObservations(rewardType, coupling,
+        observationRadiusSqr, minDistanceSqr, poiValueCol, closestObsCol,
+        withoutClosestObsTable, extraClosestObsTable)
+
+def getRewardsFromClosestObservations(rewardType, coupling, observationRadiusSqr,
+        minDistanceSqr, poiValueCol, closestObsCol, withoutClosestObsTable,
+        extraClosestObsTable):
+    """
+    Global (rewardType 0), difference (1) or D++ (2) rewards from the closest
+    observation of each poi (closestObsCol), of each poi without each agent
+    (pois by agents) and of each poi with each number of extra copies of each
+    agent (counterfactual counts by pois by agents)
+
+    Returns:
+        tuple: global reward (float), agent rewards (array)
+    """
+    # Calculate Global Reward
+    globalReward = float(sumInOrder(getPoiRewardCol(closestObsCol, poiValueCol,
+        observationRadiusSqr, minDistanceSqr)))
+    number_agents = withoutClosestObsTable.shape[1]
+    if rewardType == 0:
+        return globalReward, np.full(number_agents, globalReward)
+
+    # Calculate Difference Reward
+    globalWithoutRewardCol = sumInOrder(getPoiRewardCol(withoutClosestObsTable,
+        poiValueCol[:, np.newaxis], observationRadiusSqr, minDistanceSqr))
+    rewardCol = globalReward - globalWithoutRewardCol
+    if rewardType == 1:
+        return globalReward, rewardCol
+
+    # Calculate Dpp Reward
+    for counterfactualCount in range(coupling):
+        globalWithExtraRewardCol = sumInOrder(getPoiRewardCol(
+            extraClosestObsTable[counterfactualCount], poiValueCol[:, np.newaxis],
+            observationRadiusSqr, minDistanceSqr))
+        dppRewardCol = (globalWithExtraRewardCol - globalReward)/(1.0 + counterfactualCount)
+        rewardCol = np.where(dppRewardCol > rewardCol, dppRewardCol, rewardCol)
+    return globalReward, rewardCol
+
+def assignDifferenceRewardNaive(data):
+    """
+    Reference difference reward that recomputes the global reward without
+    each agent from scratch. Kept for checking and benchmarking
+    assignDifferenceReward(); single world only.
+    """
+    globalReward, npRewardCol = getRewardWorldNaive(1, *getRewardParameters(data),
+        data["Agent Position History"], data['Poi Values'], data["Poi Positions"])
+    data["Agent Rewards"] = npRewardCol
+    data["Global Reward"] = globalReward
+
+def assignDppRewardNaive(data):
+    """
+    Reference D++ reward that recomputes every counterfactual from scratch.
+    Kept for checking and benchmarking assignDppReward(); single world only.
+    """
+    globalReward, npRewardCol = getRewardWorldNaive(2, *getRewardParameters(data),
+        data["Agent Position History"], data['Poi Values'], data["Poi Positions"])
+    data["Agent Rewards"] = npRewardCol
+    data["Global Reward"] = globalReward
+
+def getRewardWorldNaive(rewardType, number_agents, number_pois,
+        historyStepCount, coupling, observationRadiusSqr, minDistanceSqr,
+        agentPositionHistory, poiValueCol, poiPositionCol):
+    """
+    Difference (rewardType 1) or D++ (2) rewards that count the observers of
+    every counterfactual world again
+    """
+    distanceSqrTable = getDistanceSqrTable(agentPositionHistory, poiPositionCol)
+    isObservedTable = distanceSqrTable < observationRadiusSqr
+    observedDistanceSqrTable = np.where(isObservedTable, distanceSqrTable, np.inf)
+
+    def getClosestObsCol(observerWeightCol):
+        # Observers are counted with the given weight per agent
+        observerCountTable = np.sum(isObservedTable * observerWeightCol, axis = -1)
+        closestTable = np.min(np.where(observerWeightCol > 0, observedDistanceSqrTable, np.inf),
+            axis = -1, initial = np.inf)
+        return getClosestObservation(observerCountTable, closestTable, coupling, 1)
+
+    closestObsCol = getClosestObsCol(np.ones(number_agents, dtype = int))
+    withoutClosestObsTable = np.full((number_pois, number_agents), np.inf)
+    extraClosestObsTable = np.full((coupling, number_pois, number_agents), np.inf)
+    for agentIndex in range(number_agents):
+        observerWeightCol = np.ones(number_agents, dtype = int)
+        observerWeightCol[agentIndex] = 0
+        withoutClosestObsTable[:, agentIndex] = getClosestObsCol(observerWeightCol)
+        if rewardType == 2:
+            for counterfactualCount in range(coupling):
+                observerWeightCol[agentIndex] = 1 + counterfactualCount
+                extraClosestObsTable[counterfactualCount, :, agentIndex] = \
+                    getClosestObsCol(observerWeightCol)
+
+    return getRewardsFromClosestObservations(rewardType, coupling,
+        observationRadiusSqr, minDistanceSqr, poiValueCol, closestObsCol,
+        withoutClosestObsTable, extraClosestObsTable)
+
+
+# Streaming rewards: instead of keeping the whole trajectory history,
+# createRewardStream() and updateRewardStream() fold each step's positions
+# into per-poi running minimums, and the assign...RewardStreaming() functions
+# finish the rewards from those in one pass over the pois. Memory per world
+# does not depend on data["Steps"] and results are identical to the history
+# based rewards. data["Reward Stream"] holds, for every poi:
+#   the closest observation distance (squared) over all steps where the poi
+#       is observed by at least "Coupling" agents,
+#   per agent, the same without that agent (difference reward),
+#   per agent and number of extra copies of that agent, the closest
+#       observation over the steps that only reach "Coupling" with the
+#       extra copies (D++ reward).
+
+def createRewardStream(data):
+    """
+    Allocates data["Reward Stream"] and adds the starting positions to it.
+    Use as a world begin function in place of createTrajectoryHistories().
+    Supports a leading world axis like createTrajectoryHistories().
+    """
+    number_agents = data['Number of Agents']
+    number_pois = data['Number of POIs']
+    coupling = data["Coupling"]
+    worldShape = np.shape(data["Agent Positions"])[:-2]
+
+    data["Reward Stream"] = (
+        np.full(worldShape + (number_pois,), np.inf),
+        np.full(worldShape + (number_pois, number_agents), np.inf),
+        np.full(worldShape + (number_pois, coupling, number_agents), np.inf)
+    )
+    updateRewardStream(data)
+
+def updateRewardStream(data):
+    """
+    Adds the current agent positions to data["Reward Stream"]. Use as a
+    world step function in place of updateTrajectoryHistories().
+    """
+    number_agents = data['Number of Agents']
+    coupling = data["Coupling"]
+    observationRadiusSqr = data["Observation Radius"] ** 2
+    npAgentPositionCol = data["Agent Positions"]
+    npGlobalBestCol, npWithoutBestTable, npExtraBestTable = data["Reward Stream"]
+
+    if npAgentPositionCol.ndim == 3:
+        for worldIndex in range(npAgentPositionCol.shape[0]):
+            updateRewardStreamWorld(number_agents, coupling, observationRadiusSqr,
+                npAgentPositionCol[worldIndex], data["Poi Positions"][worldIndex],
+                npGlobalBestCol[worldIndex], npWithoutBestTable[worldIndex],
+                npExtraBestTable[worldIndex])
+    else:
+        updateRewardStreamWorld(number_agents, coupling, observationRadiusSqr,
+            npAgentPositionCol, data["Poi Positions"], npGlobalBestCol,
+            npWithoutBestTable, npExtraBestTable)
+
+def updateRewardStreamWorld(number_agents, coupling, observationRadiusSqr,
+        agentPositionCol, poiPositionCol, globalBestCol, withoutBestTable,
+        extraBestTable):
+    """
+    Updates the stream's running minimums in place with one step
+    """
+    # Count the observers and find the closest two, like getObservationTables()
+    isObservedTable, observerCountCol, closestAgentCol, closestCol, secondClosestCol = \
+        getObservationTables(getDistanceSqrTable(agentPositionCol, poiPositionCol),
+        observationRadiusSqr)
+    isPoiObservedCol = observerCountCol > 0
+
+    # update closest distance only if poi is observed
+    np.minimum(globalBestCol, closestCol, out = globalBestCol,
+        where = isPoiObservedCol & (observerCountCol >= coupling))
+
+    # Remove each agent from the step's observers
+    withoutCountTable = observerCountCol[:, np.newaxis] - isObservedTable
+    withoutClosestTable = np.where(
+        isObservedTable & (closestAgentCol[:, np.newaxis] == np.arange(number_agents)),
+        secondClosestCol[:, np.newaxis], closestCol[:, np.newaxis])
+    np.minimum(withoutBestTable, withoutClosestTable, out = withoutBestTable,
+        where = isPoiObservedCol[:, np.newaxis] & (withoutCountTable >= coupling))
+
+    # Extra copies of the agent can complete the coupling
+    # (pois by counterfactual counts by agents)
+    counterfactualCountCol = np.arange(coupling)[np.newaxis, :, np.newaxis]
+    isCompletedTable = isObservedTable[:, np.newaxis, :] & \
+        (observerCountCol[:, np.newaxis, np.newaxis] < coupling) & \
+        (counterfactualCountCol >= coupling - observerCountCol[:, np.newaxis, np.newaxis])
+    np.minimum(extraBestTable, closestCol[:, np.newaxis, np.newaxis], out = extraBestTable,
+        where = isPoiObservedCol[:, np.newaxis, np.newaxis] & isCompletedTable)
+
+def assignGlobalRewardStreaming(data):
+    """
+    assignGlobalReward() from data["Reward Stream"]
+    """
+    assignRewardFromStream(data, 0)
+
+def assignDifferenceRewardStreaming(data):
+    """
+    assignDifferenceReward() from data["Reward Stream"]
+    """
+    assignRewardFromStream(data, 1)
+
+def assignDppRewardStreaming(data):
+    """
+    assignDppReward() from data["Reward Stream"]
+    """
+    assignRewardFromStream(data, 2)
+
+def assignRewardFromStream(data, rewardType):
+    """
+    rewardType is 0 for global, 1 for difference and 2 for D++ rewards
+    """
+    number_agents = data['Number of Agents']
+    minDistanceSqr = data["Minimum Distance"] ** 2
+    coupling = data["Coupling"]
+    observationRadiusSqr = data["Observation Radius"] ** 2
+    npGlobalBestCol, npWithoutBestTable, npExtraBestTable = data["Reward Stream"]
+
+    def rewardStreamWorld(poiValueCol, globalBestCol, withoutBestTable, extraBestTable):
+        # Extra copies never take the closest observation past the global one
+        extraClosestObsTable = np.minimum(globalBestCol[:, np.newaxis, np.newaxis],
+            extraBestTable).transpose(1, 0, 2)
+        return getRewardsFromClosestObservations(rewardType, coupling,
+            observationRadiusSqr, minDistanceSqr, poiValueCol, globalBestCol,
+            withoutBestTable, extraClosestObsTable)
+
+    if npGlobalBestCol.ndim == 2:
+        # Leading world axis, evaluate each world in the batch separately
+        npGlobalRewardCol = np.zeros(npGlobalBestCol.shape[0])
+        npRewardCol = np.zeros((npGlobalBestCol.shape[0], number_agents))
+        for worldIndex in range(npGlobalBestCol.shape[0]):
+            npGlobalRewardCol[worldIndex], npRewardCol[worldIndex] = rewardStreamWorld(
+                data['Poi Values'][worldIndex], npGlobalBestCol[worldIndex],
+                npWithoutBestTable[worldIndex], npExtraBestTable[worldIndex])
+        data["Agent Rewards"] = npRewardCol
+        data["Global Reward"] = npGlobalRewardCol
+    else:
+        globalReward, npRewardCol = rewardStreamWorld(data['Poi Values'],
+            npGlobalBestCol, npWithoutBestTable, npExtraBestTable)
+        data["Agent Rewards"] = npRewardCol
+        data["Global Reward"] = globalReward
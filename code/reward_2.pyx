@@ -1,76 +1,381 @@
 import numpy as np
 cimport cython
+from cython.parallel cimport prange
+from libc.math cimport INFINITY
+
+# Note: the kernels below run without the GIL. Their outer poi or agent loops
+# are split over data["Thread Count"] threads (default 1) with OpenMP, see
+# reward_2.pyxbld. Each thread computes whole per-poi or per-agent results
+# and partial sums are added in the sequential order, so results do not
+# depend on the thread count.
 
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing.
 def assignGlobalReward(data):
-    
+    """
+    If data["Agent Position History"] has a leading world axis (see 
+    data["World Batch Size"] in core.py), each world is evaluated separately 
+    and the results are stacked: "Global Reward" has one value per world and 
+    "Agent Rewards" has one row per world.
+    """
     cdef int number_agents = data['Number of Agents']
     cdef int number_pois = data['Number of POIs'] 
     cdef double minDistanceSqr = data["Minimum Distance"] ** 2
     cdef int historyStepCount = data["Steps"] + 1
     cdef int coupling = data["Coupling"]
     cdef double observationRadiusSqr = data["Observation Radius"] ** 2
-    cdef double[:, :, :] agentPositionHistory = data["Agent Position History"]
-    cdef double[:] poiValueCol = data['Poi Values']
-    cdef double[:, :] poiPositionCol = data["Poi Positions"]
-  
+    cdef int threadCount = data.get("Thread Count", 1)
+    npAgentPositionHistory = data["Agent Position History"]
     
-    cdef int poiIndex, stepIndex, agentIndex, observerCount
-    cdef double separation0, separation1, closestObsDistanceSqr, distanceSqr, stepClosestObsDistanceSqr
-    cdef double Inf = float("inf")
+    cdef int worldIndex
+    cdef double[:, :, :, :] agentPositionHistoryBatch
+    cdef double[:, :] poiValueBatch
+    cdef double[:, :, :] poiPositionBatch
+    cdef double[:] globalRewardBatch
     
+    if npAgentPositionHistory.ndim == 4:
+        # Leading world axis, evaluate each world in the batch separately
+        agentPositionHistoryBatch = npAgentPositionHistory
+        poiValueBatch = data['Poi Values']
+        poiPositionBatch = data["Poi Positions"]
+        npGlobalRewardCol = np.zeros(agentPositionHistoryBatch.shape[0])
+        globalRewardBatch = npGlobalRewardCol
+        for worldIndex in range(agentPositionHistoryBatch.shape[0]):
+            globalRewardBatch[worldIndex] = globalRewardWorld(number_agents, 
+                number_pois, historyStepCount, coupling, observationRadiusSqr, 
+                minDistanceSqr, agentPositionHistoryBatch[worldIndex], 
+                poiValueBatch[worldIndex], poiPositionBatch[worldIndex],
+                threadCount)
+        data["Global Reward"] = npGlobalRewardCol
+        data["Agent Rewards"] = np.ones((agentPositionHistoryBatch.shape[0], number_agents)) * \
+            npGlobalRewardCol[:, np.newaxis]
+    else:
+        globalReward = globalRewardWorld(number_agents, number_pois, 
+            historyStepCount, coupling, observationRadiusSqr, minDistanceSqr, 
+            npAgentPositionHistory, data['Poi Values'], data["Poi Positions"],
+            threadCount)
+        data["Global Reward"] = globalReward
+        data["Agent Rewards"] = np.ones(number_agents) * globalReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double globalRewardWorld(int number_agents, int number_pois, 
+        int historyStepCount, int coupling, double observationRadiusSqr, 
+        double minDistanceSqr, double[:, :, :] agentPositionHistory, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, int threadCount):
+    cdef int poiIndex
     cdef double globalReward = 0.0
+    npPoiRewardCol = np.zeros(number_pois)
+    cdef double[:] poiRewardCol = npPoiRewardCol
+    
+    with nogil:
+        for poiIndex in prange(number_pois, num_threads = threadCount, schedule = 'static'):
+            poiRewardCol[poiIndex] = poiGlobalReward(poiIndex, number_agents,
+                historyStepCount, coupling, observationRadiusSqr,
+                minDistanceSqr, agentPositionHistory, poiValueCol,
+                poiPositionCol)
+
+    for poiIndex in range(number_pois):
+        globalReward += poiRewardCol[poiIndex]
+
+    return globalReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double poiGlobalReward(int poiIndex, int number_agents,
+        int historyStepCount, int coupling, double observationRadiusSqr,
+        double minDistanceSqr, double[:, :, :] agentPositionHistory,
+        double[:] poiValueCol, double[:, :] poiPositionCol) noexcept nogil:
+    cdef int stepIndex, agentIndex, observerCount
+    cdef double separation0, separation1, closestObsDistanceSqr, distanceSqr, stepClosestObsDistanceSqr
+
+    closestObsDistanceSqr = INFINITY
+    for stepIndex in range(historyStepCount):
+        # Count how many agents observe poi, update closest distance if necessary
+        observerCount = 0
+        stepClosestObsDistanceSqr = INFINITY
+        for agentIndex in range(number_agents):
+            # Calculate separation distance between poi and agent
+            separation0 = poiPositionCol[poiIndex, 0] - agentPositionHistory[stepIndex, agentIndex, 0]
+            separation1 = poiPositionCol[poiIndex, 1] - agentPositionHistory[stepIndex, agentIndex, 1]
+            distanceSqr = separation0 * separation0 + separation1 * separation1
+
+            # Check if agent observes poi, update closest step distance
+            if distanceSqr < observationRadiusSqr:
+                observerCount += 1
+                if distanceSqr < stepClosestObsDistanceSqr:
+                    stepClosestObsDistanceSqr = distanceSqr
+
+        # update closest distance only if poi is observed
+        if observerCount >= coupling:
+            if stepClosestObsDistanceSqr < closestObsDistanceSqr:
+                closestObsDistanceSqr = stepClosestObsDistanceSqr
+
+    # reward if poi is observed
+    if closestObsDistanceSqr < observationRadiusSqr:
+        if closestObsDistanceSqr < minDistanceSqr:
+            closestObsDistanceSqr = minDistanceSqr
+        return poiValueCol[poiIndex] / closestObsDistanceSqr
+    return 0.0
+
+
+ 
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+def assignDifferenceReward(data):
+    cdef int number_agents = data['Number of Agents']
+    cdef int number_pois = data['Number of POIs'] 
+    cdef double minDistanceSqr = data["Minimum Distance"] ** 2
+    cdef int historyStepCount = data["Steps"] + 1
+    cdef int coupling = data["Coupling"]
+    cdef double observationRadiusSqr = data["Observation Radius"] ** 2
+    cdef int threadCount = data.get("Thread Count", 1)
+    npAgentPositionHistory = data["Agent Position History"]
+    
+    cdef int worldIndex
+    cdef double[:, :, :, :] agentPositionHistoryBatch
+    cdef double[:, :] poiValueBatch
+    cdef double[:, :, :] poiPositionBatch
+    cdef double[:] globalRewardBatch
+    cdef double[:, :] rewardBatch
     
+    if npAgentPositionHistory.ndim == 4:
+        # Leading world axis, evaluate each world in the batch separately
+        agentPositionHistoryBatch = npAgentPositionHistory
+        poiValueBatch = data['Poi Values']
+        poiPositionBatch = data["Poi Positions"]
+        npGlobalRewardCol = np.zeros(agentPositionHistoryBatch.shape[0])
+        globalRewardBatch = npGlobalRewardCol
+        npRewardCol = np.zeros((agentPositionHistoryBatch.shape[0], number_agents))
+        rewardBatch = npRewardCol
+        for worldIndex in range(agentPositionHistoryBatch.shape[0]):
+            globalRewardBatch[worldIndex] = differenceRewardWorld(number_agents, 
+                number_pois, historyStepCount, coupling, observationRadiusSqr, 
+                minDistanceSqr, agentPositionHistoryBatch[worldIndex], 
+                poiValueBatch[worldIndex], poiPositionBatch[worldIndex], 
+                rewardBatch[worldIndex], threadCount)
+        data["Agent Rewards"] = npRewardCol  
+        data["Global Reward"] = npGlobalRewardCol
+    else:
+        npRewardCol = np.zeros(number_agents)
+        globalReward = differenceRewardWorld(number_agents, number_pois, 
+            historyStepCount, coupling, observationRadiusSqr, minDistanceSqr, 
+            npAgentPositionHistory, data['Poi Values'], data["Poi Positions"],
+            npRewardCol, threadCount)
+        data["Agent Rewards"] = npRewardCol  
+        data["Global Reward"] = globalReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double differenceRewardWorld(int number_agents, int number_pois, 
+        int historyStepCount, int coupling, double observationRadiusSqr, 
+        double minDistanceSqr, double[:, :, :] agentPositionHistory, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double[:] differenceRewardCol, int threadCount):
+    """
+    Difference reward from one pass over the trajectory history. The pass
+    records, per poi and step, the observer count and the closest and second
+    closest observer. Removing an agent then only changes the step's count 
+    and closest distance when that agent is itself an observer, which is an 
+    O(1) lookup. Results are identical to differenceRewardWorldNaive().
+    """
+    cdef double globalReward
+    
+    npObserverCountTable = np.zeros((number_pois, historyStepCount), dtype = np.intc)
+    npClosestAgentTable = np.zeros((number_pois, historyStepCount), dtype = np.intc)
+    npClosestTable = np.zeros((number_pois, historyStepCount))
+    npSecondClosestTable = np.zeros((number_pois, historyStepCount))
+    cdef int[:, :] observerCountTable = npObserverCountTable
+    cdef int[:, :] closestAgentTable = npClosestAgentTable
+    cdef double[:, :] closestTable = npClosestTable
+    cdef double[:, :] secondClosestTable = npSecondClosestTable
+    
+    with nogil:
+        fillObservationTables(number_agents, number_pois, historyStepCount,
+            observationRadiusSqr, agentPositionHistory, poiPositionCol,
+            observerCountTable, closestAgentTable, closestTable,
+            secondClosestTable, threadCount)
+        globalReward = observationTablesReward(number_pois, historyStepCount,
+            coupling, observationRadiusSqr, minDistanceSqr, poiValueCol,
+            observerCountTable, closestTable)
+        differenceRewardFromTables(number_agents, number_pois, historyStepCount,
+            coupling, observationRadiusSqr, minDistanceSqr, agentPositionHistory,
+            poiValueCol, poiPositionCol, globalReward, observerCountTable,
+            closestAgentTable, closestTable, secondClosestTable,
+            differenceRewardCol, threadCount)
+
+    return globalReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void differenceRewardFromTables(int number_agents, int number_pois, 
+        int historyStepCount, int coupling, double observationRadiusSqr, 
+        double minDistanceSqr, double[:, :, :] agentPositionHistory, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double globalReward, int[:, :] observerCountTable, 
+        int[:, :] closestAgentTable, double[:, :] closestTable, 
+        double[:, :] secondClosestTable, double[:] differenceRewardCol,
+        int threadCount) noexcept nogil:
+    cdef int agentIndex
+
+    for agentIndex in prange(number_agents, num_threads = threadCount, schedule = 'static'):
+        differenceRewardCol[agentIndex] = globalReward - globalWithoutAgentReward(
+            agentIndex, number_pois, historyStepCount, coupling,
+            observationRadiusSqr, minDistanceSqr, agentPositionHistory,
+            poiValueCol, poiPositionCol, observerCountTable,
+            closestAgentTable, closestTable, secondClosestTable)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double globalWithoutAgentReward(int agentIndex, int number_pois,
+        int historyStepCount, int coupling, double observationRadiusSqr,
+        double minDistanceSqr, double[:, :, :] agentPositionHistory,
+        double[:] poiValueCol, double[:, :] poiPositionCol,
+        int[:, :] observerCountTable, int[:, :] closestAgentTable,
+        double[:, :] closestTable, double[:, :] secondClosestTable) noexcept nogil:
+    cdef int poiIndex, stepIndex, observerCount
+    cdef double separation0, separation1, closestObsDistanceSqr, distanceSqr, stepClosestObsDistanceSqr
+    cdef double globalWithoutReward = 0.0
     
     for poiIndex in range(number_pois):
-        closestObsDistanceSqr = Inf
+        closestObsDistanceSqr = INFINITY
         for stepIndex in range(historyStepCount):
-            # Count how many agents observe poi, update closest distance if necessary
-            observerCount = 0
-            stepClosestObsDistanceSqr = Inf
-            for agentIndex in range(number_agents):
-                # Calculate separation distance between poi and agent
-                separation0 = poiPositionCol[poiIndex, 0] - agentPositionHistory[stepIndex, agentIndex, 0]
-                separation1 = poiPositionCol[poiIndex, 1] - agentPositionHistory[stepIndex, agentIndex, 1]
-                distanceSqr = separation0 * separation0 + separation1 * separation1
+            observerCount = observerCountTable[poiIndex, stepIndex]
+            stepClosestObsDistanceSqr = closestTable[poiIndex, stepIndex]
                 
-                # Check if agent observes poi, update closest step distance
-                if distanceSqr < observationRadiusSqr:
-                    observerCount += 1
-                    if distanceSqr < stepClosestObsDistanceSqr:
-                        stepClosestObsDistanceSqr = distanceSqr
-                        
-                        
-            # update closest distance only if poi is observed    
+            # Remove agent from the step's observers if it is one
+            separation0 = poiPositionCol[poiIndex, 0] - agentPositionHistory[stepIndex, agentIndex, 0]
+            separation1 = poiPositionCol[poiIndex, 1] - agentPositionHistory[stepIndex, agentIndex, 1]
+            distanceSqr = separation0 * separation0 + separation1 * separation1
+            if distanceSqr < observationRadiusSqr:
+                observerCount -= 1
+                if closestAgentTable[poiIndex, stepIndex] == agentIndex:
+                    stepClosestObsDistanceSqr = secondClosestTable[poiIndex, stepIndex]
+                
+            # update closest distance only if poi is observed
             if observerCount >= coupling:
                 if stepClosestObsDistanceSqr < closestObsDistanceSqr:
                     closestObsDistanceSqr = stepClosestObsDistanceSqr
+            
+        # add to global reward if poi is observed
+        if closestObsDistanceSqr < observationRadiusSqr:
+            if closestObsDistanceSqr < minDistanceSqr:
+                closestObsDistanceSqr = minDistanceSqr
+            globalWithoutReward += poiValueCol[poiIndex] / closestObsDistanceSqr
+
+    return globalWithoutReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void fillObservationTables(int number_agents, int number_pois, 
+        int historyStepCount, double observationRadiusSqr, 
+        double[:, :, :] agentPositionHistory, double[:, :] poiPositionCol, 
+        int[:, :] observerCountTable, int[:, :] closestAgentTable, 
+        double[:, :] closestTable, double[:, :] secondClosestTable,
+        int threadCount) noexcept nogil:
+    """
+    For each poi and step, record how many agents observe the poi, which 
+    agent is the closest observer (the first one on ties) and the closest and 
+    second closest observation distances (Inf if there are none).
+    """
+    cdef int tableIndex
+
+    for tableIndex in prange(number_pois * historyStepCount, num_threads = threadCount, schedule = 'static'):
+        fillObservationTableEntry(tableIndex // historyStepCount,
+            tableIndex % historyStepCount, number_agents,
+            observationRadiusSqr, agentPositionHistory, poiPositionCol,
+            observerCountTable, closestAgentTable, closestTable,
+            secondClosestTable)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void fillObservationTableEntry(int poiIndex, int stepIndex,
+        int number_agents, double observationRadiusSqr,
+        double[:, :, :] agentPositionHistory, double[:, :] poiPositionCol,
+        int[:, :] observerCountTable, int[:, :] closestAgentTable,
+        double[:, :] closestTable, double[:, :] secondClosestTable) noexcept nogil:
+    cdef int agentIndex
+    cdef int observerCount = 0
+    cdef int closestAgent = -1
+    cdef double separation0, separation1, distanceSqr
+    cdef double stepClosestObsDistanceSqr = INFINITY
+    cdef double stepSecondClosestObsDistanceSqr = INFINITY
+    
+    for agentIndex in range(number_agents):
+        # Calculate separation distance between poi and agent
+        separation0 = poiPositionCol[poiIndex, 0] - agentPositionHistory[stepIndex, agentIndex, 0]
+        separation1 = poiPositionCol[poiIndex, 1] - agentPositionHistory[stepIndex, agentIndex, 1]
+        distanceSqr = separation0 * separation0 + separation1 * separation1
+                
+        # Check if agent observes poi, update closest step distances
+        if distanceSqr < observationRadiusSqr:
+            observerCount += 1
+            if distanceSqr < stepClosestObsDistanceSqr:
+                stepSecondClosestObsDistanceSqr = stepClosestObsDistanceSqr
+                stepClosestObsDistanceSqr = distanceSqr
+                closestAgent = agentIndex
+            elif distanceSqr < stepSecondClosestObsDistanceSqr:
+                stepSecondClosestObsDistanceSqr = distanceSqr
+                        
+    observerCountTable[poiIndex, stepIndex] = observerCount
+    closestAgentTable[poiIndex, stepIndex] = closestAgent
+    closestTable[poiIndex, stepIndex] = stepClosestObsDistanceSqr
+    secondClosestTable[poiIndex, stepIndex] = stepSecondClosestObsDistanceSqr
+            
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double observationTablesReward(int number_pois, int historyStepCount, 
+        int coupling, double observationRadiusSqr, double minDistanceSqr, 
+        double[:] poiValueCol, int[:, :] observerCountTable, 
+        double[:, :] closestTable) noexcept nogil:
+    """
+    Global reward from the tables filled by fillObservationTables()
+    """
+    cdef int poiIndex, stepIndex
+    cdef double closestObsDistanceSqr
+    cdef double globalReward = 0.0
+    
+    for poiIndex in range(number_pois):
+        closestObsDistanceSqr = INFINITY
+        for stepIndex in range(historyStepCount):
+            # update closest distance only if poi is observed    
+            if observerCountTable[poiIndex, stepIndex] >= coupling:
+                if closestTable[poiIndex, stepIndex] < closestObsDistanceSqr:
+                    closestObsDistanceSqr = closestTable[poiIndex, stepIndex]
         
         # add to global reward if poi is observed 
         if closestObsDistanceSqr < observationRadiusSqr:
             if closestObsDistanceSqr < minDistanceSqr:
                 closestObsDistanceSqr = minDistanceSqr
             globalReward += poiValueCol[poiIndex] / closestObsDistanceSqr
-    
-    data["Global Reward"] = globalReward
-    data["Agent Rewards"] = np.ones(number_agents) * globalReward
-
+            
+    return globalReward
 
- 
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing.
-def assignDifferenceReward(data):
+def assignDifferenceRewardNaive(data):
+    """
+    Reference difference reward that recomputes the global reward without 
+    each agent from scratch. Kept for checking and benchmarking 
+    assignDifferenceReward(); single world only.
+    """
     cdef int number_agents = data['Number of Agents']
-    cdef int number_pois = data['Number of POIs'] 
-    cdef double minDistanceSqr = data["Minimum Distance"] ** 2
-    cdef int historyStepCount = data["Steps"] + 1
-    cdef int coupling = data["Coupling"]
-    cdef double observationRadiusSqr = data["Observation Radius"] ** 2
-    cdef double[:, :, :] agentPositionHistory = data["Agent Position History"]
-    cdef double[:] poiValueCol = data['Poi Values']
-    cdef double[:, :] poiPositionCol = data["Poi Positions"]
+    npRewardCol = np.zeros(number_agents)
+    globalReward = differenceRewardWorldNaive(number_agents, 
+        data['Number of POIs'], data["Steps"] + 1, data["Coupling"], 
+        data["Observation Radius"] ** 2, data["Minimum Distance"] ** 2, 
+        data["Agent Position History"], data['Poi Values'], 
+        data["Poi Positions"], npRewardCol)
+    data["Agent Rewards"] = npRewardCol  
+    data["Global Reward"] = globalReward
 
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double differenceRewardWorldNaive(int number_agents, int number_pois, 
+        int historyStepCount, int coupling, double observationRadiusSqr, 
+        double minDistanceSqr, double[:, :, :] agentPositionHistory, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double[:] differenceRewardCol):
     cdef int poiIndex, stepIndex, agentIndex, observerCount, otherAgentIndex
     cdef double separation0, separation1, closestObsDistanceSqr, distanceSqr, stepClosestObsDistanceSqr
     cdef double Inf = float("inf")
@@ -78,9 +383,7 @@ def assignDifferenceReward(data):
     cdef double globalReward = 0.0
     cdef double globalWithoutReward = 0.0
     
-    npDifferenceRewardCol = np.zeros(number_agents)
-    cdef double[:] differenceRewardCol = npDifferenceRewardCol
-    
+
     for poiIndex in range(number_pois):
         closestObsDistanceSqr = Inf
         for stepIndex in range(historyStepCount):
@@ -145,10 +448,9 @@ def assignDifferenceReward(data):
                     closestObsDistanceSqr = minDistanceSqr
                 globalWithoutReward += poiValueCol[poiIndex] / closestObsDistanceSqr
         differenceRewardCol[agentIndex] = globalReward - globalWithoutReward
-        
-    data["Agent Rewards"] = npDifferenceRewardCol  
-    data["Global Reward"] = globalReward
-    
+
+    return globalReward
+
 
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing.
@@ -159,11 +461,163 @@ def assignDppReward(data):
     cdef int historyStepCount = data["Steps"] + 1
     cdef int coupling = data["Coupling"]
     cdef double observationRadiusSqr = data["Observation Radius"] ** 2
-    cdef double[:, :, :] agentPositionHistory = data["Agent Position History"]
-    cdef double[:] poiValueCol = data['Poi Values']
-    cdef double[:, :] poiPositionCol = data["Poi Positions"]
+    cdef int threadCount = data.get("Thread Count", 1)
+    npAgentPositionHistory = data["Agent Position History"]
+    
+    cdef int worldIndex
+    cdef double[:, :, :, :] agentPositionHistoryBatch
+    cdef double[:, :] poiValueBatch
+    cdef double[:, :, :] poiPositionBatch
+    cdef double[:] globalRewardBatch
+    cdef double[:, :] rewardBatch
+    
+    if npAgentPositionHistory.ndim == 4:
+        # Leading world axis, evaluate each world in the batch separately
+        agentPositionHistoryBatch = npAgentPositionHistory
+        poiValueBatch = data['Poi Values']
+        poiPositionBatch = data["Poi Positions"]
+        npGlobalRewardCol = np.zeros(agentPositionHistoryBatch.shape[0])
+        globalRewardBatch = npGlobalRewardCol
+        npRewardCol = np.zeros((agentPositionHistoryBatch.shape[0], number_agents))
+        rewardBatch = npRewardCol
+        for worldIndex in range(agentPositionHistoryBatch.shape[0]):
+            globalRewardBatch[worldIndex] = dppRewardWorld(number_agents, 
+                number_pois, historyStepCount, coupling, observationRadiusSqr, 
+                minDistanceSqr, agentPositionHistoryBatch[worldIndex], 
+                poiValueBatch[worldIndex], poiPositionBatch[worldIndex], 
+                rewardBatch[worldIndex], threadCount)
+        data["Agent Rewards"] = npRewardCol  
+        data["Global Reward"] = npGlobalRewardCol
+    else:
+        npRewardCol = np.zeros(number_agents)
+        globalReward = dppRewardWorld(number_agents, number_pois, 
+            historyStepCount, coupling, observationRadiusSqr, minDistanceSqr, 
+            npAgentPositionHistory, data['Poi Values'], data["Poi Positions"],
+            npRewardCol, threadCount)
+        data["Agent Rewards"] = npRewardCol  
+        data["Global Reward"] = globalReward
 
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double dppRewardWorld(int number_agents, int number_pois, 
+        int historyStepCount, int coupling, double observationRadiusSqr, 
+        double minDistanceSqr, double[:, :, :] agentPositionHistory, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double[:] differenceRewardCol, int threadCount):
+    """
+    D++ reward from the tables of fillObservationTables(). Extra copies of an
+    agent only add to the step's observer count when that agent observes the
+    poi, and never change the closest distance, so each counterfactual is an
+    O(1) lookup. Results are identical to dppRewardWorldNaive().
+    """
+    cdef int agentIndex
+    cdef double globalReward
+    
+    npObserverCountTable = np.zeros((number_pois, historyStepCount), dtype = np.intc)
+    npClosestAgentTable = np.zeros((number_pois, historyStepCount), dtype = np.intc)
+    npClosestTable = np.zeros((number_pois, historyStepCount))
+    npSecondClosestTable = np.zeros((number_pois, historyStepCount))
+    cdef int[:, :] observerCountTable = npObserverCountTable
+    cdef int[:, :] closestAgentTable = npClosestAgentTable
+    cdef double[:, :] closestTable = npClosestTable
+    cdef double[:, :] secondClosestTable = npSecondClosestTable
+    
+    with nogil:
+        # Calculate Global Reward
+        fillObservationTables(number_agents, number_pois, historyStepCount,
+            observationRadiusSqr, agentPositionHistory, poiPositionCol,
+            observerCountTable, closestAgentTable, closestTable,
+            secondClosestTable, threadCount)
+        globalReward = observationTablesReward(number_pois, historyStepCount,
+            coupling, observationRadiusSqr, minDistanceSqr, poiValueCol,
+            observerCountTable, closestTable)
+        
+        # Calculate Difference Reward
+        differenceRewardFromTables(number_agents, number_pois, historyStepCount,
+            coupling, observationRadiusSqr, minDistanceSqr, agentPositionHistory,
+            poiValueCol, poiPositionCol, globalReward, observerCountTable,
+            closestAgentTable, closestTable, secondClosestTable,
+            differenceRewardCol, threadCount)
     
+        # Calculate Dpp Reward
+        for agentIndex in prange(number_agents, num_threads = threadCount, schedule = 'static'):
+            differenceRewardCol[agentIndex] = agentDppReward(agentIndex,
+                number_pois, historyStepCount, coupling, observationRadiusSqr,
+                minDistanceSqr, agentPositionHistory, poiValueCol,
+                poiPositionCol, globalReward, observerCountTable,
+                closestTable, differenceRewardCol[agentIndex])
+
+    return globalReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double agentDppReward(int agentIndex, int number_pois,
+        int historyStepCount, int coupling, double observationRadiusSqr,
+        double minDistanceSqr, double[:, :, :] agentPositionHistory,
+        double[:] poiValueCol, double[:, :] poiPositionCol,
+        double globalReward, int[:, :] observerCountTable,
+        double[:, :] closestTable, double differenceReward) noexcept nogil:
+    cdef int poiIndex, stepIndex, observerCount, counterfactualCount
+    cdef double separation0, separation1, closestObsDistanceSqr, distanceSqr
+    cdef double globalWithExtraReward, dppReward
+    cdef double reward = differenceReward
+
+    for counterfactualCount in range(coupling):
+        # Calculate Difference with Extra Me Reward
+        globalWithExtraReward = 0
+        for poiIndex in range(number_pois):
+            closestObsDistanceSqr = INFINITY
+            for stepIndex in range(historyStepCount):
+                observerCount = observerCountTable[poiIndex, stepIndex]
+                    
+                # Add the extra copies if the agent observes the poi
+                separation0 = poiPositionCol[poiIndex, 0] - agentPositionHistory[stepIndex, agentIndex, 0]
+                separation1 = poiPositionCol[poiIndex, 1] - agentPositionHistory[stepIndex, agentIndex, 1]
+                distanceSqr = separation0 * separation0 + separation1 * separation1
+                if distanceSqr < observationRadiusSqr:
+                    observerCount += counterfactualCount
+                    
+                # update closest distance only if poi is observed
+                if observerCount >= coupling:
+                    if closestTable[poiIndex, stepIndex] < closestObsDistanceSqr:
+                        closestObsDistanceSqr = closestTable[poiIndex, stepIndex]
+                
+            # add to global reward if poi is observed
+            if closestObsDistanceSqr < observationRadiusSqr:
+                if closestObsDistanceSqr < minDistanceSqr:
+                    closestObsDistanceSqr = minDistanceSqr
+                globalWithExtraReward += poiValueCol[poiIndex] / closestObsDistanceSqr
+            
+        dppReward = (globalWithExtraReward - globalReward)/(1.0 + counterfactualCount)
+        if dppReward > reward:
+            reward = dppReward
+
+    return reward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+def assignDppRewardNaive(data):
+    """
+    Reference D++ reward that recomputes every counterfactual from scratch. 
+    Kept for checking and benchmarking assignDppReward(); single world only.
+    """
+    cdef int number_agents = data['Number of Agents']
+    npRewardCol = np.zeros(number_agents)
+    globalReward = dppRewardWorldNaive(number_agents, 
+        data['Number of POIs'], data["Steps"] + 1, data["Coupling"], 
+        data["Observation Radius"] ** 2, data["Minimum Distance"] ** 2, 
+        data["Agent Position History"], data['Poi Values'], 
+        data["Poi Positions"], npRewardCol)
+    data["Agent Rewards"] = npRewardCol  
+    data["Global Reward"] = globalReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double dppRewardWorldNaive(int number_agents, int number_pois, 
+        int historyStepCount, int coupling, double observationRadiusSqr, 
+        double minDistanceSqr, double[:, :, :] agentPositionHistory, 
+        double[:] poiValueCol, double[:, :] poiPositionCol, 
+        double[:] differenceRewardCol):
     cdef int poiIndex, stepIndex, agentIndex, observerCount, otherAgentIndex, counterfactualCount
     cdef double separation0, separation1, closestObsDistanceSqr, distanceSqr, stepClosestObsDistanceSqr
     cdef double Inf = float("inf")
@@ -172,9 +626,7 @@ def assignDppReward(data):
     cdef double globalWithoutReward = 0.0
     cdef double globalWithExtraReward = 0.0
     
-    npDifferenceRewardCol = np.zeros(number_agents)
-    cdef double[:] differenceRewardCol = npDifferenceRewardCol
-    
+
     # Calculate Global Reward
     for poiIndex in range(number_pois):
         closestObsDistanceSqr = Inf
@@ -277,9 +729,267 @@ def assignDppReward(data):
                     globalWithExtraReward += poiValueCol[poiIndex] / closestObsDistanceSqr
             differenceRewardCol[agentIndex] = max(differenceRewardCol[agentIndex], 
             (globalWithExtraReward - globalReward)/(1.0 + counterfactualCount))
+
+    return globalReward
+
+
+# Streaming rewards: instead of keeping the whole trajectory history, 
+# createRewardStream() and updateRewardStream() fold each step's positions 
+# into per-poi running minimums, and the assign...RewardStreaming() functions
+# finish the rewards from those in one pass over the pois. Memory per world 
+# does not depend on data["Steps"] and results are identical to the history
+# based rewards. data["Reward Stream"] holds, for every poi:
+#   the closest observation distance (squared) over all steps where the poi 
+#       is observed by at least "Coupling" agents,
+#   per agent, the same without that agent (difference reward),
+#   per agent and number of extra copies of that agent, the closest 
+#       observation over the steps that only reach "Coupling" with the 
+#       extra copies (D++ reward).
+
+def createRewardStream(data):
+    """
+    Allocates data["Reward Stream"] and adds the starting positions to it. 
+    Use as a world begin function in place of createTrajectoryHistories().
+    Supports a leading world axis like createTrajectoryHistories().
+    """
+    cdef int number_agents = data['Number of Agents']
+    cdef int number_pois = data['Number of POIs']
+    cdef int coupling = data["Coupling"]
+    worldShape = np.shape(data["Agent Positions"])[:-2]
+    
+    data["Reward Stream"] = (
+        np.full(worldShape + (number_pois,), np.inf),
+        np.full(worldShape + (number_pois, number_agents), np.inf),
+        np.full(worldShape + (number_pois, coupling, number_agents), np.inf)
+    )
+    updateRewardStream(data)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+def updateRewardStream(data):
+    """
+    Adds the current agent positions to data["Reward Stream"]. Use as a 
+    world step function in place of updateTrajectoryHistories().
+    """
+    cdef int number_agents = data['Number of Agents']
+    cdef int number_pois = data['Number of POIs']
+    cdef int coupling = data["Coupling"]
+    cdef double observationRadiusSqr = data["Observation Radius"] ** 2
+    cdef int threadCount = data.get("Thread Count", 1)
+    npAgentPositionCol = data["Agent Positions"]
+    npGlobalBestCol, npWithoutBestTable, npExtraBestTable = data["Reward Stream"]
+    
+    cdef int worldIndex
+    cdef double[:, :, :] agentPositionBatch, poiPositionBatch
+    cdef double[:, :] globalBestBatch
+    cdef double[:, :, :] withoutBestBatch
+    cdef double[:, :, :, :] extraBestBatch
+    
+    if npAgentPositionCol.ndim == 3:
+        agentPositionBatch = npAgentPositionCol
+        poiPositionBatch = data["Poi Positions"]
+        globalBestBatch = npGlobalBestCol
+        withoutBestBatch = npWithoutBestTable
+        extraBestBatch = npExtraBestTable
+        for worldIndex in range(agentPositionBatch.shape[0]):
+            updateRewardStreamWorld(number_agents, number_pois, coupling, 
+                observationRadiusSqr, agentPositionBatch[worldIndex], 
+                poiPositionBatch[worldIndex], globalBestBatch[worldIndex], 
+                withoutBestBatch[worldIndex], extraBestBatch[worldIndex], 
+                threadCount)
+    else:
+        updateRewardStreamWorld(number_agents, number_pois, coupling, 
+            observationRadiusSqr, npAgentPositionCol, data["Poi Positions"], 
+            npGlobalBestCol, npWithoutBestTable, npExtraBestTable, threadCount)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void updateRewardStreamWorld(int number_agents, int number_pois, 
+        int coupling, double observationRadiusSqr, 
+        double[:, :] agentPositionCol, double[:, :] poiPositionCol, 
+        double[:] globalBestCol, double[:, :] withoutBestTable, 
+        double[:, :, :] extraBestTable, int threadCount) noexcept nogil:
+    cdef int poiIndex
+    
+    for poiIndex in prange(number_pois, num_threads = threadCount, schedule = 'static'):
+        updateRewardStreamPoi(poiIndex, number_agents, coupling, 
+            observationRadiusSqr, agentPositionCol, poiPositionCol, 
+            globalBestCol, withoutBestTable, extraBestTable)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef void updateRewardStreamPoi(int poiIndex, int number_agents, int coupling,
+        double observationRadiusSqr, double[:, :] agentPositionCol, 
+        double[:, :] poiPositionCol, double[:] globalBestCol, 
+        double[:, :] withoutBestTable, double[:, :, :] extraBestTable) noexcept nogil:
+    cdef int agentIndex, counterfactualCount, withoutCount
+    cdef int observerCount = 0
+    cdef int closestAgent = -1
+    cdef double separation0, separation1, distanceSqr, withoutClosestDistanceSqr
+    cdef double stepClosestObsDistanceSqr = INFINITY
+    cdef double stepSecondClosestObsDistanceSqr = INFINITY
+    
+    # Count the observers and find the closest two, like fillObservationTableEntry()
+    for agentIndex in range(number_agents):
+        separation0 = poiPositionCol[poiIndex, 0] - agentPositionCol[agentIndex, 0]
+        separation1 = poiPositionCol[poiIndex, 1] - agentPositionCol[agentIndex, 1]
+        distanceSqr = separation0 * separation0 + separation1 * separation1
         
-    data["Agent Rewards"] = npDifferenceRewardCol  
-    data["Global Reward"] = globalReward   
+        if distanceSqr < observationRadiusSqr:
+            observerCount += 1
+            if distanceSqr < stepClosestObsDistanceSqr:
+                stepSecondClosestObsDistanceSqr = stepClosestObsDistanceSqr
+                stepClosestObsDistanceSqr = distanceSqr
+                closestAgent = agentIndex
+            elif distanceSqr < stepSecondClosestObsDistanceSqr:
+                stepSecondClosestObsDistanceSqr = distanceSqr
+    
+    if observerCount == 0:
+        return
+    
+    # update closest distance only if poi is observed
+    if observerCount >= coupling:
+        if stepClosestObsDistanceSqr < globalBestCol[poiIndex]:
+            globalBestCol[poiIndex] = stepClosestObsDistanceSqr
+    
+    for agentIndex in range(number_agents):
+        separation0 = poiPositionCol[poiIndex, 0] - agentPositionCol[agentIndex, 0]
+        separation1 = poiPositionCol[poiIndex, 1] - agentPositionCol[agentIndex, 1]
+        distanceSqr = separation0 * separation0 + separation1 * separation1
+        
+        withoutCount = observerCount
+        withoutClosestDistanceSqr = stepClosestObsDistanceSqr
+        if distanceSqr < observationRadiusSqr:
+            # Remove agent from the step's observers
+            withoutCount -= 1
+            if closestAgent == agentIndex:
+                withoutClosestDistanceSqr = stepSecondClosestObsDistanceSqr
+            
+            # Extra copies of the agent can complete the coupling
+            if observerCount < coupling:
+                for counterfactualCount in range(coupling - observerCount, coupling):
+                    if stepClosestObsDistanceSqr < extraBestTable[poiIndex, counterfactualCount, agentIndex]:
+                        extraBestTable[poiIndex, counterfactualCount, agentIndex] = stepClosestObsDistanceSqr
+        
+        if withoutCount >= coupling:
+            if withoutClosestDistanceSqr < withoutBestTable[poiIndex, agentIndex]:
+                withoutBestTable[poiIndex, agentIndex] = withoutClosestDistanceSqr
+
+def assignGlobalRewardStreaming(data):
+    """
+    assignGlobalReward() from data["Reward Stream"]
+    """
+    assignRewardFromStream(data, 0)
+
+def assignDifferenceRewardStreaming(data):
+    """
+    assignDifferenceReward() from data["Reward Stream"]
+    """
+    assignRewardFromStream(data, 1)
+    
+def assignDppRewardStreaming(data):
+    """
+    assignDppReward() from data["Reward Stream"]
+    """
+    assignRewardFromStream(data, 2)
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef assignRewardFromStream(data, int rewardType):
+    """
+    rewardType is 0 for global, 1 for difference and 2 for D++ rewards
+    """
+    cdef int number_agents = data['Number of Agents']
+    cdef int number_pois = data['Number of POIs']
+    cdef double minDistanceSqr = data["Minimum Distance"] ** 2
+    cdef int coupling = data["Coupling"]
+    cdef double observationRadiusSqr = data["Observation Radius"] ** 2
+    npGlobalBestCol, npWithoutBestTable, npExtraBestTable = data["Reward Stream"]
+    
+    cdef int worldIndex
+    cdef double[:, :] poiValueBatch, globalBestBatch, rewardBatch
+    cdef double[:, :, :] withoutBestBatch
+    cdef double[:, :, :, :] extraBestBatch
+    cdef double[:] globalRewardBatch
+    
+    if npGlobalBestCol.ndim == 2:
+        # Leading world axis, evaluate each world in the batch separately
+        poiValueBatch = data['Poi Values']
+        globalBestBatch = npGlobalBestCol
+        withoutBestBatch = npWithoutBestTable
+        extraBestBatch = npExtraBestTable
+        npGlobalRewardCol = np.zeros(globalBestBatch.shape[0])
+        globalRewardBatch = npGlobalRewardCol
+        npRewardCol = np.zeros((globalBestBatch.shape[0], number_agents))
+        rewardBatch = npRewardCol
+        for worldIndex in range(globalBestBatch.shape[0]):
+            globalRewardBatch[worldIndex] = rewardStreamWorld(rewardType,
+                number_agents, number_pois, coupling, observationRadiusSqr, 
+                minDistanceSqr, poiValueBatch[worldIndex], 
+                globalBestBatch[worldIndex], withoutBestBatch[worldIndex], 
+                extraBestBatch[worldIndex], rewardBatch[worldIndex])
+        data["Agent Rewards"] = npRewardCol
+        data["Global Reward"] = npGlobalRewardCol
+    else:
+        npRewardCol = np.zeros(number_agents)
+        globalReward = rewardStreamWorld(rewardType, number_agents, 
+            number_pois, coupling, observationRadiusSqr, minDistanceSqr, 
+            data['Poi Values'], npGlobalBestCol, npWithoutBestTable, 
+            npExtraBestTable, npRewardCol)
+        data["Agent Rewards"] = npRewardCol
+        data["Global Reward"] = globalReward
+
+@cython.boundscheck(False)  # Deactivate bounds checking
+@cython.wraparound(False)   # Deactivate negative indexing.
+cdef double rewardStreamWorld(int rewardType, int number_agents, 
+        int number_pois, int coupling, double observationRadiusSqr, 
+        double minDistanceSqr, double[:] poiValueCol, double[:] globalBestCol, 
+        double[:, :] withoutBestTable, double[:, :, :] extraBestTable, 
+        double[:] rewardCol):
+    cdef int agentIndex, poiIndex, counterfactualCount
+    cdef double globalReward = 0.0
+    cdef double globalWithoutReward, globalWithExtraReward, dppReward
+    
+    # Calculate Global Reward
+    for poiIndex in range(number_pois):
+        globalReward += streamPoiReward(globalBestCol[poiIndex], 
+            poiValueCol[poiIndex], observationRadiusSqr, minDistanceSqr)
+    
+    for agentIndex in range(number_agents):
+        if rewardType == 0:
+            rewardCol[agentIndex] = globalReward
+            continue
+        
+        # Calculate Difference Reward
+        globalWithoutReward = 0.0
+        for poiIndex in range(number_pois):
+            globalWithoutReward += streamPoiReward(
+                withoutBestTable[poiIndex, agentIndex], poiValueCol[poiIndex], 
+                observationRadiusSqr, minDistanceSqr)
+        rewardCol[agentIndex] = globalReward - globalWithoutReward
+        if rewardType == 1:
+            continue
+            
+        # Calculate Dpp Reward
+        for counterfactualCount in range(coupling):
+            globalWithExtraReward = 0
+            for poiIndex in range(number_pois):
+                globalWithExtraReward += streamPoiReward(
+                    min(globalBestCol[poiIndex], 
+                        extraBestTable[poiIndex, counterfactualCount, agentIndex]), 
+                    poiValueCol[poiIndex], observationRadiusSqr, minDistanceSqr)
+            dppReward = (globalWithExtraReward - globalReward)/(1.0 + counterfactualCount)
+            if dppReward > rewardCol[agentIndex]:
+                rewardCol[agentIndex] = dppReward
     
+    return globalReward
 
-    
\ No newline at end of file
+cdef inline double streamPoiReward(double closestObsDistanceSqr, 
+        double poiValue, double observationRadiusSqr, 
+        double minDistanceSqr) noexcept nogil:
+    # reward if poi is observed
+    if closestObsDistanceSqr < observationRadiusSqr:
+        if closestObsDistanceSqr < minDistanceSqr:
+            closestObsDistanceSqr = minDistanceSqr
+        return poiValue / closestObsDistanceSqr
+    return 0.0
@@ -1,10 +1,14 @@
 import csv 
 import os
 import errno
+from code.async_io import submitWrite
 
     
 def saveRewardHistory(data):
-    saveFileName  = data["Performance Save File Name"]
+    submitWrite(data, writeRewardHistory, data["Performance Save File Name"], 
+        tuple(data["Reward History"]))
+    
+def writeRewardHistory(saveFileName, rewardHistory):
     # Create File Directory if it doesn't exist
     if not os.path.exists(os.path.dirname(saveFileName)):
         try:
@@ -15,8 +19,8 @@ def saveRewardHistory(data):
                 
     with open(saveFileName, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(["*Episode"] + list(range(len(data["Reward History"]))))
-        writer.writerow(['Performance'] + data["Reward History"])
+        writer.writerow(["*Episode"] + list(range(len(rewardHistory))))
+        writer.writerow(['Performance'] + list(rewardHistory))
 
 def createRewardHistory(data):
     data["Reward History"] = []
@@ -27,4 +31,113 @@ def updateRewardHistory(data):
 def printGlobalReward(data):
     if data["World Index"] == 0:
         print(data["Global Reward"])
-                
\ No newline at end of file
+                
+
+# Performance log: an append-only text file with one "episode,performance" 
+# line per test episode under a "*Episode,Performance" header, so it can be
+# read (e.g. with tail -f) while the trial runs and survives a crash. Lines
+# are appended every data["Performance Log Flush Period"] test episodes 
+# (default 1) and at trial end. The file name is 
+# data["Performance Log File Name"] if set, otherwise 
+# data["Performance Save File Name"] with a ".log" extension. 
+# exportPerformanceLog() converts it to the CSV layout of saveRewardHistory().
+
+def getPerformanceLogFileName(data):
+    logFileName = data.get("Performance Log File Name")
+    if logFileName is None:
+        logFileName = os.path.splitext(data["Performance Save File Name"])[0] + ".log"
+    return logFileName
+
+def createPerformanceLog(data):
+    data["Performance Log Buffer"] = []
+    
+    # A resumed trial appends to its own log, see truncatePerformanceLog()
+    if data.get("Resume Checkpoint File Name") is None:
+        submitWrite(data, writePerformanceLogLines, getPerformanceLogFileName(data), ())
+    
+def updatePerformanceLog(data):
+    data["Performance Log Buffer"].append(
+        "%d,%r\n"%(data["Episode Index"], float(data["Global Reward"]))
+    )
+    if len(data["Performance Log Buffer"]) >= data.get("Performance Log Flush Period", 1):
+        flushPerformanceLog(data)
+
+def flushPerformanceLog(data):
+    lineCol = tuple(data["Performance Log Buffer"])
+    data["Performance Log Buffer"] = []
+    if lineCol:
+        submitWrite(data, writePerformanceLogLines, getPerformanceLogFileName(data), lineCol)
+
+def writePerformanceLogLines(logFileName, lineCol):
+    """
+    Appends lines to the performance log, creating it with its header first 
+        if needed
+    """
+    if not os.path.exists(os.path.dirname(logFileName)):
+        try:
+            os.makedirs(os.path.dirname(logFileName))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+                
+    with open(logFileName, 'a', newline='') as logFile:
+        if logFile.tell() == 0:
+            logFile.write("*Episode,Performance\n")
+        logFile.writelines(lineCol)
+        logFile.flush()
+        os.fsync(logFile.fileno())
+
+def truncatePerformanceLog(data):
+    """
+    Drops the lines of episodes after data["Episode Index"] from the 
+        performance log, e.g. those logged after the checkpoint a trial is 
+        resumed from
+    """
+    submitWrite(data, writeTruncatedPerformanceLog, getPerformanceLogFileName(data),
+        data["Episode Index"])
+
+def writeTruncatedPerformanceLog(logFileName, lastEpisodeIndex):
+    if not os.path.exists(logFileName):
+        return
+    with open(logFileName, newline='') as logFile:
+        lineCol = [
+            line for line in logFile
+            if line.endswith('\n') and (line[0] == '*' or 
+                int(line.split(',')[0]) <= lastEpisodeIndex)
+        ]
+    with open(logFileName + ".tmp", 'w', newline='') as logFile:
+        logFile.writelines(lineCol)
+        logFile.flush()
+        os.fsync(logFile.fileno())
+    os.replace(logFileName + ".tmp", logFileName)
+
+def loadPerformanceLog(logFileName):
+    """
+    Returns the episode indices and performances of a performance log as 
+        lists, ignoring a partially written last line
+    """
+    episodeCol = []
+    performanceCol = []
+    with open(logFileName, newline='') as logFile:
+        for line in logFile:
+            if line[0] == '*' or not line.endswith('\n'):
+                continue
+            episode, performance = line.split(',')
+            episodeCol.append(int(episode))
+            performanceCol.append(float(performance))
+    return episodeCol, performanceCol
+
+def exportPerformanceLog(logFileName, saveFileName = None):
+    """
+    Writes a performance log in the "*Episode"/"Performance" CSV layout of 
+        saveRewardHistory() (readable by folderToData() in folder_to_data), 
+        by default next to the log with a ".csv" extension
+    """
+    if saveFileName is None:
+        saveFileName = os.path.splitext(logFileName)[0] + ".csv"
+    episodeCol, performanceCol = loadPerformanceLog(logFileName)
+    with open(saveFileName, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["*Episode"] + episodeCol)
+        writer.writerow(['Performance'] + performanceCol)
+    return saveFileName
@@ -1,9 +1,15 @@
 import pickle
 import os
+import errno
+from code.async_io import submitWrite
 
 def savePickle(data):
-    saveFileName = data["Pickle Save File Name"]
+    # The writer itself can not be pickled
+    pickleData = {key: value for key, value in data.items() if key != "Async Writer"}
+    submitWrite(data, writePickle, data["Pickle Save File Name"], 
+        pickle.dumps(pickleData, protocol = pickle.HIGHEST_PROTOCOL))
     
+def writePickle(saveFileName, pickleBytes):
     if not os.path.exists(os.path.dirname(saveFileName)):
         try:
             os.makedirs(os.path.dirname(saveFileName))
@@ -12,4 +18,4 @@ def savePickle(data):
                 raise
     
     with open(saveFileName, 'wb') as handle:
-        pickle.dump(data, handle, protocol = pickle.HIGHEST_PROTOCOL)
\ No newline at end of file
+        handle.write(pickleBytes)
\ No newline at end of file
@@ -1,8 +1,34 @@
-from distutils.core import setup
+"""
+Builds the compiled kernels ahead of time, so that no process compiles them
+on import (see code/backend.py). From the repository root:
+
+    python code/setup.py build_ext --inplace
+
+Compiles with OpenMP when available like the .pyxbld files, so the prange
+loops can use data["Thread Count"] threads (see code/build_flags.py).
+"""
+import os
+from setuptools import setup, Extension
 from Cython.Build import cythonize
 import numpy
+from build_flags import getOpenMPArgs # This file's directory is on sys.path
+
+# Build from the repository root so the modules are named code.<module>
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+openmpArgCol = getOpenMPArgs()
+
+extensionCol = [
+    Extension(
+        name = "code." + moduleName,
+        sources = ["code/%s.pyx"%moduleName],
+        include_dirs = [numpy.get_include()],
+        extra_compile_args = openmpArgCol,
+        extra_link_args = openmpArgCol
+    )
+    for moduleName in ("agent_domain_2", "reward_2", "ccea_2")
+]
 
 setup(
-    ext_modules = cythonize("agent_domain_2.pyx", annotate=True),
-    include_dirs=[numpy.get_include()]
-)
\ No newline at end of file
+    ext_modules = cythonize(extensionCol, annotate=True),
+)
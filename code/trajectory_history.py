@@ -2,19 +2,23 @@ import csv
 import os
 import errno
 import numpy as np
+from code.async_io import submitWrite, getArraySnapshot
 
 
 def createTrajectoryHistories(data):
     # create a history of positions for each agents in order to evalutate reward at the end
     number_agents = data['Number of Agents']
     historyStepCount = data["Steps"] + 1
-    agentPositionHistory = np.zeros((historyStepCount, number_agents, 2))
-    agentOrientationHistory = np.zeros((historyStepCount, number_agents, 2))
     positionCol = data["Agent Positions"]
     orientationCol = data["Agent Orientations"]
+    
+    # Worlds run in lockstep get a leading world axis: worlds by steps by agents
+    worldShape = np.shape(positionCol)[:-2]
+    agentPositionHistory = np.zeros(worldShape + (historyStepCount, number_agents, 2))
+    agentOrientationHistory = np.zeros(worldShape + (historyStepCount, number_agents, 2))
 
-    agentPositionHistory[0] = positionCol
-    agentOrientationHistory[0] = orientationCol
+    agentPositionHistory[..., 0, :, :] = positionCol
+    agentOrientationHistory[..., 0, :, :] = orientationCol
     
     
     data["Agent Position History"] = agentPositionHistory
@@ -31,21 +35,28 @@ def updateTrajectoryHistories(data):
     orientationCol = data["Agent Orientations"]
     
     
-    agentPositionHistory[stepIndex + 1] = positionCol
-    agentOrientationHistory[stepIndex + 1] = orientationCol
-        
+    # Worlds of a RoverDomainCoreGymVec can each be at a different step
+    if np.ndim(stepIndex) > 0:
+        worldIndexCol = np.arange(len(stepIndex))
+        agentPositionHistory[worldIndexCol, stepIndex + 1] = positionCol
+        agentOrientationHistory[worldIndexCol, stepIndex + 1] = orientationCol
+    else:
+        agentPositionHistory[..., stepIndex + 1, :, :] = positionCol
+        agentOrientationHistory[..., stepIndex + 1, :, :] = orientationCol
+
     data["Agent Position History"] = agentPositionHistory
     data["Agent Orientation History"] = agentOrientationHistory
     
 def saveTrajectoryHistories(data):
-    saveFileName = data["Trajectory Save File Name"]
-    number_agents = data['Number of Agents']
-    number_pois = data["Number of POIs"]
-    historyStepCount = data["Steps"] + 1
-    agentPositionHistory = data["Agent Position History"]
-    agentOrientationHistory = data["Agent Orientation History"]
-    poiPositionCol = data["Poi Positions"]
+    submitWrite(data, writeTrajectoryHistories, 
+        data["Trajectory Save File Name"], data['Number of Agents'], 
+        data["Number of POIs"], 
+        getArraySnapshot(data["Agent Position History"]), 
+        getArraySnapshot(data["Agent Orientation History"]), 
+        getArraySnapshot(data["Poi Positions"]))
     
+def writeTrajectoryHistories(saveFileName, number_agents, number_pois, 
+        agentPositionHistory, agentOrientationHistory, poiPositionCol):
     if not os.path.exists(os.path.dirname(saveFileName)):
         try:
             os.makedirs(os.path.dirname(saveFileName))
@@ -65,3 +76,162 @@ def saveTrajectoryHistories(data):
         for poiIndex in range(number_pois):
             writer.writerow(["Poi %d Position 0"%(poiIndex)] + [poiPositionCol[poiIndex, 0]])
             writer.writerow(["Poi %d Position 1"%(poiIndex)] + [poiPositionCol[poiIndex, 1]])
+            
+
+# Binary trajectory archive: each archived world appends one block of raw 
+# float64 arrays (position history, orientation history, poi positions) to 
+# the archive file, then one fixed size record to the index file 
+# (archive file name + ".idx") giving the shapes and byte offsets of the 
+# arrays. Readers load the small index and memory map only the worlds they 
+# need; see loadTrajectoryArchiveIndex() and readArchivedTrajectory().
+#
+# The archive file name is data["Trajectory Archive File Name"] if set, 
+# otherwise data["Trajectory Save File Name"] with a ".bin" extension.
+# Which worlds are archived is set by:
+#   data["Trajectory Archive Episode Period"]: archive every Nth episode 
+#       (default 1, every episode)
+#   data["Trajectory Archive Modes"]: the modes to archive worlds of 
+#       (default ("Train", "Test"))
+# Note: archiving appends from the process running the world, so only 
+# archive "Test" worlds when "Train Worker Count" is greater than 1.
+
+trajectoryArchiveIndexDtype = np.dtype([
+    ("Episode Index", "<i8"),
+    ("Mode", "<i8"),                # 0 for "Train", 1 for "Test"
+    ("World Index", "<i8"),         # -1 for a batch of worlds
+    ("World Count", "<i8"),         # 0 if there is no leading world axis
+    ("History Step Count", "<i8"),
+    ("Agent Count", "<i8"),
+    ("Poi Count", "<i8"),
+    ("Position Offset", "<i8"),
+    ("Orientation Offset", "<i8"),
+    ("Poi Offset", "<i8")
+])
+trajectoryArchiveModeCol = ("Train", "Test")
+
+def getTrajectoryArchiveFileName(data):
+    saveFileName = data.get("Trajectory Archive File Name")
+    if saveFileName is None:
+        saveFileName = os.path.splitext(data["Trajectory Save File Name"])[0] + ".bin"
+    return saveFileName
+
+def archiveTrajectoryHistories(data):
+    """
+    Appends the histories of the current world (or batch of worlds) to the 
+    trajectory archive if the episode and mode are selected. Use as a world 
+    end function.
+    """
+    episodeIndex = data.get("Episode Index")
+    if episodeIndex is None:
+        episodeIndex = 0
+    if episodeIndex % data.get("Trajectory Archive Episode Period", 1) != 0:
+        return
+    if data["Mode"] not in data.get("Trajectory Archive Modes", trajectoryArchiveModeCol):
+        return
+        
+    agentPositionHistory = getArraySnapshot(data["Agent Position History"])
+    poiPositionCol = getArraySnapshot(data["Poi Positions"])
+    worldIndex = data.get("World Index")
+    
+    record = np.zeros(1, dtype = trajectoryArchiveIndexDtype)
+    record["Episode Index"] = episodeIndex
+    record["Mode"] = trajectoryArchiveModeCol.index(data["Mode"])
+    record["World Index"] = -1 if worldIndex is None else worldIndex
+    record["World Count"] = agentPositionHistory.shape[0] if agentPositionHistory.ndim == 4 else 0
+    record["History Step Count"] = agentPositionHistory.shape[-3]
+    record["Agent Count"] = agentPositionHistory.shape[-2]
+    record["Poi Count"] = poiPositionCol.shape[-2]
+    
+    submitWrite(data, writeTrajectoryArchiveEntry, 
+        getTrajectoryArchiveFileName(data), record, agentPositionHistory, 
+        getArraySnapshot(data["Agent Orientation History"]), poiPositionCol)
+        
+def writeTrajectoryArchiveEntry(saveFileName, record, agentPositionHistory, 
+        agentOrientationHistory, poiPositionCol):
+    """
+    Appends one world to the trajectory archive, the offsets of record are
+        filled in here
+    """
+    if not os.path.exists(os.path.dirname(saveFileName)):
+        try:
+            os.makedirs(os.path.dirname(saveFileName))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+    
+    # Append the arrays first so the index never points past the archive end
+    with open(saveFileName, 'ab') as archiveFile:
+        archiveFile.seek(0, os.SEEK_END)
+        positionOffset = archiveFile.tell()
+        archiveFile.write(agentPositionHistory.astype('<f8').tobytes())
+        orientationOffset = archiveFile.tell()
+        archiveFile.write(agentOrientationHistory.astype('<f8').tobytes())
+        poiOffset = archiveFile.tell()
+        archiveFile.write(poiPositionCol.astype('<f8').tobytes())
+    
+    record = record.copy()
+    record["Position Offset"] = positionOffset
+    record["Orientation Offset"] = orientationOffset
+    record["Poi Offset"] = poiOffset
+    with open(saveFileName + ".idx", 'ab') as indexFile:
+        indexFile.write(record.tobytes())
+
+def truncateTrajectoryArchive(data):
+    """
+    Drops the worlds of episodes after data["Episode Index"] from the 
+        trajectory archive, e.g. those archived after the checkpoint a trial
+        is resumed from
+    """
+    submitWrite(data, writeTruncatedTrajectoryArchive, 
+        getTrajectoryArchiveFileName(data), data["Episode Index"])
+
+def writeTruncatedTrajectoryArchive(saveFileName, lastEpisodeIndex):
+    if not os.path.exists(saveFileName + ".idx"):
+        return
+    recordCol = loadTrajectoryArchiveIndex(saveFileName)
+    recordCol = recordCol[recordCol["Episode Index"] <= lastEpisodeIndex]
+    
+    # Worlds are appended in order, the archive ends after the last kept one
+    archiveSize = 0
+    if len(recordCol) > 0:
+        lastRecord = recordCol[-1]
+        archiveSize = int(lastRecord["Poi Offset"]) + 8 * 2 * \
+            int(lastRecord["Poi Count"]) * max(int(lastRecord["World Count"]), 1)
+    with open(saveFileName + ".idx.tmp", 'wb') as indexFile:
+        indexFile.write(recordCol.tobytes())
+    os.replace(saveFileName + ".idx.tmp", saveFileName + ".idx")
+    if os.path.exists(saveFileName):
+        os.truncate(saveFileName, archiveSize)
+
+def loadTrajectoryArchiveIndex(saveFileName):
+    """
+    Returns the index of a trajectory archive as a numpy structured array 
+        with one trajectoryArchiveIndexDtype record per archived world (or 
+        batch of worlds), in the order they were archived
+    """
+    return np.fromfile(saveFileName + ".idx", dtype = trajectoryArchiveIndexDtype)
+    
+def readArchivedTrajectory(saveFileName, record):
+    """
+    Memory maps one archived world (or batch of worlds)
+    
+    Args:
+        saveFileName (str): the archive file name
+        record: an entry of loadTrajectoryArchiveIndex(saveFileName)
+    
+    Returns:
+        dict: read only "Agent Position History", "Agent Orientation 
+            History" and "Poi Positions" arrays shaped like they were in data
+    """
+    worldShape = (int(record["World Count"]),) if record["World Count"] > 0 else ()
+    historyShape = worldShape + (int(record["History Step Count"]), 
+        int(record["Agent Count"]), 2)
+    poiShape = worldShape + (int(record["Poi Count"]), 2)
+    return {
+        "Agent Position History": np.memmap(saveFileName, dtype = '<f8', 
+            mode = 'r', offset = int(record["Position Offset"]), shape = historyShape),
+        "Agent Orientation History": np.memmap(saveFileName, dtype = '<f8', 
+            mode = 'r', offset = int(record["Orientation Offset"]), shape = historyShape),
+        "Poi Positions": np.memmap(saveFileName, dtype = '<f8', 
+            mode = 'r', offset = int(record["Poi Offset"]), shape = poiShape)
+    }
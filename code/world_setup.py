@@ -1,45 +1,116 @@
 import numpy as np
+from code.random_streams import getEpisodeRandomState
+
+blueprintKeyCol = ('Agent Positions BluePrint', 'Agent Orientations BluePrint',
+    'Poi Positions BluePrint', 'Poi Values BluePrint')
+
+def blueprintEachWorld(data, blueprintFunc):
+    """
+    If data["Blueprint World Count"] is set (e.g. by RoverDomainCoreGymVec),
+        runs blueprintFunc once for each world with data["Blueprint World 
+        Index"] set to it and stacks the blueprints it sets on a leading 
+        world axis, so every world gets its own blueprint.
+    
+    Returns:
+        bool: False if data["Blueprint World Count"] is None and nothing was
+            done
+    """
+    worldCount = data.get("Blueprint World Count")
+    if worldCount is None or data.get("Blueprint World Index") is not None:
+        return False
+    
+    blueprintDictCol = []
+    try:
+        for worldIndex in range(worldCount):
+            data["Blueprint World Index"] = worldIndex
+            oldBlueprintDict = {key: data.get(key) for key in blueprintKeyCol}
+            blueprintFunc(data)
+            blueprintDictCol.append({key: data[key] for key in blueprintKeyCol
+                if data.get(key) is not oldBlueprintDict[key]})
+            for key, blueprint in oldBlueprintDict.items():
+                if blueprint is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = blueprint
+    finally:
+        data["Blueprint World Index"] = None
+    for key in blueprintDictCol[0]:
+        data[key] = np.stack([blueprintDict[key] for blueprintDict in blueprintDictCol])
+    return True
+
+def getBlueprintRandomState(data, streamName):
+    """
+    Returns getEpisodeRandomState() for the world being blueprinted (see
+        blueprintEachWorld()), or for the episode
+    """
+    worldIndex = data.get("Blueprint World Index")
+    if worldIndex is None:
+        return getEpisodeRandomState(data, streamName)
+    return getEpisodeRandomState(data, streamName, worldIndex)
 
 def blueprintAgent(data):
+    if blueprintEachWorld(data, blueprintAgent):
+        return
     number_agents = data['Number of Agents']
     world_width = data['World Width']
     world_length = data['World Length']
+    random = getBlueprintRandomState(data, "Blueprint Agent")
     
     # Initialize all agents in the np.randomly in world
-    data['Agent Positions BluePrint'] = np.random.rand(number_agents, 2) * [world_width, world_length]
-    angleCol = np.random.uniform(-np.pi, np.pi, number_agents)
+    data['Agent Positions BluePrint'] = random.rand(number_agents, 2) * [world_width, world_length]
+    angleCol = random.uniform(-np.pi, np.pi, number_agents)
     data['Agent Orientations BluePrint'] = np.vstack((np.cos(angleCol), np.sin(angleCol))).T
 
 def blueprintAgentInitSize(data):
+    if blueprintEachWorld(data, blueprintAgentInitSize):
+        return
     number_agents = data['Number of Agents']
     world_width = data['World Width']
     world_length = data['World Length']
     agentInitSize = data["Agent Initialization Size"]
+    random = getBlueprintRandomState(data, "Blueprint Agent Init Size")
     
     worldSize = np.array([world_width, world_length])
     
     # Initialize all agents in the np.randomly in world
-    positionCol = np.random.rand(number_agents, 2) * worldSize
+    positionCol = random.rand(number_agents, 2) * worldSize
     positionCol *= agentInitSize
     positionCol += 0.5 * (1 - agentInitSize) * worldSize
     data['Agent Positions BluePrint'] = positionCol
-    angleCol = np.random.uniform(-np.pi, np.pi, number_agents)
+    angleCol = random.uniform(-np.pi, np.pi, number_agents)
     data['Agent Orientations BluePrint'] = np.vstack((np.cos(angleCol), np.sin(angleCol))).T
 
 
     
     
 def blueprintPoi(data):
+    if blueprintEachWorld(data, blueprintPoi):
+        return
     number_pois = data['Number of POIs']    
     world_width = data['World Width']
     world_length = data['World Length']  
+    random = getBlueprintRandomState(data, "Blueprint Poi")
     
     # Initialize all Pois np.randomly
-    data['Poi Positions BluePrint'] = np.random.rand(number_pois, 2) * [world_width, world_length]
+    data['Poi Positions BluePrint'] = random.rand(number_pois, 2) * [world_width, world_length]
     data['Poi Values BluePrint'] = np.arange(number_pois) + 1.0
  
  
 def initWorld(data):
+    worldCount = data.get("World Batch Size")
+    
+    # Stack a copy of the blueprints for each world when running in lockstep
+    if worldCount is not None:
+        for key in ('Agent Positions', 'Agent Orientations', 'Poi Positions', 
+                'Poi Values'):
+            blueprint = data[key + ' BluePrint']
+            # Blueprints of each world already have the world axis
+            if data.get("Blueprint World Count") is not None:
+                data[key] = blueprint.copy()
+            else:
+                data[key] = np.repeat(blueprint[np.newaxis], worldCount, axis = 0)
+        return
+        
     data['Agent Positions'] = data['Agent Positions BluePrint'].copy()
     data['Agent Orientations'] = data['Agent Orientations BluePrint'].copy()
     data['Poi Positions'] = data['Poi Positions BluePrint'].copy()
@@ -47,13 +118,16 @@ def initWorld(data):
 
 
 def blueprintStatic(data):
+    if blueprintEachWorld(data, blueprintStatic):
+        return
     number_agents = data['Number of Agents']
     number_pois = data['Number of POIs'] 
     world_width = data['World Width']
     world_length = data['World Length']
+    random = getBlueprintRandomState(data, "Blueprint Static")
     
     data['Agent Positions BluePrint'] = np.ones((number_agents,2)) * 0.5 * [world_width, world_length]
-    angles = np.random.uniform(-np.pi, np.pi, number_agents)
+    angles = random.uniform(-np.pi, np.pi, number_agents)
     data['Agent Orientations BluePrint'] = np.vstack((np.cos(angles), np.sin(angles))).T
     data['Poi Positions BluePrint'] = data['Poi Relative Static Positions'] * [world_width, world_length]
     data['Poi Values BluePrint'] =  data['Poi Static Values'].copy()
@@ -62,6 +136,7 @@ def assignRandomPolicies(data):
     number_agents = data['Number of Agents']
     populationCol = data['Agent Populations']
     policyCol = [None] * number_agents
+    random = getEpisodeRandomState(data, "Assign Random Policies", data["World Index"])
     for agentIndex in range(number_agents):
-        policyCol[agentIndex] = np.random.choice(populationCol[agentIndex])
+        policyCol[agentIndex] = random.choice(populationCol[agentIndex])
     data["Agent Policies"] = policyCol
\ No newline at end of file
@@ -15,11 +15,49 @@ SimulationCore provides and manages the following keys during run() execution:
     "Number of Episodes": number of episodes (i.e. generations) in the trial
     "Episode Index": the index of the current episode in the trial
     "Mode": the current simulation mode which can be set to "Train" or "Test"
-        Training mode runs before testing mode
+        Training mode runs before testing mode. It is set before the begin 
+        training and begin testing functions run
     "World Index": the index of the current world instance in the current mode
         and episode
     "Step Index": the index of the current time step for the current world 
         instance
+    "Batch Train Worlds": if True, all training world instances of an episode
+        are run together in lockstep instead of in sequence (default False).
+        World begin, step and end training functions are then executed once 
+        for the whole batch and must accept a leading world axis on the world
+        state arrays (e.g. "Agent Positions" is worlds by agents by 2). 
+        Batching takes precedence over "Train Worker Count": no workers are
+        forked while it is True
+    "World Batch Size": the number of world instances being run in lockstep,
+        or None when world instances are run in sequence. "World Index" is 
+        None while a batch is running
+    "Train Worker Count": if greater than 1, the number of worker processes 
+        that run training world instances in parallel (default None, ignored 
+        while "Batch Train Worlds" is True). Workers are forked once at 
+        trial begin and inherit the simulation; each training world is then
+        sent to a worker with the entries listed below, and only its results
+        are sent back
+    "Train World Shared Keys": keys of data entries copied to the worker for 
+        each training world (e.g. blueprints set by trainBeginFuncCol). 
+        "Episode Index" and "Number of Episodes" are always copied, "Mode" 
+        and "World Index" are set by the worker; any other entry that 
+        changes during the trial and is read by a world training function 
+        must be listed here
+    "Train World Export Function": optional function called with data for 
+        each training world before it is sent to a worker; returns a 
+        dictionary of extra entries to copy to the worker (e.g. the team)
+    "Train World Import Function": optional function called with the worker's
+        data after the entries are copied and before the world begin 
+        functions run
+    "Train World Result Keys": keys of data entries copied back from the 
+        worker after the world end functions run
+    "Checkpoint Load Function": function called by resume() with data and a
+        checkpoint file name after the trial begin functions run; it must 
+        restore the trial state saved at the end of an episode, including 
+        that episode's "Episode Index"
+    "Resume Checkpoint File Name": the checkpoint given to resume(), or None;
+        set before the trial begin functions run so they can skip starting 
+        new files or records that the resumed trial already has
 Warning: Use caution when manually reseting these values within the simulation.
 
 
@@ -51,6 +89,12 @@ An ordered collection of functions; each function is executed in order
     at the end of the world instance of the current episode when
     in training mode. 
 
+self.worldTrainMergeFuncCol:
+An ordered collection of functions; each function is executed in order  
+    in the main process after the results of a training world instance run 
+    by a worker have been copied back into data. Only used when 
+    "Train Worker Count" is greater than 1.
+
 self.trainEndFuncCol:
 An ordered collection of functions; each function is executed in order  
     at the end of the training mode of the current episode. 
@@ -87,6 +131,11 @@ An ordered collection of functions; each function is executed in order at the
 Note: Each function must take in the dictionary data as its first and only required 
     parameter. 
 """
+import multiprocessing
+
+# Simulation inherited by forked training world workers
+workerSim = None
+
 class SimulationCore:
     def __init__(self):
         """
@@ -102,7 +151,14 @@ class SimulationCore:
             "Steps": 5,
             "Trains per Episode": 3,
             "Tests per Episode": 1,
-            "Number of Episodes": 20
+            "Number of Episodes": 20,
+            "Batch Train Worlds": False,
+            "Train Worker Count": None,
+            "Train World Shared Keys": [],
+            "Train World Export Function": None,
+            "Train World Import Function": None,
+            "Train World Result Keys": [],
+            "Checkpoint Load Function": None
         } 
     
         self.trialBeginFuncCol = []
@@ -111,6 +167,7 @@ class SimulationCore:
         self.worldTrainBeginFuncCol = []
         self.worldTrainStepFuncCol = []
         self.worldTrainEndFuncCol = []
+        self.worldTrainMergeFuncCol = []
         self.trainEndFuncCol = []
         
         self.testBeginFuncCol = []
@@ -132,43 +189,157 @@ class SimulationCore:
             None
         """
         
+        self.runTrial()
+        
+    def resume(self, checkpointFileName):
+        """
+        Continues a trial from a checkpoint. The trial begin functions run as
+            usual, then data["Checkpoint Load Function"] restores the state 
+            saved at the end of an episode and the trial continues from the 
+            next episode.
+        
+        Args:
+            checkpointFileName (str): checkpoint to load
+           
+        Returns:
+            None
+        """
+        self.runTrial(checkpointFileName)
+        
+    def runTrial(self, checkpointFileName = None):
+        """
+        Runs the trial, from the episode after the checkpoint if 
+            checkpointFileName is not None
+        """
         # Do Trial Begin Functions
+        self.data["Resume Checkpoint File Name"] = checkpointFileName
         for func in self.trialBeginFuncCol:
             func(self.data)
             
+        firstEpisodeIndex = 0
+        if checkpointFileName is not None:
+            self.data["Checkpoint Load Function"](self.data, checkpointFileName)
+            firstEpisodeIndex = self.data["Episode Index"] + 1
+        
+        # Fork training world workers after the trial is set, batched 
+        # training worlds all run in this process
+        pool = None
+        workerCount = self.data["Train Worker Count"]
+        if not self.data["Batch Train Worlds"] and workerCount is not None \
+                and workerCount > 1:
+            global workerSim
+            workerSim = self
+            pool = multiprocessing.get_context("fork").Pool(workerCount)
+            
+        try:
+            self.runEpisodes(pool, firstEpisodeIndex)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+                
+        # Do Trial End Functions
+        for func in self.trialEndFuncCol:
+            func(self.data)
+            
+    def runEpisodes(self, pool = None, firstEpisodeIndex = 0):
+        """
+        Runs all episodes of the trial
+        
+        Args:
+            pool (multiprocessing.Pool, None): workers to run training worlds
+                with, or None to run training worlds in this process
+            firstEpisodeIndex (int): index of the first episode to run
+        
+        Returns:
+            None
+        """
         # Do Each Episode
-        for episodeIndex in range(self.data["Number of Episodes"]):
+        for episodeIndex in range(firstEpisodeIndex, self.data["Number of Episodes"]):
             self.data["Episode Index"] = episodeIndex
+            self.data["Mode"] = "Train"
             
             # Do Begin Training Functions
             for func in self.trainBeginFuncCol:
                 func(self.data)
     
-            # Repeat running world (with new teams) until repeat is set to false
-            for worldIndex in range(self.data["Trains per Episode"]):
+            # Run all training worlds together if batching is enabled
+            if self.data["Batch Train Worlds"]:
                 self.data["Mode"] = "Train"
-                self.data["World Index"] = worldIndex
+                self.data["World Index"] = None
+                self.data["World Batch Size"] = self.data["Trains per Episode"]
                 self.data["Step Index"] = None
                 
                 # Do world begin (setup) functions
                 for func in self.worldTrainBeginFuncCol:
                     func(self.data)
                 
-                # Do world end functions
+                # Do world step functions
                 for stepIndex in range(self.data["Steps"]):
                     self.data["Step Index"] = stepIndex
                     for func in self.worldTrainStepFuncCol:
                         func(self.data)
                     
-                # Do world 
+                # Do world end functions
                 for func in self.worldTrainEndFuncCol:
                     func(self.data)
+                    
+            # Send training worlds to workers if parallel workers are enabled
+            elif pool is not None:
+                self.data["Mode"] = "Train"
+                self.data["World Batch Size"] = None
+                self.data["Step Index"] = None
+                exportFunc = self.data["Train World Export Function"]
+                taskCol = []
+                for worldIndex in range(self.data["Trains per Episode"]):
+                    self.data["World Index"] = worldIndex
+                    payload = {
+                        key: self.data[key] 
+                        for key in self.data["Train World Shared Keys"]
+                    }
+                    # Workers keep the episode of the fork otherwise
+                    payload["Episode Index"] = self.data["Episode Index"]
+                    payload["Number of Episodes"] = self.data["Number of Episodes"]
+                    if exportFunc is not None:
+                        payload.update(exportFunc(self.data))
+                    taskCol.append((worldIndex, payload))
+                    
+                # Merge results in world order
+                for worldIndex, result in enumerate(
+                        pool.imap(runTrainWorldInWorker, taskCol)):
+                    self.data["World Index"] = worldIndex
+                    self.data.update(result)
+                    for func in self.worldTrainMergeFuncCol:
+                        func(self.data)
+                    
+            # Otherwise, repeat running world (with new teams) in sequence
+            else:
+                for worldIndex in range(self.data["Trains per Episode"]):
+                    self.data["Mode"] = "Train"
+                    self.data["World Index"] = worldIndex
+                    self.data["World Batch Size"] = None
+                    self.data["Step Index"] = None
+                
+                    # Do world begin (setup) functions
+                    for func in self.worldTrainBeginFuncCol:
+                        func(self.data)
+                
+                    # Do world end functions
+                    for stepIndex in range(self.data["Steps"]):
+                        self.data["Step Index"] = stepIndex
+                        for func in self.worldTrainStepFuncCol:
+                            func(self.data)
+                    
+                    # Do world 
+                    for func in self.worldTrainEndFuncCol:
+                        func(self.data)
     
             # Do End Training Functions
             for func in self.trainEndFuncCol:
                 func(self.data)
             
             # Do Begin Testing Functions
+            self.data["Mode"] = "Test"
             for func in self.testBeginFuncCol:
                 func(self.data)
     
@@ -176,6 +347,7 @@ class SimulationCore:
             for worldIndex in range(self.data["Tests per Episode"]):
                 self.data["Mode"] = "Test"
                 self.data["World Index"] = worldIndex
+                self.data["World Batch Size"] = None
                 self.data["Step Index"] = None
                 
                 
@@ -197,9 +369,46 @@ class SimulationCore:
             for func in self.testEndFuncCol:
                 func(self.data)
                 
-        # Do Trial End Functions
-        for func in self.trialEndFuncCol:
+    def runTrainWorld(self, worldIndex, payload):
+        """
+        Runs one training world instance in a worker process
+        
+        Args:
+            worldIndex (int): index of the world instance in the episode
+            payload (dict): data entries sent from the main process
+            
+        Returns:
+            dict: the data entries listed in data["Train World Result Keys"]
+        """
+        self.data.update(payload)
+        self.data["Mode"] = "Train"
+        self.data["World Index"] = worldIndex
+        self.data["World Batch Size"] = None
+        self.data["Step Index"] = None
+        
+        importFunc = self.data["Train World Import Function"]
+        if importFunc is not None:
+            importFunc(self.data)
+        
+        # Do world begin (setup) functions
+        for func in self.worldTrainBeginFuncCol:
             func(self.data)
+        
+        # Do world step functions
+        for stepIndex in range(self.data["Steps"]):
+            self.data["Step Index"] = stepIndex
+            for func in self.worldTrainStepFuncCol:
+                func(self.data)
+            
+        # Do world end functions
+        for func in self.worldTrainEndFuncCol:
+            func(self.data)
+            
+        return {key: self.data[key] for key in self.data["Train World Result Keys"]}
+    
+def runTrainWorldInWorker(task):
+    worldIndex, payload = task
+    return workerSim.runTrainWorld(worldIndex, payload)
             
 
 
@@ -1,63 +1,182 @@
-import csv
 import glob
+import json
+import multiprocessing
+import os
 from numpy import *
-from scipy import stats
 import matplotlib.pyplot as plt
 
 data = {}
 
-def folderToData(folderName, count = None):
+# folderToData() averages the csv files of a folder (e.g. the performance 
+# files of saveRewardHistory()) label by label. Starred labels (e.g. 
+# "*Episode") are taken from one file and not averaged.
+#
+# Files are parsed by a pool of worker processes, each folding its files into
+# running (Welford) means and sums of squared deviations, which are then 
+# combined. Memory use grows with the number of episodes, not files.
+#
+# The running sums are cached in the folder (see getFolderCacheFileName()) 
+# with the name, modification time and size of each file folded in, so 
+# calling folderToData() again only parses new files. If a cached file 
+# changed or was removed, the whole folder is parsed again.
+
+def getFolderCacheFileName(folderName):
+    return folderName + ".folder_to_data_cache.npz"
+
+def getFileKey(fileName):
+    fileStat = os.stat(fileName)
+    return [os.path.basename(fileName), fileStat.st_mtime_ns, fileStat.st_size]
+
+def parseDataFile(fileName):
+    """
+    Returns a dictionary of the rows of a data file, label to values
+    """
+    rowDict = {}
+    with open(fileName) as dataFile:
+        for line in dataFile:
+            label, _, values = line.rstrip("\r\n").partition(',')
+            if label:
+                rowDict[label] = fromstring(values, sep = ',')
+    return rowDict
+
+def createAccumulator():
+    return {"Count": 0, "Mean": {}, "M2": {}, "Starred": {}}
+
+def mergeAccumulators(accumulator, other):
+    """
+    Combines the running means and squared deviation sums of other into
+        accumulator (Chan et al.'s parallel update)
+    """
+    if other["Count"] == 0:
+        return accumulator
+    if accumulator["Count"] == 0:
+        return other
+    count = accumulator["Count"] + other["Count"]
+    for label, otherMean in other["Mean"].items():
+        mean = accumulator["Mean"][label]
+        if mean.shape != otherMean.shape:
+            raise ValueError("Label %s has %d values in some files and %d in others"%
+                (label, len(mean), len(otherMean)))
+        delta = otherMean - mean
+        accumulator["Mean"][label] = mean + delta * (other["Count"] / count)
+        accumulator["M2"][label] += other["M2"][label] + \
+            delta * delta * (accumulator["Count"] * other["Count"] / count)
+    accumulator["Count"] = count
+    return accumulator
+
+def accumulateFiles(fileNameCol):
+    """
+    Folds the data files into a new accumulator one at a time (Welford)
+    """
+    accumulator = createAccumulator()
+    for fileName in fileNameCol:
+        rowDict = parseDataFile(fileName)
+        fileAccumulator = createAccumulator()
+        fileAccumulator["Count"] = 1
+        for label, values in rowDict.items():
+            # stared labels are labels we do not average
+            if label[0] == '*':
+                fileAccumulator["Starred"][label[1:]] = values
+            else:
+                fileAccumulator["Mean"][label] = values
+                fileAccumulator["M2"][label] = zeros(len(values))
+        if accumulator["Count"] == 0:
+            accumulator = fileAccumulator
+        else:
+            try:
+                mergeAccumulators(accumulator, fileAccumulator)
+            except ValueError as error:
+                raise ValueError("%s: %s"%(fileName, error))
+    return accumulator
+
+def loadFolderCache(cacheFileName):
+    """
+    Returns the cached accumulator and its file keys, or None
+    """
+    if not os.path.exists(cacheFileName):
+        return None
+    try:
+        with load(cacheFileName) as arrayDict:
+            fileKeyCol = json.loads(str(arrayDict["File Keys"]))
+            accumulator = createAccumulator()
+            accumulator["Count"] = len(fileKeyCol)
+            for key in arrayDict.files:
+                kind, _, label = key.partition(" ")
+                if kind in ("Mean", "M2", "Starred"):
+                    accumulator[kind][label] = arrayDict[key]
+    except (OSError, ValueError, KeyError): # Unreadable cache, parse again
+        return None
+    return accumulator, fileKeyCol
+
+def saveFolderCache(cacheFileName, accumulator, fileKeyCol):
+    arrayDict = {"File Keys": array(json.dumps(fileKeyCol))}
+    for kind in ("Mean", "M2", "Starred"):
+        for label, values in accumulator[kind].items():
+            arrayDict[kind + " " + label] = values
+    try:
+        with open(cacheFileName + ".tmp", 'wb') as cacheFile:
+            savez(cacheFile, **arrayDict)
+        os.replace(cacheFileName + ".tmp", cacheFileName)
+    except OSError: # e.g. a read only folder, only caching is lost
+        pass
+
+def folderToData(folderName, count = None, processCount = None, useCache = True):
     if folderName[-1] != '/':
         folderName += '/'
-    
-    rawData = {}
-    
+
     # Get all data files in folder
-    fileNameCol = glob.glob(folderName + "*.csv")
+    fileNameCol = sorted(glob.glob(folderName + "*.csv"))
     sampleCount = len(fileNameCol)
-    averagingLabelCol = []
-    allLabelCol = []
     if count != None:
         fileNameCol = fileNameCol[:min(sampleCount, count)]
-    
+
     sampleCount = len(fileNameCol)
     print(sampleCount)
-    
-    # Get all labels from first file
-    with open(fileNameCol[0], newline='') as csvfile:
-        reader = csv.reader(csvfile, delimiter=',')
-        for row in reader:
-            label = row[0]
-            
-            # stared labels are labels we do not average
-            if label[0] == '*':
-                label = label[1:]
-                rawData[label] = array(list(map(float, row[1:])))
-            else:
-                rawData[label] = zeros((sampleCount, len(row[1:])))
-                averagingLabelCol.append(label)
-                allLabelCol.append(label + "_err")
-            allLabelCol.append(label)
-                
-    # Get all data from files
-    sampleIndex = 0
-    for fileName in fileNameCol:
-        with open(fileName, newline='') as csvfile:
-            reader = csv.reader(csvfile, delimiter=',')
-            for row in reader:
-                label = row[0]
-                if label[0] != '*':
-                    rawData[label][sampleIndex, :]  = list(map(float, row[1:]))
-        sampleIndex += 1
-        
-    # Get error (95% CI) and mean (deleting raw data in the process)
-    for label in averagingLabelCol:
-        rawData[label + "_err"] = 1.96 * stats.sem(rawData[label])
-        rawData[label] = mean(rawData[label], axis = 0)
-    
-    # Use spacing to lower resolution of data
-    for label in allLabelCol:
-        rawData[label] = rawData[label]
-        
+
+    # Only parse the files that are not in the cache yet
+    fileKeyCol = [getFileKey(fileName) for fileName in fileNameCol]
+    accumulator = createAccumulator()
+    cachedKeyCol = []
+    cacheFileName = getFolderCacheFileName(folderName)
+    cache = loadFolderCache(cacheFileName) if useCache else None
+    if cache is not None:
+        cachedAccumulator, cachedKeyCol = cache
+        fileKeySet = set(tuple(fileKey) for fileKey in fileKeyCol)
+        if set(tuple(fileKey) for fileKey in cachedKeyCol) <= fileKeySet:
+            accumulator = cachedAccumulator
+        else:
+            cachedKeyCol = []
+    cachedKeySet = set(tuple(fileKey) for fileKey in cachedKeyCol)
+    newFileNameCol = [
+        fileName for fileName, fileKey in zip(fileNameCol, fileKeyCol)
+        if tuple(fileKey) not in cachedKeySet
+    ]
+
+    # Get all data from files, in parallel chunks for many files
+    if processCount is None:
+        processCount = os.cpu_count()
+    if processCount > 1 and len(newFileNameCol) >= 4 * processCount:
+        chunkCount = 4 * processCount
+        chunkCol = [newFileNameCol[chunkIndex::chunkCount] for chunkIndex in range(chunkCount)]
+        with multiprocessing.get_context("fork").Pool(processCount) as pool:
+            for chunkAccumulator in pool.imap_unordered(accumulateFiles, chunkCol):
+                accumulator = mergeAccumulators(accumulator, chunkAccumulator)
+    else:
+        accumulator = mergeAccumulators(accumulator, accumulateFiles(newFileNameCol))
+
+    if useCache and newFileNameCol:
+        saveFolderCache(cacheFileName, accumulator,
+            cachedKeyCol + [getFileKey(fileName) for fileName in newFileNameCol])
+
+    # Get error (95% CI) and mean
+    rawData = {}
+    rawData.update(accumulator["Starred"])
+    sampleCount = accumulator["Count"]
+    for label, mean in accumulator["Mean"].items():
+        if sampleCount > 1:
+            rawData[label + "_err"] = 1.96 * sqrt(accumulator["M2"][label] / (sampleCount - 1)) / sqrt(sampleCount)
+        else:
+            rawData[label + "_err"] = full(len(mean), nan)
+        rawData[label] = mean
+
     return rawData
-    
@@ -1,8 +1,47 @@
 import datetime
+import code.backend # Compiled or NumPy kernels (see code/backend.py)
+from code.agent_domain_2 import * # Rover Domain Dynamic  
+from code.trajectory_history import * # Agent Position Trajectory History 
 from code.reward_2 import * # Agent Reward 
 from code.curriculum import * # Agent Curriculum
 
 
+def fusedRolloutMod(sim):
+    """
+    Runs each world of getSim() with one compiled doAgentRollout() call 
+    instead of per step sense, process, move and history functions. 
+    Apply together with a reward mod.
+    """
+    sim.worldTrainStepFuncCol.clear()
+    sim.worldTestStepFuncCol.clear()
+    sim.worldTrainEndFuncCol.insert(0, doAgentRollout)
+    sim.worldTestEndFuncCol.insert(0, doAgentRollout)
+
+
+def streamingRewardMod(sim):
+    """
+    Replaces the trajectory histories of getSim() with a reward stream (see 
+    createRewardStream() in reward_2) so memory per world does not grow with
+    data["Steps"], and switches the reward and evaluation functions to their
+    streaming versions. Trajectories are no longer archived. Apply after a 
+    reward mod; not for use with fusedRolloutMod().
+    """
+    streamingFuncDict = {
+        assignGlobalReward: assignGlobalRewardStreaming,
+        assignDifferenceReward: assignDifferenceRewardStreaming,
+        assignDppReward: assignDppRewardStreaming
+    }
+    for funcCol in (sim.worldTrainBeginFuncCol, sim.worldTestBeginFuncCol):
+        funcCol[funcCol.index(createTrajectoryHistories)] = createRewardStream
+    for funcCol in (sim.worldTrainStepFuncCol, sim.worldTestStepFuncCol):
+        funcCol[funcCol.index(updateTrajectoryHistories)] = updateRewardStream
+    for funcCol in (sim.worldTrainEndFuncCol, sim.worldTestEndFuncCol):
+        if archiveTrajectoryHistories in funcCol:
+            funcCol.remove(archiveTrajectoryHistories)
+    for key in ("Reward Function", "Evaluation Function"):
+        sim.data[key] = streamingFuncDict[sim.data[key]]
+
+
 def globalRewardMod(sim):
     sim.data["Mod Name"] = "global"
     
@@ -61,6 +100,7 @@ def dppRewardMod(sim):
 
 def globalRewardSizeCurrMod10(sim):
     sim.data["Schedule"] = ((10.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "globalSizeCurr10"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -82,6 +122,7 @@ def globalRewardSizeCurrMod10(sim):
         
 def globalRewardSizeCurrMod20(sim):
     sim.data["Schedule"] = ((20.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "globalSizeCurr20"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -104,6 +145,7 @@ def globalRewardSizeCurrMod20(sim):
         
 def globalRewardSizeCurrMod30(sim):
     sim.data["Schedule"] = ((30.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "globalSizeCurr30"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -125,6 +167,7 @@ def globalRewardSizeCurrMod30(sim):
         
 def globalRewardSizeCurrMod40(sim):
     sim.data["Schedule"] = ((40.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "globalSizeCurr40"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -148,6 +191,7 @@ def globalRewardSizeCurrMod40(sim):
 
 def globalRewardCoupCurrMod1(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((1, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "globalCoupCurr1"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -170,6 +214,7 @@ def globalRewardCoupCurrMod1(sim):
         
 def globalRewardCoupCurrMod2(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((2, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "globalCoupCurr2"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -192,6 +237,7 @@ def globalRewardCoupCurrMod2(sim):
         
 def globalRewardCoupCurrMod3(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((3, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "globalCoupCurr3"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -214,6 +260,7 @@ def globalRewardCoupCurrMod3(sim):
         
 def globalRewardCoupCurrMod4(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((4, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "globalCoupCurr4"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -236,6 +283,7 @@ def globalRewardCoupCurrMod4(sim):
         
 def globalRewardCoupCurrMod5(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((5, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "globalCoupCurr5"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -262,6 +310,7 @@ def globalRewardCoupCurrMod5(sim):
         
 def differenceRewardSizeCurrMod10(sim):
     sim.data["Schedule"] = ((10.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "differenceSizeCurr10"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -283,6 +332,7 @@ def differenceRewardSizeCurrMod10(sim):
         
 def differenceRewardSizeCurrMod20(sim):
     sim.data["Schedule"] = ((20.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "differenceSizeCurr20"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -305,6 +355,7 @@ def differenceRewardSizeCurrMod20(sim):
         
 def differenceRewardSizeCurrMod30(sim):
     sim.data["Schedule"] = ((30.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "differenceSizeCurr30"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -326,6 +377,7 @@ def differenceRewardSizeCurrMod30(sim):
         
 def differenceRewardSizeCurrMod40(sim):
     sim.data["Schedule"] = ((40.0, 2000), (50.0,3000))
+    sim.data["Curriculum Type"] = "Size"
     sim.data["Mod Name"] = "differenceSizeCurr40"
     sim.trainBeginFuncCol.insert(0, setCurriculumWorldSize)
     sim.testBeginFuncCol.insert(0, restoreWorldSize)
@@ -349,6 +401,7 @@ def differenceRewardSizeCurrMod40(sim):
 
 def differenceRewardCoupCurrMod1(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((1, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "differenceCoupCurr1"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -371,6 +424,7 @@ def differenceRewardCoupCurrMod1(sim):
         
 def differenceRewardCoupCurrMod2(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((2, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "differenceCoupCurr2"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -393,6 +447,7 @@ def differenceRewardCoupCurrMod2(sim):
         
 def differenceRewardCoupCurrMod3(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((3, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "differenceCoupCurr3"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -415,6 +470,7 @@ def differenceRewardCoupCurrMod3(sim):
         
 def differenceRewardCoupCurrMod4(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((4, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "differenceCoupCurr4"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -437,6 +493,7 @@ def differenceRewardCoupCurrMod4(sim):
         
 def differenceRewardCoupCurrMod5(sim):
     sim.data["Schedule"] = sim.data["Schedule"] = ((5, 2000), (6, 3000))
+    sim.data["Curriculum Type"] = "Coupling"
     sim.data["Mod Name"] = "differenceCoupCurr5"
     sim.trainBeginFuncCol.insert(0, setCurriculumCoupling)
     sim.testBeginFuncCol.insert(0, restoreCoupling)
@@ -1,8 +1,9 @@
-# Dependencies: numpy, cython 
+# Dependencies: numpy, cython (optional, see code/backend.py)
 
 import datetime
+import multiprocessing
 from core import SimulationCore
-import pyximport; pyximport.install() # For cython(pyx) code
+import code.backend # Compiled or NumPy kernels (see code/backend.py)
 from code.world_setup import * # Rover Domain Construction 
 from code.agent_domain_2 import * # Rover Domain Dynamic  
 from code.reward_2 import * # Agent Reward and Performance Recording 
@@ -127,6 +128,20 @@ class RoverDomainCoreGym(SimulationCore):
             lambda data: data.update({"Gym Reward": data["Global Reward"]}) 
         )    
         
+        # Add World Snapshot Functionality
+        """
+        snapshot() copies the data entries listed in data["Snapshot Keys"] 
+        (numpy arrays, tuples of numpy arrays or plain values) and restore() 
+        copies them back, so that several alternatives can be rolled forward
+        from the same mid-world state.
+        """
+        self.data["Snapshot Keys"] = [
+            "Step Index", "Mode", "Agent Positions", "Agent Orientations", 
+            "Poi Positions", "Poi Values", "Agent Observations", 
+            "Agent Position History", "Agent Orientation History", 
+            "Reward Stream", "Gym Reward"
+        ]
+        
         # Setup world for first time
         self.reset(newMode = "Train", fullyResetting = True)
         
@@ -194,6 +209,39 @@ class RoverDomainCoreGym(SimulationCore):
         return self.data["Agent Observations"], self.data["Gym Reward"], \
             done, self.data
         
+    def snapshot(self, handle = None):
+        """
+        Save the current world state
+        
+        Args:
+        handle (None, WorldSnapshot): a snapshot from a previous call to 
+            reuse, its buffers are overwritten instead of allocating new ones
+            
+        Returns:
+        WorldSnapshot: handle to pass to restore()
+        """
+        if handle is None:
+            handle = WorldSnapshot()
+        handle.save(self.data, self.data["Snapshot Keys"])
+        return handle
+        
+    def restore(self, handle):
+        """
+        Return the world to the state saved by snapshot(). The handle is not
+            changed and can be restored again. Arrays are copied back into 
+            the world's current arrays where the shapes match, so copy any 
+            earlier observations or rewards that should be kept.
+        
+        Args:
+        handle (WorldSnapshot): returned by snapshot()
+            
+        Returns:
+        observation: see rover domain dynamic functionality comments in 
+            __init__()
+        """
+        handle.load(self.data)
+        return self.data["Agent Observations"]
+        
     def reset(self, newMode = None, fullyResetting = False):
         """
         Reset the world 
@@ -240,5 +288,378 @@ class RoverDomainCoreGym(SimulationCore):
         
         return self.data["Agent Observations"]
         
+class WorldSnapshot:
+    """
+    Saved data entries of a RoverDomainCoreGym, see 
+        RoverDomainCoreGym.snapshot(). Arrays are copied into buffers owned 
+        by the snapshot, which are reused when the snapshot is saved again 
+        with arrays of the same shapes; nothing else in data is copied.
+    """
+    def __init__(self):
+        self.valueDict = {}
+        
+    def save(self, data, keyCol):
+        valueDict = {}
+        for key in keyCol:
+            if key not in data:
+                continue
+            value = data[key]
+            if isinstance(value, np.ndarray):
+                valueDict[key] = copyIntoBuffer(value, self.valueDict.get(key))
+            elif isinstance(value, tuple):
+                oldBufferCol = self.valueDict.get(key)
+                if not isinstance(oldBufferCol, tuple) or len(oldBufferCol) != len(value):
+                    oldBufferCol = (None,) * len(value)
+                valueDict[key] = tuple(
+                    copyIntoBuffer(array, buffer) 
+                    for array, buffer in zip(value, oldBufferCol)
+                )
+            else:
+                valueDict[key] = value
+        self.valueDict = valueDict
+        
+    def load(self, data):
+        for key, value in self.valueDict.items():
+            if isinstance(value, np.ndarray):
+                data[key] = copyIntoBuffer(value, data.get(key))
+            elif isinstance(value, tuple):
+                oldArrayCol = data.get(key)
+                if not isinstance(oldArrayCol, tuple) or len(oldArrayCol) != len(value):
+                    oldArrayCol = (None,) * len(value)
+                data[key] = tuple(
+                    copyIntoBuffer(buffer, array) 
+                    for buffer, array in zip(value, oldArrayCol)
+                )
+            else:
+                data[key] = value
+                
+def copyIntoBuffer(array, buffer):
+    """
+    Copy array into buffer if buffer is an array of the same shape and type,
+        otherwise into a new array. Returns the array copied into.
+    """
+    if isinstance(buffer, np.ndarray) and buffer.shape == array.shape and \
+            buffer.dtype == array.dtype and buffer.flags.writeable:
+        np.copyto(buffer, array)
+        return buffer
+    return array.copy()
+
+class RoverDomainCoreGymVec(RoverDomainCoreGym):
+    """
+    Vectorized version of RoverDomainCoreGym that runs worldCount worlds 
+    together in lockstep (see data["World Batch Size"] in core.py). The 
+    world state arrays get a leading world axis and every function 
+    collection runs once per step for all worlds, so stepping costs about 
+    the same Python overhead as a single RoverDomainCoreGym.
+    
+    Every world is built from its own blueprint (see blueprintEachWorld() in
+    code/world_setup.py) and keeps its own step index, data["Step Index"] is
+    an array with one entry per world. step() resets only the worlds that 
+    are done, from their blueprints, and resetWorlds() resets any of them; 
+    the entries of data["World Axis Keys"] are sliced for the worlds being 
+    reset or ended and copied back.
+    """
+    def __init__(self, worldCount):
+        self.worldCount = worldCount
+        RoverDomainCoreGym.__init__(self)
+        
+        self.data["World Axis Keys"] = [
+            "Step Index", "Agent Positions", "Agent Orientations", 
+            "Poi Positions", "Poi Values", "Agent Observations", 
+            "Agent Position History", "Agent Orientation History", 
+            "Reward Stream", 'Agent Positions BluePrint', 
+            'Agent Orientations BluePrint', 'Poi Positions BluePrint', 
+            'Poi Values BluePrint'
+        ]
+        
+    def step(self, action):
+        """
+        Proceed 1 time step in all worlds, resetting the worlds that are done
+        
+        Args:
+        action (3d numpy array with double precision): Actions for all rovers
+            of all worlds, worldCount by agentCount by 2
+        
+        Returns:
+        observation (3d numpy array with double precision): Observations of 
+            all worlds, worldCount by agentCount by 8. For the worlds that 
+            are done these are the first observations of the reset worlds.
+        reward (2d numpy array with double precision): Rewards for all rovers
+            of all worlds, worldCount by agentCount. Zero for worlds that are
+            not done, otherwise data["Agent Rewards"] in training mode and 
+            data["Global Reward"] of the world in testing mode.
+        done (1d numpy array of booleans): Whether each world finished with 
+            this step, length is worldCount
+        info (dictionary): Empty unless a world is done, then contains 
+            "Final Observations" (worldCount by agentCount by 8) and "Global 
+            Reward" (length worldCount); only the entries of the done worlds
+            are meaningful
+        """
+        if self.data["Mode"] == "Train":
+            stepFuncCol = self.worldTrainStepFuncCol
+            endFuncCol = self.worldTrainEndFuncCol
+        elif self.data["Mode"] == "Test":
+            stepFuncCol = self.worldTestStepFuncCol
+            endFuncCol = self.worldTestEndFuncCol
+        else:
+            raise Exception('data["Mode"] should be set to "Train" or "Test"')
+        
+        # Do Step Functionality
+        self.data["Agent Actions"] = action
+        for func in stepFuncCol:
+            func(self.data)
+        self.data["Step Index"] += 1
+        self.data["Observation Function"](self.data)
+        
+        reward = np.zeros((self.worldCount, self.data["Number of Agents"]))
+        done = self.data["Step Index"] >= self.data["Steps"]
+        info = {}
+        
+        # Do ending functions for the worlds that are done, then reset them
+        if done.any():
+            worldIndexCol = np.flatnonzero(done)
+            worldData = self.getWorldData(worldIndexCol)
+            for func in endFuncCol:
+                func(worldData)
+            if self.data["Mode"] == "Train":
+                reward[worldIndexCol] = worldData["Agent Rewards"]
+            else:
+                reward[worldIndexCol] = np.reshape(worldData["Global Reward"], (-1, 1))
+            info["Final Observations"] = self.data["Agent Observations"].copy()
+            info["Global Reward"] = np.zeros(self.worldCount)
+            info["Global Reward"][worldIndexCol] = worldData["Global Reward"]
+            self.resetWorlds(worldIndexCol)
+                
+        return self.data["Agent Observations"], reward, done, info
+        
+    def reset(self, newMode = None, fullyResetting = False):
+        """
+        Reset all worlds, see RoverDomainCoreGym.reset(). Fully resetting 
+            draws new blueprints for every world.
+        
+        Returns:
+        observation (3d numpy array with double precision): Observations of 
+            all worlds, worldCount by agentCount by 8
+        """
+        self.data["World Index"] = None
+        self.data["World Batch Size"] = self.worldCount
+        self.data["Blueprint World Count"] = self.worldCount
+        observation = RoverDomainCoreGym.reset(self, newMode, fullyResetting)
+        self.data["Step Index"] = np.zeros(self.worldCount, dtype = int)
+        return observation
+        
+    def resetWorlds(self, worldIndexCol):
+        """
+        Reset the worlds worldIndexCol from their blueprints, leaving the 
+            other worlds as they are
+            
+        Args:
+        worldIndexCol (1d numpy array of ints): indices of the worlds to reset
+            
+        Returns:
+        observation (3d numpy array with double precision): Observations of 
+            all worlds, worldCount by agentCount by 8
+        """
+        if self.data["Mode"] == "Train":
+            beginFuncCol = self.worldTrainBeginFuncCol
+        elif self.data["Mode"] == "Test":
+            beginFuncCol = self.worldTestBeginFuncCol
+        else:
+            raise Exception('data["Mode"] should be set to "Train" or "Test"')
+            
+        worldData = self.getWorldData(worldIndexCol)
+        for func in beginFuncCol:
+            func(worldData)
+        worldData["Observation Function"](worldData)
+        worldData["Step Index"] = np.zeros(len(worldIndexCol), dtype = int)
+        self.setWorldData(worldData, worldIndexCol)
+        
+        return self.data["Agent Observations"]
+        
+    def getWorldData(self, worldIndexCol):
+        """
+        Returns a copy of data for the worlds worldIndexCol only, with copies
+            of the data["World Axis Keys"] entries of those worlds
+        """
+        worldData = dict(self.data)
+        worldData["World Batch Size"] = len(worldIndexCol)
+        for key in self.data["World Axis Keys"]:
+            value = self.data.get(key)
+            if isinstance(value, np.ndarray):
+                worldData[key] = value[worldIndexCol]
+            elif isinstance(value, tuple):
+                worldData[key] = tuple(array[worldIndexCol] for array in value)
+        return worldData
+        
+    def setWorldData(self, worldData, worldIndexCol):
+        """
+        Copies the data["World Axis Keys"] entries of worldData, from 
+            getWorldData(worldIndexCol), back into the worlds worldIndexCol
+        """
+        for key in self.data["World Axis Keys"]:
+            value = self.data.get(key)
+            if isinstance(value, np.ndarray):
+                value[worldIndexCol] = worldData[key]
+            elif isinstance(value, tuple):
+                for array, worldArray in zip(value, worldData[key]):
+                    array[worldIndexCol] = worldArray
+        
+class RoverDomainCoreGymSubproc:
+    """
+    Runs envCount RoverDomainCoreGym environments (made by envFunc, which
+    should also apply any mods) in workerCount forked worker processes, for
+    reward or policy code that can not run on stacked worlds like 
+    RoverDomainCoreGymVec. 
+    
+    Actions, observations, rewards and done flags are exchanged through 
+    shared memory buffers; each step only sends a short command to every 
+    worker and waits for its reply, so the cost of a step does not depend on
+    the size of the world state (e.g. the trajectory histories). Like 
+    RoverDomainCoreGymVec, environments that are done are reset by step().
+    
+    Each worker reseeds numpy's random generator with seed + workerIndex 
+    (or from the OS if seed is None) so the workers do not build identical 
+    worlds.
+    
+    agentCount must be the "Number of Agents" of the environments envFunc 
+    makes; it sizes the shared buffers, which exist before any environment 
+    is made in the workers.
+    """
+    def __init__(self, envFunc, envCount, workerCount, agentCount, seed = None):
+        self.envCount = envCount
+        self.agentCount = agentCount
+        
+        # Shared buffers, viewed as numpy arrays on both sides
+        context = multiprocessing.get_context("fork")
+        self.bufferDict = {
+            "Actions": (context.RawArray('d', envCount * self.agentCount * 2), 
+                (envCount, self.agentCount, 2)),
+            "Observations": (context.RawArray('d', envCount * self.agentCount * 8), 
+                (envCount, self.agentCount, 8)),
+            "Final Observations": (context.RawArray('d', envCount * self.agentCount * 8), 
+                (envCount, self.agentCount, 8)),
+            "Rewards": (context.RawArray('d', envCount * self.agentCount), 
+                (envCount, self.agentCount)),
+            "Global Reward": (context.RawArray('d', envCount), (envCount,)),
+            "Done": (context.RawArray('d', envCount), (envCount,))
+        }
+        self.arrayDict = getSharedArrays(self.bufferDict)
+        
+        # Give each worker a contiguous range of environments
+        self.connectionCol = []
+        self.processCol = []
+        envSplitCol = np.linspace(0, envCount, workerCount + 1).astype(int)
+        for workerIndex in range(workerCount):
+            connection, workerConnection = context.Pipe()
+            workerSeed = None if seed is None else seed + workerIndex
+            process = context.Process(
+                target = runGymWorker,
+                args = (envFunc, envSplitCol[workerIndex], 
+                    envSplitCol[workerIndex + 1], self.bufferDict, 
+                    workerSeed, workerConnection),
+                daemon = True
+            )
+            process.start()
+            workerConnection.close()
+            self.connectionCol.append(connection)
+            self.processCol.append(process)
+        
+    def sendCommand(self, command):
+        for connection in self.connectionCol:
+            connection.send(command)
+        for connection in self.connectionCol:
+            connection.recv()
+        
+    def step(self, action):
+        """
+        Proceed 1 time step in all environments, see RoverDomainCoreGymVec.step()
+        
+        Args:
+        action (3d numpy array with double precision): Actions for all rovers
+            of all environments, envCount by agentCount by 2
+        
+        Returns:
+        observation, reward, done, info: see RoverDomainCoreGymVec.step(). 
+            info contains "Final Observations" and "Global Reward" for all 
+            environments; only the entries of the done ones are meaningful.
+        """
+        self.arrayDict["Actions"][:] = action
+        self.sendCommand(("Step",))
+        
+        info = {
+            "Final Observations": self.arrayDict["Final Observations"].copy(),
+            "Global Reward": self.arrayDict["Global Reward"].copy()
+        }
+        return self.arrayDict["Observations"].copy(), \
+            self.arrayDict["Rewards"].copy(), \
+            self.arrayDict["Done"].astype(bool), info
+        
+    def reset(self, newMode = None, fullyResetting = False):
+        """
+        Reset all environments, see RoverDomainCoreGym.reset()
+        
+        Returns:
+        observation (3d numpy array with double precision): Observations of 
+            all environments, envCount by agentCount by 8
+        """
+        self.sendCommand(("Reset", newMode, fullyResetting))
+        return self.arrayDict["Observations"].copy()
+        
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        for connection in self.connectionCol:
+            connection.send(("Close",))
+        for process in self.processCol:
+            process.join()
+        for connection in self.connectionCol:
+            connection.close()
+        self.connectionCol = []
+        self.processCol = []
+
+def getSharedArrays(bufferDict):
+    return {
+        key: np.frombuffer(buffer, dtype = np.float64).reshape(shape)
+        for key, (buffer, shape) in bufferDict.items()
+    }
+    
+def runGymWorker(envFunc, envStart, envStop, bufferDict, seed, connection):
+    """
+    Worker loop of RoverDomainCoreGymSubproc, runs environments envStart to
+    envStop - 1 and answers every command on connection with None
+    """
+    np.random.seed(seed)
+    envCol = [envFunc() for envIndex in range(envStart, envStop)]
+    arrayDict = getSharedArrays(bufferDict)
+    agentCount = arrayDict["Actions"].shape[1]
+    for env in envCol:
+        if env.data["Number of Agents"] != agentCount:
+            raise ValueError("envFunc() made an environment with %d agents, "
+                "RoverDomainCoreGymSubproc expected agentCount = %d"%(
+                env.data["Number of Agents"], agentCount))
+    
+    while True:
+        command = connection.recv()
+        if command[0] == "Step":
+            for envIndex, env in zip(range(envStart, envStop), envCol):
+                observation, reward, done, info = \
+                    env.step(arrayDict["Actions"][envIndex].copy())
+                arrayDict["Rewards"][envIndex] = reward
+                arrayDict["Done"][envIndex] = done
+                if done:
+                    arrayDict["Final Observations"][envIndex] = observation
+                    arrayDict["Global Reward"][envIndex] = env.data["Global Reward"]
+                    observation = env.reset()
+                arrayDict["Observations"][envIndex] = observation
+        elif command[0] == "Reset":
+            newMode, fullyResetting = command[1:]
+            for envIndex, env in zip(range(envStart, envStop), envCol):
+                arrayDict["Observations"][envIndex] = env.reset(newMode, fullyResetting)
+        elif command[0] == "Close":
+            break
+        connection.send(None)
+    connection.close()
+        
 def assign(data, key, value):
     data[key] = value
\ No newline at end of file
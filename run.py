@@ -1,55 +1,41 @@
-from specifics import getSim
-from mods import *
-from shutil import copyfile
-import random
+from sweep import runSweep
 
-# NOTE: Add the mod functions (variables) to run to modCol here:
-modCol = [
-    globalRewardSizeCurrMod10,
-    globalRewardSizeCurrMod20,
-    globalRewardSizeCurrMod30,
-    globalRewardSizeCurrMod40,
-    globalRewardCoupCurrMod1,
-    globalRewardCoupCurrMod2,
-    globalRewardCoupCurrMod3,
-    globalRewardCoupCurrMod4,
-    globalRewardCoupCurrMod5,
-    differenceRewardSizeCurrMod10,
-    differenceRewardSizeCurrMod20,
-    differenceRewardSizeCurrMod30,
-    differenceRewardSizeCurrMod40,
-    differenceRewardCoupCurrMod1,
-    differenceRewardCoupCurrMod2,
-    differenceRewardCoupCurrMod3,
-    differenceRewardCoupCurrMod4,
-    differenceRewardCoupCurrMod5,
-    
-]
+# NOTE: Set the trials to run in sweepGrid here (see sweep.py):
+# (the reward and curriculum axes match the ...SizeCurrMod and ...CoupCurrMod
+# functions in mods.py)
+sweepGrid = {
+    "Reward": ["global", "difference"],
+    "Curriculum": [
+        {"Type": "Size", "Schedule": [[10.0, 2000], [50.0, 3000]]},
+        {"Type": "Size", "Schedule": [[20.0, 2000], [50.0, 3000]]},
+        {"Type": "Size", "Schedule": [[30.0, 2000], [50.0, 3000]]},
+        {"Type": "Size", "Schedule": [[40.0, 2000], [50.0, 3000]]},
+        {"Type": "Coupling", "Schedule": [[1, 2000], [6, 3000]]},
+        {"Type": "Coupling", "Schedule": [[2, 2000], [6, 3000]]},
+        {"Type": "Coupling", "Schedule": [[3, 2000], [6, 3000]]},
+        {"Type": "Coupling", "Schedule": [[4, 2000], [6, 3000]]},
+        {"Type": "Coupling", "Schedule": [[5, 2000], [6, 3000]]},
+    ],
+    "Number of Agents": [30],
+    "Number of POIs": [8],
+    "Repetitions": 30,
+}
 
-# modCol = [
-#     globalRewardMod,
-#     differenceRewardMod
-# ]
+# sweepGrid = {
+#     "Reward": ["global", "difference"],
+# }
 
-def copyTestFiles():
-    copyfile("mods.py", "log/%s/mods.py"%sim.data["Specifics Name"])
-    copyfile("specifics.py", "log/%s/specifics.py"%sim.data["Specifics Name"])
-    
+# Finished trials are recorded in the manifest; running again resumes the sweep
+# (trial names end with a hash of the configuration, so changed trials run 
+# again). Results go to log/<Specifics Name>/<Mod Name>/ as with mods.py.
+manifestFileName = "log/sweep/run_manifest.jsonl"
 
-def main():
-    getSim().run()
-    
-i = 0
-while True:
-    print("Run %i"%(i))
-    random.shuffle(modCol)
-    for mod in modCol:
-        sim = getSim()
-        mod(sim)
-        sim.run()
-    i += 1
+# To spread the sweep over several machines sharing the log directory, use
+# "python work_queue.py submit" once and "python work_queue.py work" on each
+# machine instead (see work_queue.py)
 
-    
-# main()
-# sim = getSim()
-# sim.run()
\ No newline at end of file
+# Maximum number of trials to run at once (None uses every cpu)
+processCount = None
+
+if __name__ == "__main__":
+    runSweep(sweepGrid, manifestFileName, processCount)
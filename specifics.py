@@ -1,6 +1,6 @@
 import datetime
 from core import SimulationCore
-import pyximport; pyximport.install() # For cython(pyx) code
+import code.backend # Compiled or NumPy kernels (see code/backend.py)
 from code.world_setup import * # Rover Domain Construction 
 from code.agent_domain_2 import * # Rover Domain Dynamic  
 from code.trajectory_history import * # Agent Position Trajectory History 
@@ -8,6 +8,9 @@ from code.reward_2 import * # Agent Reward
 from code.reward_history import * # Performance Recording 
 from code.ccea_2 import * # CCEA 
 from code.save_to_pickle import * # Save data as pickle file
+from code.async_io import * # Background writing of saved files
+from code.checkpoint import * # Trial checkpoints
+from code.results_catalog import * # Catalog of trials and result files
 
 # from code.experience_replay import *
 # from code.dpg import *
@@ -40,6 +43,23 @@ def getSim():
     sim.data["Specifics Name"] = "30Agents_8Poi_6Coup_Long_Comparison"
     sim.data["Mod Name"] = "global"
     
+    # Set to True to run all training worlds of an episode together in lockstep
+    sim.data["Batch Train Worlds"] = False
+    
+    # Set to the number of worker processes to run training worlds in parallel
+    sim.data["Train Worker Count"] = None
+    
+    # Set to the number of OpenMP threads used inside the compiled kernels
+    sim.data["Thread Count"] = 1
+    
+    # Set to a distance to only sense agents and pois within it (None senses all)
+    sim.data["Sensing Radius"] = None
+    
+    # Set to an integer to draw world setup and evolution from independent 
+    # random streams derived from it (None draws from the global random state)
+    sim.data["Random Seed"] = None
+    sim.data["Trial Index"] = 0
+    
     # NOTE: all simulation core ...funcCol collections are order-sensitive
     
     # print the current Episode
@@ -77,12 +97,12 @@ def getSim():
     sim.worldTrainStepFuncCol.append(
         lambda data: data["Observation Function"](data)
     )
-    sim.worldTrainStepFuncCol.append(doAgentProcess)
+    sim.worldTrainStepFuncCol.append(doAgentProcessStacked)
     sim.worldTrainStepFuncCol.append(doAgentMove)
     sim.worldTestStepFuncCol.append(
         lambda data: data["Observation Function"](data)
     )
-    sim.worldTestStepFuncCol.append(doAgentProcess)
+    sim.worldTestStepFuncCol.append(doAgentProcessStacked)
     sim.worldTestStepFuncCol.append(doAgentMove)
     
     # Add Agent Position Trajectory History Functionality
@@ -90,10 +110,15 @@ def getSim():
         (sim.data["Specifics Name"], sim.data["Mod Name"], dateTimeString)
     sim.worldTrainBeginFuncCol.append(createTrajectoryHistories)
     sim.worldTrainStepFuncCol.append(updateTrajectoryHistories)
-    sim.trialEndFuncCol.append(saveTrajectoryHistories)
     sim.worldTestBeginFuncCol.append(createTrajectoryHistories)
     sim.worldTestStepFuncCol.append(updateTrajectoryHistories)
     
+    # Archive the test world of every 100th episode in binary (see 
+    # archiveTrajectoryHistories(), saved next to "Trajectory Save File Name")
+    sim.data["Trajectory Archive Episode Period"] = 100
+    sim.data["Trajectory Archive Modes"] = ["Test"]
+    sim.worldTestEndFuncCol.append(archiveTrajectoryHistories)
+    
     # Add Agent Training Reward and Evaluation Functionality
     sim.data["Coupling"] = 6
     sim.data["Observation Radius"] = 4.0
@@ -114,6 +139,12 @@ def getSim():
     sim.testEndFuncCol.append(updateRewardHistory)
     sim.trialEndFuncCol.append(saveRewardHistory)
     
+    # Append each test episode's performance to a log next to the csv file
+    sim.data["Performance Log Flush Period"] = 1
+    sim.trialBeginFuncCol.append(createPerformanceLog)
+    sim.testEndFuncCol.append(updatePerformanceLog)
+    sim.trialEndFuncCol.append(flushPerformanceLog)
+    
     # # Add DE Functionality (all Functionality below are dependent and are displayed together for easy accessibility)
     # from code.differential_evolution import initDe, assignDePolicies, rewardDePolicies, evolveDePolicies, assignBestDePolicies
     # sim.trialBeginFuncCol.append(initDe(input_shape= 8, num_outputs=2, num_units = 16))
@@ -142,11 +173,31 @@ def getSim():
     # sim.data['Critic Hidden Count'] = 200
     # 
     # Add CCEA Functionality 
+    # Note: for array population storage with vectorized evolution, use 
+    # initCceaArray() and evolveCceaArrayPolicies() in place of initCcea() 
+    # and evolveCceaPolicies()
     sim.trialBeginFuncCol.append(initCcea(input_shape= 8, num_outputs=2, num_units = 32))
     sim.worldTrainBeginFuncCol.append(assignCceaPolicies)
+    sim.worldTrainBeginFuncCol.append(stackAgentPolicies)
     sim.worldTrainEndFuncCol.append(rewardCceaPolicies)
     sim.testEndFuncCol.append(evolveCceaPolicies)
     sim.worldTestBeginFuncCol.append(assignBestCceaPolicies)
+    sim.worldTestBeginFuncCol.append(stackAgentPolicies)
+    
+    # Parallel training worlds (enabled by setting "Train Worker Count" > 1)
+    # Workers only see the data of the fork plus these keys, "Episode Index"
+    # and "Number of Episodes": add any other per-episode key read by a 
+    # worldTrain... function (e.g. one set by a trainBeginFuncCol function)
+    sim.data["Train World Shared Keys"] = [
+        'Agent Positions BluePrint', 'Agent Orientations BluePrint',
+        'Poi Positions BluePrint', 'Poi Values BluePrint', 
+        'World Width', 'World Length', 'Coupling'
+    ]
+    sim.data["Train World Export Function"] = exportCceaTeam
+    sim.data["Train World Import Function"] = importCceaTeam
+    sim.data["Train World Result Keys"] = ["Agent Rewards", "Global Reward"]
+    sim.worldTrainMergeFuncCol.append(assignCceaPolicies)
+    sim.worldTrainMergeFuncCol.append(rewardCceaPolicies)
     
     
     # Save data as pickle file
@@ -154,6 +205,26 @@ def getSim():
         (sim.data["Specifics Name"], sim.data["Mod Name"], dateTimeString)
     #sim.trialEndFuncCol.append(savePickle)
     
+    # Checkpoint the trial every 10 episodes, continue with sim.resume(fileName)
+    # (the file names and catalog row are restored, so results stay together)
+    sim.data["Checkpoint Period"] = 10
+    sim.data["Checkpoint Value Keys"] = ["Coupling", "World Width", "World Length",
+        "Performance Save File Name", "Trajectory Save File Name", 
+        "Pickle Save File Name", "Results Catalog Trial Id"]
+    sim.data["Checkpoint Load Function"] = loadCheckpoint
+    sim.testEndFuncCol.append(saveCheckpoint)
+    
+    # Register the trial and its result files in the results catalog
+    sim.data["Results Catalog File Name"] = "log/results_catalog.sqlite"
+    sim.trialBeginFuncCol.append(registerTrialStart)
+    sim.trialEndFuncCol.append(registerTrialFinish)
+    
+    # Write saved files on a background thread, flushed at the end of the 
+    # trial (keep stopAsyncWriter last) or when the program exits
+    sim.data["Async Writer Queue Size"] = 16
+    sim.trialBeginFuncCol.insert(0, startAsyncWriter)
+    sim.trialEndFuncCol.append(stopAsyncWriter)
+    
     return sim
 
 
@@ -0,0 +1,310 @@
+"""
+Runs a grid of trials (reward × curriculum × agent/POI counts × repetitions)
+on a local pool of processes, each trial built with specifics.getSim() and
+the mod functions of mods.py.
+
+A sweep grid is a dictionary:
+    "Reward": reward names, each applies the mod <name>RewardMod (e.g.
+        "global", "difference", "dpp")
+    "Curriculum": None (no curriculum) or dictionaries with "Type"
+        ("Size" or "Coupling"), "Schedule" (e.g. [[3, 2000], [6, 3000]]) and
+        optionally "Name" (default e.g. "CoupCurr3", as in mods.py)
+    "Number of Agents", "Number of POIs": counts (default: getSim()'s)
+    "Repetitions": number of trials of each configuration (default 1)
+    "Random Seed": root seed (see code/random_streams.py), repetitions use
+        it with "Trial Index" set to the repetition. If None (default), each
+        trial seeds the global random state from the operating system
+    "Extra Mods": names of mod functions applied to every trial after the
+        reward and curriculum (e.g. ["streamingRewardMod"])
+    "Data": data entries set on every trial after the mods (e.g.
+        {"Number of Episodes": 100})
+
+Every trial has a "Trial Name" made from its configuration, ending with a
+short hash of the whole configuration (including "Data", "Extra Mods" and
+"Random Seed"). When a trial finishes, it is appended to the manifest (a
+JSON line with its configuration and save file names). Running the same
+sweep again with the same manifest only runs the trials that have not
+finished, so an interrupted sweep resumes where it stopped; a trial whose
+configuration changed gets a new name and runs again.
+
+Trials are saved under log/<Specifics Name>/<Mod Name>/ like the mods of
+mods.py, with the same "Mod Name" (e.g. "globalSizeCurr10") when the agent
+and POI counts are getSim()'s; other counts add e.g. "_50Agents_8Pois".
+
+Usage: see run.py
+"""
+import datetime
+import errno
+import hashlib
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import sys
+import numpy as np
+from specifics import getSim
+import mods
+from code.curriculum import *
+from code.results_catalog import getTrialCatalogRow
+
+curriculumFuncDict = {
+    "Size": (setCurriculumWorldSize, restoreWorldSize, "SizeCurr"),
+    "Coupling": (setCurriculumCoupling, restoreCoupling, "CoupCurr"),
+}
+
+def getCurriculumName(curriculum):
+    if curriculum is None:
+        return ""
+    if "Name" in curriculum:
+        return curriculum["Name"]
+    return "%s%g"%(curriculumFuncDict[curriculum["Type"]][2], curriculum["Schedule"][0][0])
+
+def getConfigHash(config):
+    """
+    Returns a short hash of a configuration that is the same in every run
+    """
+    configText = json.dumps(config, sort_keys = True)
+    return hashlib.sha1(configText.encode("utf-8")).hexdigest()[:8]
+
+def getSweepConfigCol(sweepGrid):
+    """
+    Returns the list of trial configurations of the sweep grid, each a
+        dictionary with a unique "Trial Name"
+    """
+    defaultData = getSim().data
+    configCol = []
+    for reward, curriculum, agentCount, poiCount, repetitionIndex in itertools.product(
+            sweepGrid["Reward"],
+            sweepGrid.get("Curriculum", [None]),
+            sweepGrid.get("Number of Agents", [defaultData["Number of Agents"]]),
+            sweepGrid.get("Number of POIs", [defaultData["Number of POIs"]]),
+            range(sweepGrid.get("Repetitions", 1))):
+        modName = reward + getCurriculumName(curriculum)
+        if agentCount != defaultData["Number of Agents"] or \
+                poiCount != defaultData["Number of POIs"]:
+            modName += "_%dAgents_%dPois"%(agentCount, poiCount)
+        config = {
+            "Mod Name": modName,
+            "Reward": reward,
+            "Curriculum": curriculum,
+            "Number of Agents": agentCount,
+            "Number of POIs": poiCount,
+            "Repetition": repetitionIndex,
+            "Random Seed": sweepGrid.get("Random Seed"),
+            "Extra Mods": list(sweepGrid.get("Extra Mods", [])),
+            "Data": dict(sweepGrid.get("Data", {})),
+        }
+        config["Trial Name"] = "%s_rep%d_%s"%(modName, repetitionIndex,
+            getConfigHash(config))
+        configCol.append(config)
+    return configCol
+
+def applySweepConfig(sim, config):
+    """
+    Applies a trial configuration of getSweepConfigCol() to a simulation
+        from getSim()
+    """
+    getattr(mods, config["Reward"] + "RewardMod")(sim)
+
+    curriculum = config["Curriculum"]
+    if curriculum is not None:
+        setFunc, restoreFunc, _ = curriculumFuncDict[curriculum["Type"]]
+        sim.data["Schedule"] = tuple(tuple(stage) for stage in curriculum["Schedule"])
+        sim.data["Curriculum Type"] = curriculum["Type"]
+        sim.trainBeginFuncCol.insert(0, setFunc)
+        sim.testBeginFuncCol.insert(0, restoreFunc)
+
+    sim.data["Number of Agents"] = config["Number of Agents"]
+    poiCount = config["Number of POIs"]
+    sim.data["Number of POIs"] = poiCount
+    if len(sim.data['Poi Static Values']) != poiCount:
+        # Fixed (per poi count) static layout for other poi counts
+        sim.data['Poi Static Values'] = np.arange(poiCount) + 1.0
+        sim.data['Poi Relative Static Positions'] = np.random.RandomState(poiCount).rand(poiCount, 2)
+
+    sim.data["Random Seed"] = config["Random Seed"]
+    sim.data["Trial Index"] = config["Repetition"]
+
+    for modName in config["Extra Mods"]:
+        getattr(mods, modName)(sim)
+    sim.data.update(config["Data"])
+
+    sim.data["Mod Name"] = config["Mod Name"]
+    dateTimeString = datetime.datetime.now().strftime("%m_%d_%Y %H_%M_%S_%f")
+    sim.data["Performance Save File Name"] = "log/%s/%s/performance/perf %s.csv"%\
+        (sim.data["Specifics Name"], sim.data["Mod Name"], dateTimeString)
+    sim.data["Trajectory Save File Name"] = "log/%s/%s/trajectory/traj %s.csv"%\
+        (sim.data["Specifics Name"], sim.data["Mod Name"], dateTimeString)
+    sim.data["Pickle Save File Name"] = "log/%s/%s/pickle/data %s.pickle"%\
+        (sim.data["Specifics Name"], sim.data["Mod Name"], dateTimeString)
+
+def runSweepTrial(config, resultConnection, quiet, catalogFileName = None):
+    """
+    Runs one trial in a sweep process and sends back its manifest entry, 
+        which includes its results catalog row. If catalogFileName is not 
+        None, the trial is registered in that catalog instead of getSim()'s.
+    """
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    if config["Random Seed"] is None:
+        # Forked processes share the parent's random state
+        np.random.seed()
+        random.seed()
+
+    sim = getSim()
+    applySweepConfig(sim, config)
+    if catalogFileName is not None:
+        sim.data["Results Catalog File Name"] = catalogFileName
+    sim.run()
+
+    resultConnection.send({
+        "Trial Name": config["Trial Name"],
+        "Status": "Finished",
+        "Config": config,
+        "Specifics Name": sim.data["Specifics Name"],
+        "Mod Name": sim.data["Mod Name"],
+        "Performance Save File Name": sim.data["Performance Save File Name"],
+        "Trajectory Save File Name": sim.data["Trajectory Save File Name"],
+        "Catalog Row": getTrialCatalogRow(sim.data),
+    })
+
+def loadManifest(manifestFileName):
+    """
+    Returns the list of manifest entries, ignoring an incomplete last line
+    """
+    entryCol = []
+    if not os.path.exists(manifestFileName):
+        return entryCol
+    with open(manifestFileName) as manifestFile:
+        for line in manifestFile:
+            try:
+                entryCol.append(json.loads(line))
+            except ValueError:
+                pass
+    return entryCol
+
+def appendManifestEntry(manifestFileName, entry):
+    if not os.path.exists(os.path.dirname(manifestFileName)):
+        try:
+            os.makedirs(os.path.dirname(manifestFileName))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+
+    with open(manifestFileName, 'a') as manifestFile:
+        manifestFile.write(json.dumps(entry) + "\n")
+        manifestFile.flush()
+        os.fsync(manifestFile.fileno())
+
+def waitForTrials(runningDict, timeout = None):
+    """
+    Waits until a trial sends its result or exits, or timeout seconds pass.
+        Results are read as soon as they arrive rather than after the trial
+        exits, since a trial sending a result larger than the pipe buffer 
+        only exits once it is read.
+
+    Args:
+        runningDict (dict): process sentinel: [process, config, 
+            receiveConnection, result] for each running trial, result is 
+            None until it is received
+        timeout (float, None): seconds to wait, None to wait without a limit
+
+    Returns:
+        list: (process, config, result) of each joined trial, removed from 
+            runningDict; result is None if the trial sent none
+    """
+    connectionDict = {trial[2]: sentinel for sentinel, trial in runningDict.items()
+        if not trial[2].closed}
+    readyCol = multiprocessing.connection.wait(
+        list(connectionDict) + list(runningDict), timeout = timeout)
+    for ready in readyCol:
+        if ready in connectionDict:
+            receiveTrialResult(runningDict[connectionDict[ready]])
+            
+    exitedCol = []
+    for ready in readyCol:
+        if ready in runningDict:
+            trial = runningDict.pop(ready)
+            if not trial[2].closed:
+                receiveTrialResult(trial)
+            process, config, receiveConnection, result = trial
+            process.join()
+            exitedCol.append((process, config, result))
+    return exitedCol
+
+def receiveTrialResult(trial):
+    """
+    Receives the result of a runningDict entry of waitForTrials() if one 
+        was sent, then closes its connection
+    """
+    receiveConnection = trial[2]
+    try:
+        if receiveConnection.poll():
+            trial[3] = receiveConnection.recv()
+    except EOFError: # The trial exited before sending its result
+        pass
+    receiveConnection.close()
+
+def runSweep(sweepGrid, manifestFileName, processCount = None, quiet = True):
+    """
+    Runs the trials of the sweep grid that are not finished in the manifest,
+        with at most processCount (default: number of cpus) trials at a time.
+        Failed trials are recorded and run again by the next runSweep().
+
+    Args:
+        sweepGrid (dict): see module docstring
+        manifestFileName (str): file that records finished trials
+        processCount (int, None): maximum number of trials run at once
+        quiet (bool): if True, hide the trials' printing
+
+    Returns:
+        list: manifest entries of the trials finished by this call
+    """
+    if processCount is None:
+        processCount = os.cpu_count()
+    finishedNameSet = set(
+        entry["Trial Name"] for entry in loadManifest(manifestFileName)
+        if entry["Status"] == "Finished"
+    )
+    configCol = getSweepConfigCol(sweepGrid)
+    pendingConfigCol = [
+        config for config in configCol
+        if config["Trial Name"] not in finishedNameSet
+    ]
+    print("Sweep: %d of %d trials to run"%(len(pendingConfigCol), len(configCol)))
+
+    # Trials are not daemonic processes so they may start their own workers
+    context = multiprocessing.get_context("fork")
+    runningDict = {}
+    finishedEntryCol = []
+    try:
+        while pendingConfigCol or runningDict:
+            while pendingConfigCol and len(runningDict) < processCount:
+                config = pendingConfigCol.pop(0)
+                receiveConnection, sendConnection = context.Pipe(duplex = False)
+                process = context.Process(target = runSweepTrial,
+                    args = (config, sendConnection, quiet))
+                process.start()
+                sendConnection.close()
+                runningDict[process.sentinel] = [process, config, receiveConnection, None]
+
+            for process, config, entry in waitForTrials(runningDict):
+                if process.exitcode != 0 or entry is None:
+                    entry = {
+                        "Trial Name": config["Trial Name"],
+                        "Status": "Failed",
+                        "Exit Code": process.exitcode,
+                        "Config": config
+                    }
+                else:
+                    finishedEntryCol.append(entry)
+                appendManifestEntry(manifestFileName, entry)
+                print("Sweep: %s %s"%(entry["Trial Name"], entry["Status"].lower()))
+    finally:
+        for process, config, receiveConnection, entry in runningDict.values():
+            process.terminate()
+            process.join()
+
+    return finishedEntryCol
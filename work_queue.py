@@ -0,0 +1,304 @@
+"""
+Runs sweep trials (see sweep.py) from job files in a directory shared by
+several machines (e.g. over NFS), without a coordinating process.
+
+The queue directory holds one JSON job file per trial configuration, in
+    pending/   waiting to be run
+    running/   claimed by a worker
+    finished/  done, with the trial's manifest entry (see sweep.py)
+    failed/    the trial raised an error or exited abnormally
+
+submitSweepJobs() writes a pending job for every trial of a sweep grid that
+is not already queued. Workers (runWorker(), on any number of machines and
+processes) claim a job by renaming it from pending/ to running/; renaming is
+atomic, so only one worker gets each job. While a trial runs, its worker
+touches the running job file every heartbeat period. A running job whose
+file has not been touched for the stale timeout (its worker died or lost the
+shared directory) is renamed back to pending/ by any worker and run again.
+Machines should keep their clocks synchronized (e.g. with NTP) to well
+within the stale timeout.
+
+SQLite must not be shared over a network file system, so workers register
+their trials in a results catalog on local disk (see 
+getWorkerCatalogFileName()) instead of getSim()'s; each finished job keeps 
+its trial's catalog row, and importFinishedJobs() adds these rows to a 
+central catalog.
+
+Usage:
+    python work_queue.py submit [queue directory]
+        queue the trials of run.py's sweepGrid (default directory log/queue)
+    python work_queue.py work [queue directory] [process count]
+        run queued trials until the queue is empty
+    python work_queue.py catalog [queue directory] [catalog file]
+        add the finished trials to a results catalog on local disk (default
+        log/results_catalog.sqlite)
+"""
+import errno
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+import traceback
+from sweep import getSweepConfigCol, runSweepTrial, waitForTrials
+from code.results_catalog import importTrialRows
+
+jobStateCol = ("pending", "running", "finished", "failed")
+
+def getJobFileName(queueDirectory, jobState, trialName):
+    return os.path.join(queueDirectory, jobState, trialName + ".json")
+
+def makeQueueDirectories(queueDirectory):
+    for jobState in jobStateCol:
+        try:
+            os.makedirs(os.path.join(queueDirectory, jobState))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+
+def writeJobFile(jobFileName, job):
+    """
+    Writes a job file so that other machines never see it half written
+    """
+    temporaryFileName = "%s.%s.%d.tmp"%(jobFileName, socket.gethostname(), os.getpid())
+    with open(temporaryFileName, 'w') as jobFile:
+        json.dump(job, jobFile)
+        jobFile.flush()
+        os.fsync(jobFile.fileno())
+    os.rename(temporaryFileName, jobFileName)
+
+def readJobFile(jobFileName):
+    with open(jobFileName) as jobFile:
+        return json.load(jobFile)
+
+def getJobNameCol(queueDirectory, jobState):
+    """
+    Returns the sorted trial names of the jobs in a state
+    """
+    return sorted(
+        fileName[:-len(".json")]
+        for fileName in os.listdir(os.path.join(queueDirectory, jobState))
+        if fileName.endswith(".json")
+    )
+
+def submitSweepJobs(sweepGrid, queueDirectory):
+    """
+    Adds a pending job for each trial of the sweep grid that is not pending,
+        running or finished yet. Failed trials are queued again.
+
+    Returns:
+        int: number of jobs added
+    """
+    makeQueueDirectories(queueDirectory)
+    queuedNameSet = set()
+    for jobState in ("pending", "running", "finished"):
+        queuedNameSet.update(getJobNameCol(queueDirectory, jobState))
+
+    jobCount = 0
+    for config in getSweepConfigCol(sweepGrid):
+        trialName = config["Trial Name"]
+        if trialName in queuedNameSet:
+            continue
+        writeJobFile(getJobFileName(queueDirectory, "pending", trialName),
+            {"Trial Name": trialName, "Config": config, "Attempts": 0})
+        failedFileName = getJobFileName(queueDirectory, "failed", trialName)
+        if os.path.exists(failedFileName):
+            os.remove(failedFileName)
+        jobCount += 1
+    return jobCount
+
+def claimJob(queueDirectory):
+    """
+    Claims a pending job
+
+    Returns:
+        dict, None: the job, or None if there are no pending jobs
+    """
+    for trialName in getJobNameCol(queueDirectory, "pending"):
+        pendingFileName = getJobFileName(queueDirectory, "pending", trialName)
+        runningFileName = getJobFileName(queueDirectory, "running", trialName)
+        try:
+            # Touch first, the rename keeps the time, so the claimed job is
+            # never stale
+            os.utime(pendingFileName)
+            os.rename(pendingFileName, runningFileName)
+        except FileNotFoundError: # Another worker claimed it first
+            continue
+        try:
+            return readJobFile(runningFileName)
+        except (FileNotFoundError, ValueError):
+            continue
+    return None
+
+def touchJob(queueDirectory, trialName):
+    """
+    Heartbeat of a running job
+
+    Returns:
+        bool: False if the job is no longer running (it was reclaimed)
+    """
+    try:
+        os.utime(getJobFileName(queueDirectory, "running", trialName))
+        return True
+    except FileNotFoundError:
+        return False
+
+def reclaimStaleJobs(queueDirectory, staleTimeout):
+    """
+    Moves running jobs that have not had a heartbeat for staleTimeout seconds
+        back to pending
+
+    Returns:
+        list: trial names of the reclaimed jobs
+    """
+    reclaimedNameCol = []
+    for trialName in getJobNameCol(queueDirectory, "running"):
+        runningFileName = getJobFileName(queueDirectory, "running", trialName)
+        try:
+            if time.time() - os.stat(runningFileName).st_mtime < staleTimeout:
+                continue
+            os.rename(runningFileName, getJobFileName(queueDirectory, "pending", trialName))
+        except FileNotFoundError: # Finished or reclaimed meanwhile
+            continue
+        reclaimedNameCol.append(trialName)
+    return reclaimedNameCol
+
+def finishJob(queueDirectory, job, jobState, result):
+    """
+    Records the result of a job in finished/ or failed/ and removes it from
+        running/. A job that was reclaimed while it ran is still recorded;
+        if it finished twice, the first result is kept.
+    """
+    job = dict(job)
+    job["Attempts"] += 1
+    job["Result"] = result
+    jobFileName = getJobFileName(queueDirectory, jobState, job["Trial Name"])
+    if not (jobState == "finished" and os.path.exists(jobFileName)):
+        writeJobFile(jobFileName, job)
+    try:
+        os.remove(getJobFileName(queueDirectory, "running", job["Trial Name"]))
+    except FileNotFoundError:
+        pass
+
+def getWorkerCatalogFileName():
+    """
+    Returns the results catalog of the trials run on this machine, in its 
+        local temporary directory
+    """
+    return os.path.join(tempfile.gettempdir(), "rover_domain", 
+        "results_catalog %s.sqlite"%socket.gethostname())
+
+def importFinishedJobs(queueDirectory, catalogFileName):
+    """
+    Adds the catalog rows of the finished jobs to a results catalog, skipping
+        trials that are already in it
+
+    Returns:
+        int: number of trials added
+    """
+    rowCol = []
+    for trialName in getJobNameCol(queueDirectory, "finished"):
+        job = readJobFile(getJobFileName(queueDirectory, "finished", trialName))
+        rowCol.append(job["Result"].get("Catalog Row"))
+    return importTrialRows(catalogFileName, rowCol)
+
+def runJobTrial(config, resultConnection, quiet, catalogFileName):
+    """
+    Runs a trial in a worker's child process, sends the traceback on errors
+    """
+    try:
+        runSweepTrial(config, resultConnection, quiet, catalogFileName)
+    except BaseException:
+        resultConnection.send({"Status": "Failed", "Error": traceback.format_exc()})
+        raise
+
+def runWorker(queueDirectory, processCount = 1, heartbeatPeriod = 30.0,
+        staleTimeout = 300.0, quiet = True, catalogFileName = None):
+    """
+    Runs queued jobs, at most processCount at a time, until no jobs are
+        pending or running in the queue
+
+    Args:
+        queueDirectory (str): shared queue directory
+        processCount (int): maximum number of trials this worker runs at once
+        heartbeatPeriod (float): seconds between heartbeats of running jobs
+        staleTimeout (float): seconds without a heartbeat after which any
+            worker reclaims a running job, much longer than heartbeatPeriod
+        quiet (bool): if True, hide the trials' printing
+        catalogFileName (str, None): results catalog on local disk to 
+            register the trials in (default: getWorkerCatalogFileName())
+
+    Returns:
+        int: number of jobs finished by this worker
+    """
+    if catalogFileName is None:
+        catalogFileName = getWorkerCatalogFileName()
+    makeQueueDirectories(queueDirectory)
+    workerName = "%s:%d"%(socket.gethostname(), os.getpid())
+    context = multiprocessing.get_context("fork")
+    runningDict = {}
+    finishedCount = 0
+    try:
+        while True:
+            for trialName in reclaimStaleJobs(queueDirectory, staleTimeout):
+                print("Worker %s: reclaimed stale job %s"%(workerName, trialName))
+
+            while len(runningDict) < processCount:
+                job = claimJob(queueDirectory)
+                if job is None:
+                    break
+                receiveConnection, sendConnection = context.Pipe(duplex = False)
+                process = context.Process(target = runJobTrial,
+                    args = (job["Config"], sendConnection, quiet, catalogFileName))
+                process.start()
+                sendConnection.close()
+                runningDict[process.sentinel] = [process, job, receiveConnection, None]
+                print("Worker %s: running %s"%(workerName, job["Trial Name"]))
+
+            if not runningDict:
+                # Wait for jobs of other workers that may still be reclaimed
+                if not getJobNameCol(queueDirectory, "running"):
+                    break
+                time.sleep(min(heartbeatPeriod, staleTimeout))
+                continue
+
+            for process, job, result in waitForTrials(runningDict,
+                    timeout = heartbeatPeriod):
+                if process.exitcode != 0 or result is None or result["Status"] != "Finished":
+                    if result is None:
+                        result = {"Status": "Failed"}
+                    result["Exit Code"] = process.exitcode
+                    jobState = "failed"
+                else:
+                    finishedCount += 1
+                    jobState = "finished"
+                result["Worker"] = workerName
+                finishJob(queueDirectory, job, jobState, result)
+                print("Worker %s: %s %s"%(workerName, job["Trial Name"], jobState))
+
+            for process, job, receiveConnection, result in runningDict.values():
+                touchJob(queueDirectory, job["Trial Name"])
+    finally:
+        # Jobs of an interrupted worker are left running and reclaimed later
+        for process, job, receiveConnection, result in runningDict.values():
+            process.terminate()
+            process.join()
+
+    return finishedCount
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("submit", "work", "catalog"):
+        print(__doc__)
+        sys.exit(1)
+    queueDirectory = sys.argv[2] if len(sys.argv) > 2 else "log/queue"
+    if sys.argv[1] == "submit":
+        from run import sweepGrid
+        print("Queued %d jobs"%submitSweepJobs(sweepGrid, queueDirectory))
+    elif sys.argv[1] == "catalog":
+        catalogFileName = sys.argv[3] if len(sys.argv) > 3 else "log/results_catalog.sqlite"
+        print("Cataloged %d trials"%importFinishedJobs(queueDirectory, catalogFileName))
+    else:
+        processCount = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+        print("Finished %d jobs"%runWorker(queueDirectory, processCount))